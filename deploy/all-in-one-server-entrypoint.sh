@@ -2,40 +2,19 @@
 # server-entrypoint.sh
 # 2025-08-22 | CR
 
-install_all_dependencies() {
-    set -e
-    echo "Installing all dependencies (not from individual requirements files)"
-    echo ""
-
-    pip install --no-cache-dir --upgrade \
-        "fastapi>=0.116.1,<0.117.0" \
-        "transformers>=4.55.3,<5.0.0" \
-        "uvicorn>=0.35.0,<0.36.0" \
-        "python-multipart>=0.0.20,<0.0.21" \
-        "torch>=2.8.0,<3.0.0" \
-        "litellm>=1.75.9,<2.0.0" \
-        "safetensors>=0.6.2,<0.7.0" \
-        "peft>=0.17.1,<0.18.0" \
-        "fastmcp>=2.11.3,<3.0.0"
-
-    echo ""
-    echo "All dependencies installed"
-    echo ""
-}
-
-install_server_dependencies() {
-    cd /code
-    pip install --upgrade pip
-    pip install --no-cache-dir --upgrade -r /code/requirements.txt
-}
-
-install_mcp_server_dependencies() {
-    cd /code/mcp-server
-    pip install --no-cache-dir --upgrade -r /code/mcp-server/requirements.txt
+run_server() {
+    # Preloaded pre-fork workers (see gunicorn.conf.py), or a single
+    # reloading uvicorn process with SERVER_RELOAD=1
+    if [ "$SERVER_RELOAD" = "1" ]; then
+        cd /code && uvicorn api.main:app --host 0.0.0.0 --port 8000 --reload --reload-dir /code/api --env-file /code/.env
+    else
+        cd /code && gunicorn -c /code/gunicorn.conf.py api.main:app
+    fi
 }
 
-run_server() {
-    cd /code && uvicorn api.main:app --host 0.0.0.0 --port 8000 --env-file /code/.env
+run_batch_worker() {
+    # The batch jobs run in their own process, apart from the API workers
+    cd /code && python -m api.batch_worker
 }
 
 run_mcp_server() {
@@ -55,8 +34,6 @@ load_envs() {
 
 load_envs
 
-# install_server_dependencies
-# install_mcp_server_dependencies
-install_all_dependencies
+# The dependencies are installed when the image is built (deploy/Dockerfile)
 
-run_server & run_mcp_server & wait
+run_server & run_batch_worker & run_mcp_server & wait
@@ -1,10 +1,24 @@
 #!/bin/bash
 # server-entrypoint.sh
 # 2025-08-22 | CR
-
-cd /code/api
-pip install --upgrade pip
-pip install --no-cache-dir --upgrade -r /code/requirements.txt
+#
+# The dependencies are installed when the image is built, not here.
+# SERVER_RELOAD=1 runs a single uvicorn process that reloads on code
+# changes (development). Otherwise the API is served by gunicorn with
+# preloaded pre-fork workers (see gunicorn.conf.py). The batch jobs are
+# processed by the batch worker process (api.batch_worker).
 
 cd /code
-uvicorn api.main:app --host 0.0.0.0 --port 8000 --reload --reload-dir /code --env-file /code/.env
+
+if [ -f /code/.env ]; then
+    set -o allexport; . /code/.env; set +o allexport
+fi
+
+# The batch jobs run in their own process, apart from the API workers
+python -m api.batch_worker &
+
+if [ "$SERVER_RELOAD" = "1" ]; then
+    exec uvicorn api.main:app --host 0.0.0.0 --port 8000 --reload --reload-dir /code --env-file /code/.env
+fi
+
+exec gunicorn -c /code/gunicorn.conf.py api.main:app
@@ -6,7 +6,7 @@ Based on the AbstractGo's server/api/main.py
 """
 import os
 import json
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 
 # For MCP Server
 from fastmcp import FastMCP
@@ -26,14 +26,24 @@ from lib.api.endpoint_methods import (
     dashboard_distribution_tool,
     dashboard_analytics_tool,
     dashboard_classification_history_tool,
+    dashboard_runtime_tool,
+    feedback_tool,
+    batch_job_submit_tool,
+    batch_job_status_tool,
+    batch_job_cancel_tool,
+    batch_job_items_tool,
+    model_registry_status_tool,
+    adapters_tool,
+    similar_tool,
 )
 
 from lib.api.utilities import (
     get_standard_response,
     log_info,
     get_non_empty_value,
+    json_dumps,
 )
-from lib.api.types import Article
+from lib.api.types import Article, Feedback
 
 
 class MCPServerApp:
@@ -62,6 +72,9 @@ except ValueError:
     raise ValueError("MCP_SERVER_PORT must be an integer.")
 
 DEFAULT_JSON_INDENT = 2
+# Pretty-print the JSON results (compact by default, which is smaller and
+# faster to produce)
+MCP_PRETTY_JSON = get_non_empty_value("MCP_PRETTY_JSON", "0") == "1"
 
 
 # Initialize FastMCP server
@@ -90,15 +103,24 @@ def tool_result(result: str, other_data: dict = None) -> Dict[str, Any]:
     }
 
 
+def to_json(data) -> str:
+    """
+    Serialize the result to JSON (pretty-printed if MCP_PRETTY_JSON=1)
+    """
+    if MCP_PRETTY_JSON:
+        return json.dumps(data, indent=DEFAULT_JSON_INDENT)
+    return json_dumps(data).decode("utf-8")
+
+
 def resource_result(result: str, mime_type: str = "text/plain") -> str:
     """
     Helper function to format resource results
     """
     if result["error"]:
-        return json.dumps(result, indent=DEFAULT_JSON_INDENT)
+        return to_json(result)
     if mime_type == "application/json":
         return result["resultset"]
-    return json.dumps(result["resultset"], indent=DEFAULT_JSON_INDENT)
+    return to_json(result["resultset"])
 
 
 def mcp_authenticate(
@@ -175,7 +197,8 @@ async def mcp_training_metrics() -> Dict[str, Any]:
 @mcp.tool()
 async def mcp_predict(
     title: str,
-    abstract: str
+    abstract: str,
+    adapter: Optional[str] = None,
 ) -> Dict[str, Any]:
     """
     Predict categories for a biomedical article
@@ -183,10 +206,43 @@ async def mcp_predict(
     Args:
         title: The title of the article
         abstract: The abstract of the article
+        adapter: PEFT adapter to classify it with (see mcp_adapters)
     """
     log_info("Making prediction")
     article = Article(title=title, abstract=abstract)
-    result = predict_tool(article)
+    result = predict_tool(article, source="mcp", adapter=adapter)
+    return result
+
+
+@mcp.tool()
+async def mcp_adapters() -> Dict[str, Any]:
+    """
+    Get the PEFT adapters served on the shared base model (available,
+    loaded, memory sizes and batching counters)
+    """
+    log_info("Getting adapters")
+    result = adapters_tool()
+    return result
+
+
+@mcp.tool()
+async def mcp_similar(
+    title: str,
+    abstract: str,
+    k: int = 10,
+) -> Dict[str, Any]:
+    """
+    Get the k previously classified articles most similar to an article
+    (an article not classified yet is classified first)
+
+    Args:
+        title: The title of the article
+        abstract: The abstract of the article
+        k: Number of similar articles
+    """
+    log_info("Searching similar articles")
+    article = Article(title=title, abstract=abstract)
+    result = similar_tool(article, k, source="mcp")
     return result
 
 
@@ -205,7 +261,113 @@ async def mcp_pdfread(
     log_info("Reading file content")
     import base64
     raw_bytes = base64.b64decode(file_content)
-    result = pdfread_tool(raw_bytes, file_name)
+    result = pdfread_tool(raw_bytes, file_name, source="mcp")
+    return result
+
+
+@mcp.tool()
+async def mcp_dashboard_runtime() -> Dict[str, Any]:
+    """
+    Get the runtime gauges of the server process (single-flight
+    coalescing counters)
+    """
+    log_info("Getting dashboard runtime gauges")
+    result = dashboard_runtime_tool()
+    return result
+
+
+@mcp.tool()
+async def mcp_model_registry_status() -> Dict[str, Any]:
+    """
+    Get the served model versions, the active one and the shadow
+    evaluation results (agreement with the active model, latency)
+    """
+    log_info("Getting model registry status")
+    result = model_registry_status_tool()
+    return result
+
+
+@mcp.tool()
+async def mcp_feedback(
+    prediction_id: int,
+    category: str
+) -> Dict[str, Any]:
+    """
+    Confirm or correct the category of a classified article
+
+    Args:
+        prediction_id: The id of the classification history item
+        category: The right category
+    """
+    log_info("Recording feedback")
+    feedback = Feedback(prediction_id=prediction_id, category=category)
+    result = feedback_tool(feedback)
+    return result
+
+
+@mcp.tool()
+async def mcp_batch_job_submit(
+    file_content: str,
+    file_name: str
+) -> Dict[str, Any]:
+    """
+    Submit a batch classification job
+
+    Args:
+        file_content: Base64 encoded file content: a CSV (title and
+            abstract columns) or NDJSON list of articles, or an article
+            file (PDF, ...)
+        file_name: Name of the file
+    """
+    log_info("Submitting batch job")
+    import base64
+    raw_bytes = base64.b64decode(file_content)
+    result = batch_job_submit_tool([(file_name, raw_bytes)], source="mcp")
+    return result
+
+
+@mcp.tool()
+async def mcp_batch_job_status(job_id: str) -> Dict[str, Any]:
+    """
+    Get the status, progress, throughput and ETA of a batch job
+
+    Args:
+        job_id: The batch job id
+    """
+    log_info("Getting batch job status")
+    result = batch_job_status_tool(job_id)
+    return result
+
+
+@mcp.tool()
+async def mcp_batch_job_cancel(job_id: str) -> Dict[str, Any]:
+    """
+    Cancel a batch job
+
+    Args:
+        job_id: The batch job id
+    """
+    log_info("Cancelling batch job")
+    result = batch_job_cancel_tool(job_id)
+    return result
+
+
+@mcp.tool()
+async def mcp_batch_job_results(
+    job_id: str,
+    offset: int = 0,
+    limit: int = 100
+) -> Dict[str, Any]:
+    """
+    Get the results of a batch job (processed articles, in input order)
+
+    Args:
+        job_id: The batch job id
+        offset: Index of the first article
+        limit: Maximum number of articles (up to 500)
+    """
+    log_info("Getting batch job results")
+    result = batch_job_items_tool(job_id, offset, limit)
     return result
 
 
@@ -253,22 +415,36 @@ async def mcp_dashboard_metrics() -> Dict[str, Any]:
 
 
 @mcp.tool()
-async def mcp_dashboard_confusion_matrix() -> Dict[str, Any]:
+async def mcp_dashboard_confusion_matrix(
+    source: str = "training",
+    window_days: Optional[int] = None,
+) -> Dict[str, Any]:
     """
     Get dashboard confusion matrix
+
+    Args:
+        source: "training" or "feedback" (from the reviewers' feedback)
+        window_days: With source "feedback", only the last N days
     """
     log_info("Getting dashboard confusion matrix")
-    result = dashboard_confusion_matrix_tool()
+    result = dashboard_confusion_matrix_tool(source, window_days)
     return result
 
 
 @mcp.tool()
-async def mcp_dashboard_performance() -> Dict[str, Any]:
+async def mcp_dashboard_performance(
+    source: str = "training",
+    window_days: Optional[int] = None,
+) -> Dict[str, Any]:
     """
     Get dashboard performance metrics
+
+    Args:
+        source: "training" or "feedback" (from the reviewers' feedback)
+        window_days: With source "feedback", only the last N days
     """
     log_info("Getting dashboard performance")
-    result = dashboard_performance_tool()
+    result = dashboard_performance_tool(source, window_days)
     return result
 
 
@@ -293,12 +469,44 @@ async def mcp_dashboard_analytics() -> Dict[str, Any]:
 
 
 @mcp.tool()
-async def mcp_dashboard_classification_history() -> Dict[str, Any]:
+async def mcp_dashboard_classification_history(
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    category: Optional[str] = None,
+    status: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    min_confidence: Optional[float] = None,
+    max_confidence: Optional[float] = None,
+    fields: Optional[str] = None,
+) -> Dict[str, Any]:
     """
-    Get dashboard classification history
+    Get dashboard classification history (newest first, one page at a time)
+
+    Args:
+        limit: Page size
+        cursor: The "next_cursor" of the previous page
+        category: Filter by category
+        status: Filter by status (success, error, pending)
+        date_from: Filter from this ISO 8601 date
+        date_to: Filter up to this ISO 8601 date
+        min_confidence: Filter by minimum confidence
+        max_confidence: Filter by maximum confidence
+        fields: Comma separated fields to return (abstract is left out by
+            default)
     """
     log_info("Getting dashboard classification history")
-    result = dashboard_classification_history_tool()
+    result = dashboard_classification_history_tool(
+        limit=limit,
+        cursor=cursor,
+        category=category,
+        status=status,
+        date_from=date_from,
+        date_to=date_to,
+        min_confidence=min_confidence,
+        max_confidence=max_confidence,
+        fields=fields,
+    )
     return result
 
 
@@ -327,7 +535,7 @@ async def root_resource() -> str:
     """
     log_info("Getting root endpoint as resource")
     result = read_root_tool()
-    return json.dumps(result, indent=DEFAULT_JSON_INDENT)
+    return to_json(result)
 
 
 @mcp.resource("api://training-metrics",
@@ -338,7 +546,7 @@ async def training_metrics_resource() -> str:
     """
     log_info("Getting training metrics as resource")
     result = training_metrics_tool()
-    return json.dumps(result, indent=DEFAULT_JSON_INDENT)
+    return to_json(result)
 
 
 @mcp.resource("api://health",
@@ -349,7 +557,7 @@ async def health_resource() -> str:
     """
     log_info("Getting health status as resource")
     result = health_tool()
-    return json.dumps(result, indent=DEFAULT_JSON_INDENT)
+    return to_json(result)
 
 
 @mcp.resource("api://ai-model-params",
@@ -360,7 +568,7 @@ async def ai_model_params_resource() -> str:
     """
     log_info("Getting AI model parameters as resource")
     result = ai_model_params_tool()
-    return json.dumps(result, indent=DEFAULT_JSON_INDENT)
+    return to_json(result)
 
 
 @mcp.resource("dashboard://metrics",
@@ -371,7 +579,7 @@ async def dashboard_metrics_resource() -> str:
     """
     log_info("Getting dashboard metrics as resource")
     result = dashboard_metrics_tool()
-    return json.dumps(result, indent=DEFAULT_JSON_INDENT)
+    return to_json(result)
 
 
 @mcp.resource("dashboard://confusion-matrix",
@@ -382,7 +590,7 @@ async def dashboard_confusion_matrix_resource() -> str:
     """
     log_info("Getting dashboard confusion matrix as resource")
     result = dashboard_confusion_matrix_tool()
-    return json.dumps(result, indent=DEFAULT_JSON_INDENT)
+    return to_json(result)
 
 
 @mcp.resource("dashboard://performance",
@@ -393,7 +601,7 @@ async def dashboard_performance_resource() -> str:
     """
     log_info("Getting dashboard performance as resource")
     result = dashboard_performance_tool()
-    return json.dumps(result, indent=DEFAULT_JSON_INDENT)
+    return to_json(result)
 
 
 @mcp.resource("dashboard://distribution",
@@ -404,7 +612,7 @@ async def dashboard_distribution_resource() -> str:
     """
     log_info("Getting dashboard distribution as resource")
     result = dashboard_distribution_tool()
-    return json.dumps(result, indent=DEFAULT_JSON_INDENT)
+    return to_json(result)
 
 
 @mcp.resource("dashboard://analytics",
@@ -415,7 +623,7 @@ async def dashboard_analytics_resource() -> str:
     """
     log_info("Getting dashboard analytics as resource")
     result = dashboard_analytics_tool()
-    return json.dumps(result, indent=DEFAULT_JSON_INDENT)
+    return to_json(result)
 
 
 @mcp.resource("dashboard://classification-history",
@@ -426,7 +634,7 @@ async def dashboard_classification_history_resource() -> str:
     """
     log_info("Getting dashboard classification history as resource")
     result = dashboard_classification_history_tool()
-    return json.dumps(result, indent=DEFAULT_JSON_INDENT)
+    return to_json(result)
 
 
 # ============================================================================
@@ -483,5 +691,5 @@ def main():
         mcp.run()
 
 
-# if __name__ == "__main__":
-main()
+if __name__ == "__main__":
+    main()
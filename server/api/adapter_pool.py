@@ -0,0 +1,319 @@
+import json
+import os
+import queue
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from .ml_models import DEFAULT_LABELS, get_prediction_response
+from .rate_limit import parse_pairs
+from .startup_profile import startup_phase
+from .utilities import get_non_empty_value, log_info
+
+DEFAULT_ADAPTER_DIR = "/code/saved_models/adapters"
+ADAPTER_LABELS_FILE = "labels.json"
+ADAPTER_NAME_PATTERN = re.compile(r"^[A-Za-z0-9][A-Za-z0-9._-]{0,63}$")
+
+
+class AdapterRequest:
+    def __init__(self, text: str, adapter: str):
+        self.text = text
+        self.adapter = adapter
+        self.done = threading.Event()
+        self.result = None
+        self.exception = None
+
+
+class AdapterPool:
+    """
+    Serve many PEFT (LoRA) adapters on one shared base model.
+
+    Only the base model is loaded in full: each adapter adds its LoRA
+    matrices and its classification head. At most ADAPTER_MAX_LOADED
+    adapters are kept loaded, the least recently used one is evicted to
+    load another.
+
+    The predictions are run by a single background thread, which takes
+    the queued requests in batches (up to ADAPTER_MAX_BATCH_SIZE, waiting
+    at most ADAPTER_BATCH_WAIT seconds for them) and predicts each batch
+    in one forward pass, even if the requests are for different adapters.
+    """
+
+    def __init__(self):
+        self.debug = os.environ.get("SERVER_DEBUG", "0") == "1"
+        self.base_model_name = get_non_empty_value(
+            "ADAPTER_BASE_MODEL",
+            get_non_empty_value("BASE_MODEL_NAME", "dmis-lab/biobert-v1.1"))
+        self.adapter_dir = get_non_empty_value("ADAPTER_DIR",
+                                               DEFAULT_ADAPTER_DIR)
+        self.max_loaded = max(1, int(get_non_empty_value(
+            "ADAPTER_MAX_LOADED", "8")))
+        self.max_batch_size = int(get_non_empty_value(
+            "ADAPTER_MAX_BATCH_SIZE", "16"))
+        self.batch_wait = float(get_non_empty_value(
+            "ADAPTER_BATCH_WAIT", "0.005"))
+        self.queue = queue.Queue()
+        self.tokenizer = None
+        self.model = None
+        self.base_size = 0
+        # Loaded adapters (name -> info), least recently used first
+        self.loaded = OrderedDict()
+        self.lock = threading.Lock()
+        self.thread = None
+        self.requests = 0
+        self.batches = 0
+        self.mixed_batches = 0
+        self.loads = 0
+        self.evictions = 0
+
+    def get_adapter_paths(self) -> dict:
+        """
+        Get the available adapters (name -> directory or hub name): the
+        ADAPTER_DIR subdirectories, and the ADAPTERS ("name=path,...")
+        environment variable.
+        """
+        adapter_paths = {}
+        if os.path.isdir(self.adapter_dir):
+            for name in sorted(os.listdir(self.adapter_dir)):
+                path = os.path.join(self.adapter_dir, name)
+                if os.path.isfile(os.path.join(path, "adapter_config.json")):
+                    adapter_paths[name] = path
+        adapter_paths.update(parse_pairs(os.environ.get("ADAPTERS")))
+        return {
+            name: path for name, path in adapter_paths.items()
+            if ADAPTER_NAME_PATTERN.match(name)
+        }
+
+    def predict(self, text: str, adapter: str) -> dict:
+        """
+        Predict a text with an adapter. Returns a response like
+        `MLModels.predict_infer()`, with the adapter labels.
+        """
+        if adapter not in self.get_adapter_paths():
+            raise LookupError(f"Adapter not found: {adapter}")
+        self.start()
+        request = AdapterRequest(text, adapter)
+        self.queue.put(request)
+        request.done.wait()
+        if request.exception is not None:
+            raise request.exception
+        return request.result
+
+    def start(self):
+        with self.lock:
+            if self.thread is not None:
+                return
+            self.thread = threading.Thread(
+                target=self.run, name="adapter-pool", daemon=True)
+            self.thread.start()
+
+    # --------- Background thread ---------
+
+    def get_batch(self) -> list:
+        """
+        Wait for the first queued request, then take the others that
+        arrive within the batch wait, up to the batch size.
+        """
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.batch_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            try:
+                batch.append(self.queue.get(timeout=timeout)
+                             if timeout > 0 else self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def run(self):
+        while True:
+            batch = self.get_batch()
+            try:
+                self.predict_batch(batch)
+            except Exception as e:
+                for request in batch:
+                    request.exception = e
+            for request in batch:
+                request.done.set()
+
+    def load_base(self):
+        from transformers import (
+            AutoModelForSequenceClassification,
+            AutoTokenizer,
+        )
+        with startup_phase("adapter_base_load"):
+            self.tokenizer = AutoTokenizer.from_pretrained(
+                self.base_model_name)
+            self.model = AutoModelForSequenceClassification.from_pretrained(
+                self.base_model_name,
+                num_labels=len(DEFAULT_LABELS)).eval()
+        self.base_size = sum(parameter.numel() * parameter.element_size()
+                             for parameter in self.model.parameters())
+        log_info(f"Adapter base model {self.base_model_name} loaded")
+
+    def get_adapter_size(self, name: str) -> int:
+        return sum(
+            parameter.numel() * parameter.element_size()
+            for parameter_name, parameter in self.model.named_parameters()
+            if f".{name}." in parameter_name
+        )
+
+    def load_adapter(self, name: str, needed: set):
+        """
+        Load an adapter, then evict the least recently used ones not
+        `needed` by the current batch if the pool is over its size.
+        """
+        from peft import PeftModel
+
+        path = self.get_adapter_paths()[name]
+        start_time = time.perf_counter()
+        if not isinstance(self.model, PeftModel):
+            self.model = PeftModel.from_pretrained(
+                self.model, path, adapter_name=name).eval()
+        else:
+            try:
+                self.model.load_adapter(path, adapter_name=name)
+            except Exception:
+                # Remove what was injected before the error
+                if name in self.model.peft_config:
+                    self.model.delete_adapter(name)
+                raise
+            # The evicted adapters may include the active one
+            self.model.set_adapter(name)
+            self.model.eval()
+
+        labels = list(DEFAULT_LABELS)
+        labels_path = os.path.join(path, ADAPTER_LABELS_FILE)
+        if os.path.isfile(labels_path):
+            with open(labels_path) as file:
+                labels = json.load(file)
+        with self.lock:
+            self.loaded[name] = {
+                "labels": labels,
+                "size": self.get_adapter_size(name),
+                "load_time": time.perf_counter() - start_time,
+                "loaded_at": time.time(),
+            }
+            self.loads += 1
+
+        # Evicted after the load: PEFT cannot be left without adapters
+        while len(self.loaded) > self.max_loaded:
+            evicted = next(loaded for loaded in self.loaded
+                           if loaded not in needed)
+            self.model.delete_adapter(evicted)
+            with self.lock:
+                del self.loaded[evicted]
+                self.evictions += 1
+            if self.debug:
+                print(f"AdapterPool: {evicted} evicted")
+        log_info(f"Adapter {name} loaded"
+                 f" ({self.loaded[name]['size'] / 1e6:.1f} MB)")
+
+    def predict_batch(self, batch: list):
+        """
+        Predict a batch of requests, in as few forward passes as the
+        number of adapters that can be loaded at the same time allows.
+        """
+        import torch
+
+        if self.model is None:
+            self.load_base()
+
+        # Split the batch so each part needs at most max_loaded adapters
+        # (the loaded ones first, grouped by adapter)
+        parts = [[]]
+        part_adapters = set()
+        for request in sorted(batch, key=lambda item: (
+                item.adapter not in self.loaded, item.adapter)):
+            if request.adapter not in part_adapters and \
+                    len(part_adapters) == self.max_loaded:
+                parts.append([])
+                part_adapters = set()
+            part_adapters.add(request.adapter)
+            parts[-1].append(request)
+
+        for part in parts:
+            needed = {request.adapter for request in part}
+            for name in needed:
+                if name in self.loaded:
+                    with self.lock:
+                        self.loaded.move_to_end(name)
+                    continue
+                try:
+                    self.load_adapter(name, needed)
+                except Exception as e:
+                    log_info(f"Error loading the adapter {name}: {e}")
+                    for request in part:
+                        if request.adapter == name:
+                            request.exception = RuntimeError(
+                                f"Adapter {name} could not be loaded: {e}")
+            part = [request for request in part
+                    if request.exception is None]
+            if not part:
+                continue
+
+            inputs = self.tokenizer([request.text for request in part],
+                                    return_tensors="pt", padding=True,
+                                    truncation=True)
+            with torch.inference_mode():
+                logits = self.model(
+                    **inputs,
+                    adapter_names=[request.adapter for request in part],
+                ).logits
+            predictions = torch.softmax(logits, dim=-1).tolist()
+            for request, predictions_list in zip(part, predictions):
+                request.result = get_prediction_response(
+                    self.loaded[request.adapter]["labels"], predictions_list)
+
+            with self.lock:
+                self.requests += len(part)
+                self.batches += 1
+                self.mixed_batches += len(needed) > 1
+
+    # --------- Status ---------
+
+    def get_status(self) -> dict:
+        """
+        Get the available and loaded adapters (least recently used first),
+        the memory used by the base model and the adapters, and the
+        batching counters.
+        """
+        with self.lock:
+            loaded = [
+                {"name": name, "labels": info["labels"],
+                 "size": info["size"], "load_time": info["load_time"],
+                 "loaded_at": info["loaded_at"]}
+                for name, info in list(self.loaded.items())
+            ]
+            stats = {
+                "requests": self.requests,
+                "batches": self.batches,
+                "mixed_batches": self.mixed_batches,
+                "average_batch_size": self.requests / self.batches
+                if self.batches else None,
+                "loads": self.loads,
+                "evictions": self.evictions,
+            }
+        return {
+            "base_model": self.base_model_name,
+            "base_loaded": self.model is not None,
+            "base_size": self.base_size,
+            "adapters_size": sum(item["size"] for item in loaded),
+            "max_loaded": self.max_loaded,
+            "available": sorted(self.get_adapter_paths()),
+            "loaded": loaded,
+            "stats": stats,
+        }
+
+
+adapter_pool = None
+adapter_pool_lock = threading.Lock()
+
+
+def get_adapter_pool() -> AdapterPool:
+    global adapter_pool
+    with adapter_pool_lock:
+        if adapter_pool is None:
+            adapter_pool = AdapterPool()
+    return adapter_pool
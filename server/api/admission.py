@@ -0,0 +1,228 @@
+import asyncio
+import collections
+import math
+import threading
+import time
+from typing import Optional
+
+from starlette.datastructures import Headers
+
+from .responses import send_error_response
+from .utilities import get_non_empty_value
+
+# Request header with the client time budget, in milliseconds
+DEADLINE_HEADER = "x-request-timeout-ms"
+# Weight of the last request in the service time moving average
+SERVICE_TIME_ALPHA = 0.2
+
+# Route -> (method, environment variables prefix, default concurrency,
+# default queue size)
+ADMISSION_ROUTES = {
+    "/predict": ("POST", "PREDICT", 4, 64),
+    "/similar": ("POST", "SIMILAR", 4, 64),
+    "/pdfread": ("POST", "PDFREAD", 8, 32),
+}
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, status_code: int, message: str, retry_after: int):
+        super().__init__(message)
+        self.status_code = status_code
+        self.message = message
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Concurrency limit with a bounded FIFO queue for one route.
+
+    Up to `max_concurrency` requests run at the same time and up to
+    `max_queue` wait for a slot. A request is rejected right away when
+    the queue is full (429), or when its deadline cannot be met given the
+    queue ahead of it (if any) and the average service time (503), so the
+    accepted requests keep a predictable latency under overload.
+    """
+
+    def __init__(self, name: str, max_concurrency: int, max_queue: int,
+                 default_timeout: float):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.default_timeout = default_timeout
+        self.in_flight = 0
+        self.waiters = collections.deque()
+        self.service_time = None
+        self.admitted = 0
+        self.rejected_queue_full = 0
+        self.rejected_deadline = 0
+
+    def estimate_wait(self, position: int) -> float:
+        """
+        Estimate the seconds until the request at `position` in the queue
+        (0 is the head) gets a slot.
+        """
+        if self.service_time is None:
+            return 0.0
+        return (position // self.max_concurrency + 1) * self.service_time
+
+    def get_retry_after(self) -> int:
+        return max(1, math.ceil(self.estimate_wait(len(self.waiters))))
+
+    async def acquire(self, deadline: Optional[float] = None):
+        """
+        Wait for a slot, until the `deadline` (loop time) or the default
+        timeout. Raises AdmissionRejected if the request is not admitted.
+        """
+        loop = asyncio.get_running_loop()
+        free_slot = self.in_flight < self.max_concurrency \
+            and not self.waiters
+        if not free_slot and len(self.waiters) >= self.max_queue:
+            self.rejected_queue_full += 1
+            raise AdmissionRejected(
+                429, f"Too many {self.name} requests queued",
+                self.get_retry_after())
+        if deadline is None:
+            deadline = loop.time() + self.default_timeout
+        expected_time = self.service_time or 0
+        if not free_slot:
+            expected_time += self.estimate_wait(len(self.waiters))
+        if loop.time() + expected_time > deadline:
+            self.rejected_deadline += 1
+            raise AdmissionRejected(
+                503, f"The {self.name} request deadline cannot be met",
+                self.get_retry_after())
+        if free_slot:
+            self.in_flight += 1
+            self.admitted += 1
+            return
+
+        waiter = loop.create_future()
+        self.waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, max(deadline - loop.time(), 0))
+        except BaseException as e:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed over at the same time: pass it on
+                self.release()
+            else:
+                waiter.cancel()
+                try:
+                    self.waiters.remove(waiter)
+                except ValueError:
+                    pass
+            if isinstance(e, asyncio.TimeoutError):
+                self.rejected_deadline += 1
+                raise AdmissionRejected(
+                    503, f"The {self.name} request timed out in the queue",
+                    self.get_retry_after())
+            raise
+        self.admitted += 1
+
+    def release(self, service_time: float = None):
+        """
+        Free a slot (handing it over to the next queued request), updating
+        the service time average with the request `service_time`.
+        """
+        if service_time is not None:
+            self.service_time = service_time if self.service_time is None \
+                else (SERVICE_TIME_ALPHA * service_time
+                      + (1 - SERVICE_TIME_ALPHA) * self.service_time)
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(True)
+                return
+        self.in_flight -= 1
+
+    def get_stats(self) -> dict:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "in_flight": self.in_flight,
+            "queue_depth": len(self.waiters),
+            "service_time": self.service_time,
+            "admitted": self.admitted,
+            "rejected_queue_full": self.rejected_queue_full,
+            "rejected_deadline": self.rejected_deadline,
+        }
+
+
+class AdmissionMiddleware:
+    """
+    ASGI middleware applying the admission controllers of the inference
+    routes, before the requests take a worker thread.
+
+    Clients can send their time budget in the X-Request-Timeout-Ms
+    header. Rejected requests get a 429 or 503 response with Retry-After.
+    """
+
+    def __init__(self, app, controllers: dict = None):
+        self.app = app
+        self.controllers = controllers or get_admission_controllers()
+
+    def get_controller(self, scope) -> Optional[AdmissionController]:
+        route = ADMISSION_ROUTES.get(scope["path"])
+        if route is None or scope["method"] != route[0]:
+            return None
+        return self.controllers.get(scope["path"])
+
+    async def __call__(self, scope, receive, send):
+        controller = self.get_controller(scope) \
+            if scope["type"] == "http" else None
+        if controller is None:
+            await self.app(scope, receive, send)
+            return
+
+        deadline = None
+        timeout_ms = Headers(scope=scope).get(DEADLINE_HEADER)
+        if timeout_ms:
+            try:
+                deadline = asyncio.get_running_loop().time() \
+                    + float(timeout_ms) / 1000
+            except ValueError:
+                await send_error_response(
+                    send, 400, f"Invalid {DEADLINE_HEADER} header")
+                return
+
+        try:
+            await controller.acquire(deadline)
+        except AdmissionRejected as e:
+            await send_error_response(send, e.status_code, e.message,
+                                      e.retry_after)
+            return
+        start_time = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            controller.release(time.perf_counter() - start_time)
+
+
+admission_controllers = None
+admission_controllers_lock = threading.Lock()
+
+
+def get_admission_controllers() -> dict:
+    """
+    Get the admission controllers of the inference routes, configured
+    with <ROUTE>_MAX_CONCURRENCY, <ROUTE>_MAX_QUEUE and
+    ADMISSION_DEFAULT_TIMEOUT (seconds a request waits in the queue when
+    it has no deadline).
+    """
+    global admission_controllers
+    with admission_controllers_lock:
+        if admission_controllers is None:
+            default_timeout = float(get_non_empty_value(
+                "ADMISSION_DEFAULT_TIMEOUT", "30"))
+            admission_controllers = {
+                path: AdmissionController(
+                    name=path.strip("/"),
+                    max_concurrency=int(get_non_empty_value(
+                        f"{prefix}_MAX_CONCURRENCY", str(concurrency))),
+                    max_queue=int(get_non_empty_value(
+                        f"{prefix}_MAX_QUEUE", str(queue_size))),
+                    default_timeout=default_timeout,
+                )
+                for path, (_, prefix, concurrency, queue_size)
+                in ADMISSION_ROUTES.items()
+            }
+    return admission_controllers
@@ -1,9 +1,6 @@
 import os
 from typing import Any, Dict, List, Optional
 
-import litellm
-from openai import OpenAI
-
 from .utilities import get_non_empty_value
 
 DEFAULT_LLM_PROVIDER = "openai"
@@ -38,6 +35,7 @@ class AIModels:
         self.params: Dict[str, Any] = params or {}
 
         if self.debug:
+            import litellm
             litellm._turn_on_debug()
             print(f"AIModels: {self.params}")
 
@@ -176,6 +174,8 @@ class AIModels:
             attachments=kwargs.get("attachments"))
         model_args = self.get_model_args()
         model_args["messages"] = messages
+        # Imported on first use: litellm takes seconds to import
+        import litellm
         response = litellm.completion(**model_args)
         if self.debug:
             print(f"AIModels | {self.model_name} | {response}")
@@ -240,6 +240,7 @@ class AIModels:
                   f"\n | model_args: {model_args}"
                   f"\n | client_args: {client_args}")
 
+        from openai import OpenAI
         client = OpenAI(**client_args)
         response = client.responses.create(**model_args)
         return response
@@ -0,0 +1,582 @@
+import csv
+import io
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Callable, Iterator, Optional
+
+from .types import Article
+from .utilities import get_non_empty_value, log_info
+
+DATA_DIR = os.path.join(
+    os.path.dirname(os.path.realpath(__file__)), "..", "data")
+DEFAULT_BATCH_JOBS_DB_PATH = os.path.join(DATA_DIR, "batch_jobs.db")
+DEFAULT_BATCH_JOBS_DIR = os.path.join(DATA_DIR, "batch_jobs")
+
+# Files with a list of articles. Any other file is an article document
+# (PDF, DOCX, ...) read with the AI model, like in /pdfread.
+ARTICLE_LIST_EXTENSIONS = [".csv", ".ndjson", ".jsonl"]
+FINISHED_STATUSES = ["completed", "failed", "cancelled"]
+RESULT_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+RESULT_FIELDS = [
+    "index", "file_name", "title", "abstract", "category", "confidence",
+    "predictions", "duplicate_of", "status", "error_message",
+]
+RESULTS_PAGE_SIZE = 500
+
+BATCH_JOBS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS batch_jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    source TEXT NOT NULL,
+    status TEXT NOT NULL,
+    total_items INTEGER NOT NULL,
+    processed_items INTEGER NOT NULL DEFAULT 0,
+    error_items INTEGER NOT NULL DEFAULT 0,
+    processing_time REAL NOT NULL DEFAULT 0,
+    cancel_requested INTEGER NOT NULL DEFAULT 0,
+    worker_id TEXT,
+    lease_until REAL,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    error_message TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_batch_jobs_status_created_at
+    ON batch_jobs (status, created_at);
+CREATE TABLE IF NOT EXISTS batch_job_items (
+    job_id TEXT NOT NULL,
+    item_index INTEGER NOT NULL,
+    input TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    result TEXT,
+    error_message TEXT,
+    PRIMARY KEY (job_id, item_index)
+) WITHOUT ROWID;
+"""
+
+
+def parse_articles(raw_bytes: bytes, file_name: str) -> list:
+    """
+    Parse a CSV (with "title" and "abstract" columns) or NDJSON (one
+    {"title": ..., "abstract": ...} object per line) list of articles.
+
+    Raises ValueError for invalid files.
+    """
+    try:
+        text = raw_bytes.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        raise ValueError(f"{file_name} is not UTF-8 encoded")
+    if file_name.lower().endswith(".csv"):
+        reader = csv.DictReader(io.StringIO(text))
+        if not reader.fieldnames or not {"title", "abstract"} & {
+                field.strip().lower() for field in reader.fieldnames}:
+            raise ValueError(
+                f"{file_name} must have a \"title\" and/or \"abstract\""
+                " column")
+        rows = [
+            {(key or "").strip().lower(): value for key, value in row.items()}
+            for row in reader
+        ]
+    else:
+        rows = []
+        for line_number, line in enumerate(text.splitlines(), 1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                raise ValueError(
+                    f"{file_name}: invalid JSON in line {line_number}")
+            if not isinstance(row, dict):
+                raise ValueError(
+                    f"{file_name}: line {line_number} is not an object")
+            rows.append(row)
+    return [
+        Article(title=str(row.get("title") or ""),
+                abstract=str(row.get("abstract") or ""))
+        for row in rows
+    ]
+
+
+class BatchJobs:
+    """
+    Asynchronous batch jobs: lists of articles (CSV / NDJSON) or sets of
+    article files (PDF, ...) classified in the background.
+
+    The jobs and their items are stored in a local SQLite database, and
+    each processed chunk of items is committed with its results, so the
+    jobs survive server restarts and resume where they stopped. The jobs
+    are run by the worker threads of the batch worker process
+    (api.batch_worker), apart from the API server processes that serve
+    the interactive requests.
+
+    A worker claims a job with a lease that it renews after each chunk. A
+    job whose lease expired (e.g. its server process died) is claimed
+    again by the next free worker of any process.
+    """
+
+    def __init__(
+        self,
+        predict_articles: Callable[[list], list],
+        read_file: Callable[[bytes, str], dict],
+        prediction_log=None,
+        db_path: str = None,
+    ):
+        self.debug = os.environ.get("SERVER_DEBUG", "0") == "1"
+        self.predict_articles = predict_articles
+        self.read_file = read_file
+        self.prediction_log = prediction_log
+        self.db_path = db_path or get_non_empty_value(
+            "BATCH_JOBS_DB_PATH", DEFAULT_BATCH_JOBS_DB_PATH)
+        self.files_dir = get_non_empty_value(
+            "BATCH_JOBS_DIR", DEFAULT_BATCH_JOBS_DIR)
+        self.workers = int(get_non_empty_value("BATCH_JOB_WORKERS", "0"))
+        self.chunk_size = int(get_non_empty_value(
+            "BATCH_JOB_CHUNK_SIZE", "16"))
+        self.max_items = int(get_non_empty_value(
+            "BATCH_JOB_MAX_ITEMS", "10000"))
+        self.lease_time = float(get_non_empty_value(
+            "BATCH_JOB_LEASE_TIME", "60"))
+        self.poll_interval = float(get_non_empty_value(
+            "BATCH_JOB_POLL_INTERVAL", "2"))
+        self.wake_up = threading.Event()
+        self.local = threading.local()
+        self.threads = []
+
+        db_dir = os.path.dirname(self.db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        connection = self.connect()
+        connection.executescript(BATCH_JOBS_SCHEMA)
+        connection.close()
+
+    def connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.db_path, timeout=30,
+                                     check_same_thread=False)
+        connection.row_factory = sqlite3.Row
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    def get_connection(self) -> sqlite3.Connection:
+        """
+        Get the calling thread's connection.
+        """
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = self.connect()
+            self.local.connection = connection
+        return connection
+
+    def start(self, workers: int = None):
+        """
+        Start `workers` worker threads (BATCH_JOB_WORKERS by default: 0,
+        as the jobs are processed by the batch worker process).
+        """
+        if self.threads:
+            return
+        for index in range(self.workers if workers is None else workers):
+            thread = threading.Thread(
+                target=self.work_loop,
+                args=[f"{os.getpid()}-{index}-{uuid.uuid4().hex[:8]}"],
+                name=f"batch-job-worker-{index}",
+                daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    # --------- Submission ---------
+
+    def submit(self, files: list, source: str = "api") -> dict:
+        """
+        Create a job from a list of (file_name, raw_bytes): either article
+        lists (CSV / NDJSON) or article files (PDF, ...), not both.
+
+        Raises ValueError for invalid or too large submissions.
+        """
+        if not files:
+            raise ValueError("No files provided")
+        is_list = [
+            os.path.splitext(file_name or "")[1].lower()
+            in ARTICLE_LIST_EXTENSIONS
+            for file_name, _ in files
+        ]
+        if any(is_list) and not all(is_list):
+            raise ValueError(
+                "A job is either article lists (CSV / NDJSON) or article"
+                " files (PDF, ...), not both")
+
+        job_id = uuid.uuid4().hex
+        if all(is_list):
+            kind = "articles"
+            items = [
+                article.model_dump()
+                for file_name, raw_bytes in files
+                for article in parse_articles(raw_bytes, file_name)
+            ]
+        else:
+            kind = "files"
+            items = [
+                {"file_name": os.path.basename(file_name or "")}
+                for file_name, _ in files
+            ]
+        if not items:
+            raise ValueError("The job has no articles")
+        if len(items) > self.max_items:
+            raise ValueError(
+                f"The job has {len(items)} articles (maximum"
+                f" {self.max_items})")
+
+        if kind == "files":
+            job_dir = os.path.join(self.files_dir, job_id)
+            os.makedirs(job_dir, exist_ok=True)
+            for index, (item, (_, raw_bytes)) in enumerate(
+                    zip(items, files)):
+                item["path"] = os.path.join(
+                    job_dir, f"{index}-{item['file_name']}")
+                with open(item["path"], "wb") as f:
+                    f.write(raw_bytes)
+
+        connection = self.get_connection()
+        with connection:
+            connection.execute(
+                "INSERT INTO batch_jobs (id, kind, source, status,"
+                " total_items, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                [job_id, kind, source, "queued", len(items), time.time()])
+            connection.executemany(
+                "INSERT INTO batch_job_items (job_id, item_index, input)"
+                " VALUES (?, ?, ?)",
+                [[job_id, index, json.dumps(item)]
+                 for index, item in enumerate(items)])
+        self.wake_up.set()
+        return self.get_job(job_id)
+
+    # --------- Status ---------
+
+    def get_job(self, job_id: str) -> Optional[dict]:
+        """
+        Get the job status, progress, throughput (items per second of
+        processing) and ETA (seconds), or None if it does not exist.
+        """
+        row = self.get_connection().execute(
+            "SELECT * FROM batch_jobs WHERE id = ?", [job_id]).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        throughput = job["processed_items"] / job["processing_time"] \
+            if job["processing_time"] else None
+        remaining = job["total_items"] - job["processed_items"]
+        return {
+            "id": job["id"],
+            "kind": job["kind"],
+            "status": job["status"],
+            "total_items": job["total_items"],
+            "processed_items": job["processed_items"],
+            "error_items": job["error_items"],
+            "progress": job["processed_items"] / job["total_items"],
+            "throughput": throughput,
+            "eta": remaining / throughput
+            if throughput and job["status"] not in FINISHED_STATUSES
+            else None,
+            "cancel_requested": bool(job["cancel_requested"]),
+            "created_at": job["created_at"],
+            "started_at": job["started_at"],
+            "finished_at": job["finished_at"],
+            "error_message": job["error_message"],
+        }
+
+    def cancel(self, job_id: str) -> Optional[dict]:
+        """
+        Cancel a job: a queued job is cancelled right away, a running job
+        after its current chunk. Returns None if the job does not exist.
+        """
+        now = time.time()
+        connection = self.get_connection()
+        with connection:
+            connection.execute(
+                "UPDATE batch_jobs SET cancel_requested = 1,"
+                " status = CASE WHEN status = 'queued' THEN 'cancelled'"
+                " ELSE status END,"
+                " finished_at = CASE WHEN status = 'queued' THEN ?"
+                " ELSE finished_at END"
+                " WHERE id = ? AND status IN ('queued', 'running')",
+                [now, job_id])
+        job = self.get_job(job_id)
+        if job is not None and job["status"] == "cancelled":
+            self.remove_files(job_id)
+        return job
+
+    def get_items(self, job_id: str, offset: int = 0,
+                  limit: int = RESULTS_PAGE_SIZE) -> list:
+        """
+        Get the processed items of a job, by index.
+        """
+        rows = self.get_connection().execute(
+            "SELECT item_index, input, status, result, error_message"
+            " FROM batch_job_items WHERE job_id = ? AND item_index >= ?"
+            " AND status != 'pending' ORDER BY item_index LIMIT ?",
+            [job_id, offset, limit]).fetchall()
+        items = []
+        for row in rows:
+            item_input = json.loads(row["input"])
+            result = json.loads(row["result"]) if row["result"] else {}
+            items.append({
+                "index": row["item_index"],
+                "file_name": item_input.get("file_name"),
+                "title": result.get("title", item_input.get("title")),
+                "abstract": result.get("abstract"),
+                "category": result.get("category"),
+                "confidence": result.get("confidence"),
+                "predictions": result.get("predictions"),
+                "duplicate_of": result.get("duplicate_of"),
+                "status": row["status"],
+                "error_message": row["error_message"],
+            })
+        return items
+
+    def iter_results(self, job_id: str,
+                     result_format: str = "ndjson") -> Iterator[str]:
+        """
+        Stream the processed items of a job as NDJSON or CSV.
+        """
+        if result_format == "csv":
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(RESULT_FIELDS)
+        offset = 0
+        while True:
+            items = self.get_items(job_id, offset)
+            if not items:
+                break
+            offset = items[-1]["index"] + 1
+            if result_format != "csv":
+                yield "".join(json.dumps(item) + "\n" for item in items)
+                continue
+            for item in items:
+                writer.writerow([
+                    json.dumps(item[field]) if field == "predictions"
+                    else item[field]
+                    for field in RESULT_FIELDS
+                ])
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        if result_format == "csv" and offset == 0:
+            yield buffer.getvalue()
+
+    # --------- Workers ---------
+
+    def claim_job(self, worker_id: str) -> Optional[dict]:
+        """
+        Claim the oldest queued job, or a running job whose lease expired.
+        """
+        now = time.time()
+        connection = self.get_connection()
+        with connection:
+            row = connection.execute(
+                "UPDATE batch_jobs SET status = 'running', worker_id = ?,"
+                " lease_until = ?, started_at = COALESCE(started_at, ?)"
+                " WHERE id = (SELECT id FROM batch_jobs"
+                " WHERE status = 'queued'"
+                " OR (status = 'running' AND lease_until < ?)"
+                " ORDER BY created_at LIMIT 1)"
+                " RETURNING *",
+                [worker_id, now + self.lease_time, now, now]).fetchone()
+        return dict(row) if row is not None else None
+
+    def renew_lease(self, job: dict, worker_id: str) -> Optional[bool]:
+        """
+        Renew the lease of a running job. Returns whether its cancellation
+        was requested, or None if the lease was lost.
+        """
+        connection = self.get_connection()
+        with connection:
+            row = connection.execute(
+                "UPDATE batch_jobs SET lease_until = ?"
+                " WHERE id = ? AND worker_id = ? AND status = 'running'"
+                " RETURNING cancel_requested",
+                [time.time() + self.lease_time, job["id"],
+                 worker_id]).fetchone()
+        return bool(row["cancel_requested"]) if row is not None else None
+
+    def finish_job(self, job: dict, status: str,
+                   error_message: str = None):
+        connection = self.get_connection()
+        with connection:
+            connection.execute(
+                "UPDATE batch_jobs SET status = ?, finished_at = ?,"
+                " error_message = ?, lease_until = NULL WHERE id = ?",
+                [status, time.time(), error_message, job["id"]])
+        self.remove_files(job["id"])
+        log_info(f"Batch job {job['id']} {status}")
+
+    def remove_files(self, job_id: str):
+        shutil.rmtree(os.path.join(self.files_dir, job_id),
+                      ignore_errors=True)
+
+    def run_job(self, job: dict, worker_id: str):
+        connection = self.get_connection()
+        while True:
+            cancel_requested = self.renew_lease(job, worker_id)
+            if cancel_requested is None:
+                # Another worker took the job over
+                return
+            if cancel_requested:
+                self.finish_job(job, "cancelled")
+                return
+            rows = connection.execute(
+                "SELECT item_index, input FROM batch_job_items"
+                " WHERE job_id = ? AND status = 'pending'"
+                " ORDER BY item_index LIMIT ?",
+                [job["id"], self.chunk_size]).fetchall()
+            if not rows:
+                self.finish_job(job, "completed")
+                return
+
+            start_time = time.perf_counter()
+            items = [
+                {"index": row["item_index"],
+                 **json.loads(row["input"])}
+                for row in rows
+            ]
+            results = self.process_items(job, items)
+            processing_time = time.perf_counter() - start_time
+
+            errors = sum(1 for result in results if result["error"])
+            with connection:
+                connection.executemany(
+                    "UPDATE batch_job_items SET status = ?, result = ?,"
+                    " error_message = ? WHERE job_id = ? AND item_index = ?",
+                    [["error" if result["error"] else "success",
+                      json.dumps(result["resultset"])
+                      if not result["error"] else None,
+                      result["error_message"], job["id"], item["index"]]
+                     for item, result in zip(items, results)])
+                connection.execute(
+                    "UPDATE batch_jobs SET processed_items ="
+                    " processed_items + ?, error_items = error_items + ?,"
+                    " processing_time = processing_time + ? WHERE id = ?",
+                    [len(items), errors, processing_time, job["id"]])
+            self.log_predictions(job, items, results, processing_time)
+
+    def process_items(self, job: dict, items: list) -> list:
+        """
+        Classify a chunk of items. Returns a standard response per item,
+        with the "title", "abstract" (only for files), "category",
+        "confidence", "predictions" and "duplicate_of" (id of the earlier
+        prediction of a near-duplicate article) in the resultset.
+        """
+        articles = []
+        read_errors = {}
+        for item in items:
+            if job["kind"] == "files":
+                try:
+                    with open(item["path"], "rb") as f:
+                        response = self.read_file(f.read(),
+                                                  item["file_name"])
+                except Exception as e:
+                    response = {"error": True,
+                                "error_message": f"Error reading the file:"
+                                                 f" {e}"}
+                if response["error"]:
+                    read_errors[item["index"]] = response
+                    continue
+                item["title"] = response["resultset"]["title"]
+                item["abstract"] = response["resultset"]["abstract"]
+            articles.append(Article(title=item["title"] or "",
+                                    abstract=item["abstract"] or ""))
+
+        try:
+            predictions = iter(self.predict_articles(articles))
+        except Exception as e:
+            error = {"error": True, "resultset": None,
+                     "error_message": f"Prediction error: {e}"}
+            predictions = iter([error] * len(articles))
+
+        results = []
+        for item in items:
+            if item["index"] in read_errors:
+                results.append({**read_errors[item["index"]],
+                                "resultset": None})
+                continue
+            response = next(predictions)
+            if response["error"]:
+                results.append(response)
+                continue
+            best = max(response["resultset"],
+                       key=lambda prediction: prediction["score"])
+            duplicate = self.find_duplicate(item)
+            results.append({
+                **response,
+                "resultset": {
+                    "title": item["title"],
+                    "abstract": item["abstract"]
+                    if job["kind"] == "files" else None,
+                    "category": best["label"],
+                    "confidence": best["score"],
+                    "predictions": response["resultset"],
+                    "duplicate_of": duplicate["prediction_id"]
+                    if duplicate else None,
+                },
+            })
+        return results
+
+    def find_duplicate(self, item: dict) -> Optional[dict]:
+        """
+        Find the near-duplicate of an item among the logged predictions.
+        """
+        near_duplicates = getattr(self.prediction_log, "near_duplicates",
+                                  None)
+        if near_duplicates is None:
+            return None
+        try:
+            return near_duplicates.find(item["title"], item["abstract"])
+        except Exception as e:
+            log_info(f"Near-duplicate lookup error: {e}")
+            return None
+
+    def log_predictions(self, job: dict, items: list, results: list,
+                        processing_time: float):
+        """
+        Record the chunk in the prediction log (source "<source>_batch").
+        """
+        if self.prediction_log is None:
+            return
+        for item, result in zip(items, results):
+            resultset = result["resultset"] or {}
+            self.prediction_log.record(
+                source=f"{job['source']}_batch",
+                status="error" if result["error"] else "success",
+                title=item.get("title"),
+                abstract=item.get("abstract"),
+                category=resultset.get("category"),
+                confidence=resultset.get("confidence"),
+                predictions=resultset.get("predictions"),
+                processing_time=processing_time / len(items),
+                error_message=result["error_message"],
+            )
+
+    def work_loop(self, worker_id: str):
+        while True:
+            try:
+                job = self.claim_job(worker_id)
+            except Exception as e:
+                log_info(f"Error claiming a batch job: {e}")
+                job = None
+            if job is None:
+                self.wake_up.wait(self.poll_interval)
+                self.wake_up.clear()
+                continue
+            log_info(f"Batch job {job['id']} started by worker {worker_id}")
+            try:
+                self.run_job(job, worker_id)
+            except Exception as e:
+                log_info(f"Error running batch job {job['id']}: {e}")
+                self.finish_job(job, "failed", str(e))
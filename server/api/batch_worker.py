@@ -0,0 +1,45 @@
+"""
+Batch job worker process.
+
+    python -m api.batch_worker
+
+Runs the batch jobs (POST /batch-jobs) apart from the API server
+processes, so the bulk work does not share the model, the torch threads,
+the GIL or the admission slots of the interactive requests.
+BATCH_WORKER_THREADS jobs run at the same time, with
+BATCH_WORKER_TORCH_THREADS torch threads. The model is only loaded with
+the first job.
+
+Several worker processes can share the jobs database: each job is claimed
+with a lease, and the job of a stopped worker is taken over when its lease
+expires.
+"""
+import signal
+import threading
+
+from .utilities import get_non_empty_value, log_info
+
+
+def main():
+    # Before the model is loaded, so its thread pool has this size
+    torch_threads = int(get_non_empty_value(
+        "BATCH_WORKER_TORCH_THREADS", "1"))
+    import torch
+    torch.set_num_threads(torch_threads)
+
+    from .endpoint_methods import batch_job_workers_start_tool
+    workers = int(get_non_empty_value("BATCH_WORKER_THREADS", "1"))
+    batch_job_workers_start_tool(workers)
+    log_info(f"Batch worker started: {workers} job threads,"
+             f" {torch_threads} torch threads")
+
+    stop = threading.Event()
+    for signal_number in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signal_number, lambda *_: stop.set())
+    while not stop.wait(1):
+        pass
+    log_info("Batch worker stopped")
+
+
+if __name__ == "__main__":
+    main()
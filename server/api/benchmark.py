@@ -0,0 +1,751 @@
+"""
+End-to-end benchmark suite.
+
+Times the serving paths in one process, with the model and settings of
+the environment:
+
+- tokenizer: the tokenization of the model inputs (single and batched)
+- model: MLModels.predict_infer (single article) and predict_infer_batch,
+  for input length buckets (in tokens)
+- routes: POST /predict and the GET /dashboard/* routes, through the app
+  middlewares (in-process ASGI client)
+- pdfread: pdfread_tool, answered by a local OpenAI-compatible LLM
+  stand-in (--llm-latency-ms simulates the LLM time)
+- mcp: tool dispatch through an in-memory MCP client of
+  mcp-server/mcp_server.py (needs fastmcp)
+
+The report has the throughput, latency percentiles and peak RSS of each
+case, as JSON. With --compare, the run is checked against a baseline
+report, and fails (exit code 1) when a metric regresses beyond
+--tolerance:
+
+    python -m api.benchmark [--suites model,routes] [--output report.json]
+    python -m api.benchmark --compare baseline.json [--tolerance 0.2]
+
+The prediction log, batch jobs, embedding index and near-duplicate data
+are written in a temporary directory, not in the configured ones.
+"""
+import argparse
+import asyncio
+import atexit
+import contextlib
+import csv
+import importlib
+import importlib.util
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import ModuleType
+
+import numpy as np
+import orjson
+
+from .tokenized_dataset import DEFAULT_DATA_PATH
+from .utilities import get_non_empty_value
+
+SUITES = ("tokenizer", "model", "routes", "pdfread", "mcp")
+DEFAULT_LENGTHS = "32,128,256,512"
+DEFAULT_BATCH_SIZES = "8,32"
+DASHBOARD_ROUTES = (
+    "/dashboard/metrics",
+    "/dashboard/confusion-matrix",
+    "/dashboard/performance",
+    "/dashboard/distribution",
+    "/dashboard/analytics",
+    "/dashboard/classification-history",
+    "/dashboard/runtime",
+)
+# Compared metrics, and whether a higher value is better
+COMPARED_METRICS = {
+    "throughput": True,
+    "p50": False,
+    "p95": False,
+    "p99": False,
+    "peak_rss_mb": False,
+}
+DEFAULT_COMPARED_METRICS = "throughput,p50,p95,peak_rss_mb"
+# Environment paths of the server data, moved to the temporary directory
+DATA_PATHS = {
+    "PREDICTION_LOG_DB_PATH": "prediction_log.db",
+    "BATCH_JOBS_DB_PATH": "batch_jobs.db",
+    "BATCH_JOBS_DIR": "batch_jobs",
+    "EMBEDDING_INDEX_DIR": "embedding_index",
+    "NEAR_DUPLICATE_DB_PATH": "near_duplicates.db",
+}
+MCP_SERVER_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__)))),
+    "mcp-server", "mcp_server.py")
+
+
+def log_progress(message: str):
+    # The standard output is silenced during the runs (the model code
+    # prints every prediction)
+    print(f"{time.strftime('%Y-%m-%d %H:%M:%S')} - {message}",
+          file=sys.stderr, flush=True)
+
+
+def get_peak_rss_mb() -> float:
+    """
+    Get the peak resident set size of this process, in MB.
+    """
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, KB on Linux
+    if sys.platform == "darwin":
+        peak_rss /= 1024
+    return round(peak_rss / 1024, 1)
+
+
+def get_latency_stats(latencies: list) -> dict:
+    latencies_ms = np.asarray(latencies) * 1000
+    if not len(latencies_ms):
+        return {}
+    return {
+        "mean": round(float(latencies_ms.mean()), 4),
+        **{f"p{percentile}": round(float(np.percentile(latencies_ms,
+                                                       percentile)), 4)
+           for percentile in (50, 95, 99)},
+        "max": round(float(latencies_ms.max()), 4),
+    }
+
+
+def run_case(function, iterations: int, warmup: int, items: int = 1) -> dict:
+    """
+    Time `iterations` calls of `function(iteration)`, after `warmup`
+    untimed ones. A call processes `items` items (e.g. the articles of a
+    batch), and fails by raising an exception.
+    """
+    errors = 0
+    error = None
+    for iteration in range(warmup):
+        try:
+            function(iteration)
+        except Exception:
+            pass
+    latencies = []
+    start_time = time.perf_counter()
+    for iteration in range(warmup, warmup + iterations):
+        call_start_time = time.perf_counter()
+        try:
+            function(iteration)
+        except Exception as e:
+            errors += 1
+            error = error or str(e)
+            continue
+        latencies.append(time.perf_counter() - call_start_time)
+    elapsed = time.perf_counter() - start_time
+    stats = {
+        "iterations": iterations,
+        "items": items,
+        "errors": errors,
+        "throughput": round(len(latencies) * items / elapsed, 4)
+        if latencies else 0.0,
+        "latency_ms": get_latency_stats(latencies),
+    }
+    if error:
+        stats["error"] = error[:300]
+    return stats
+
+
+def load_articles(data_path: str) -> list:
+    """
+    Read the (title, abstract) of the challenge data articles.
+    """
+    with open(data_path, newline="", encoding="utf-8") as file:
+        return [
+            (row.get("title") or "", row.get("abstract") or "")
+            for row in csv.DictReader(file, delimiter=";")
+            if row.get("title") or row.get("abstract")
+        ]
+
+
+def get_length_texts(tokenizer, articles: list, length: int,
+                     count: int) -> list:
+    """
+    Get `count` texts of about `length` tokens (special tokens included),
+    cut from consecutive articles.
+    """
+    texts = []
+    position = 0
+    for _ in range(count):
+        text = ""
+        # Joined until long enough (a few articles at most)
+        while len(text.split()) < length:
+            title, abstract = articles[position % len(articles)]
+            text = f"{text} {title} {abstract}".strip()
+            position += 1
+        encoding = tokenizer(text, truncation=True, max_length=length,
+                             return_offsets_mapping=True)
+        texts.append(text[:max(end for _, end in
+                               encoding["offset_mapping"])])
+    return texts
+
+
+def get_next_article(context: dict) -> dict:
+    # A different article in each call of all the suites, so no
+    # near-duplicate answer is measured
+    articles = context["articles"]
+    title, abstract = articles[context["article_position"] % len(articles)]
+    context["article_position"] += 1
+    return {"title": title, "abstract": abstract}
+
+
+class LLMStandIn:
+    """
+    Local OpenAI-compatible LLM (responses and chat completions APIs),
+    answering with the title and abstract of an article after `latency`
+    seconds.
+    """
+
+    def __init__(self, answer: dict, latency: float = 0.0):
+        self.answer = orjson.dumps(answer).decode("utf-8")
+        self.latency = latency
+        self.requests = 0
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                stand_in.requests += 1
+                if stand_in.latency:
+                    time.sleep(stand_in.latency)
+                body = orjson.dumps(stand_in.get_response(self.path))
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.server.serve_forever,
+                         name="llm-stand-in", daemon=True).start()
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_address[1]}/v1"
+
+    def get_response(self, path: str) -> dict:
+        if path.endswith("/chat/completions"):
+            return {
+                "id": "chatcmpl-benchmark",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": "benchmark",
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant",
+                                "content": self.answer},
+                    "finish_reason": "stop",
+                }],
+                "usage": {"prompt_tokens": 1, "completion_tokens": 1,
+                          "total_tokens": 2},
+            }
+        return {
+            "id": "resp_benchmark",
+            "object": "response",
+            "created_at": int(time.time()),
+            "status": "completed",
+            "model": "benchmark",
+            "output": [{
+                "type": "message",
+                "id": "msg_benchmark",
+                "status": "completed",
+                "role": "assistant",
+                "content": [{"type": "output_text", "text": self.answer,
+                             "annotations": []}],
+            }],
+            "parallel_tool_calls": False,
+            "tool_choice": "auto",
+            "tools": [],
+        }
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def set_benchmark_environment(data_dir: str, llm_base_url: str):
+    """
+    Point the server data, the LLM and the API quotas of this process to
+    the benchmark ones. Done before the api modules read them.
+    """
+    for name, path in DATA_PATHS.items():
+        os.environ[name] = os.path.join(data_dir, path)
+    if os.environ.get("RATE_LIMIT_STORE_PATH"):
+        os.environ["RATE_LIMIT_STORE_PATH"] = os.path.join(
+            data_dir, "rate_limit")
+    os.environ["PDFREAD_USE_URL"] = "0"
+    for prefix in ("OPENAI", "AIMLAPI"):
+        os.environ[f"{prefix}_BASE_URL"] = llm_base_url
+        os.environ[f"{prefix}_API_KEY"] = "benchmark-api-key"
+    # The requests are not rate limited, but pay for the check
+    os.environ["API_KEY_REQUIRED"] = "0"
+    os.environ["RATE_LIMIT_ANONYMOUS_RATE"] = "1000000000"
+    os.environ["RATE_LIMIT_ANONYMOUS_BURST"] = "1000000000"
+
+
+def benchmark_tokenizer(context: dict, args) -> dict:
+    ml_model = context["ml_model"]
+    cases = {}
+    for length, texts in context["length_texts"].items():
+        cases[f"tokenize/{length}"] = run_case(
+            lambda iteration: ml_model.tokenizer(
+                texts[iteration % len(texts)], return_tensors="pt"),
+            args.iterations, args.warmup)
+        for batch_size in args.batch_sizes:
+            cases[f"tokenize_batch/{length}x{batch_size}"] = run_case(
+                lambda iteration: ml_model.tokenizer(
+                    get_batch(texts, iteration, batch_size), padding=True,
+                    truncation=True, return_tensors="pt"),
+                args.iterations, args.warmup, items=batch_size)
+    return cases
+
+
+def get_batch(texts: list, iteration: int, batch_size: int) -> list:
+    start = iteration * batch_size
+    return [texts[(start + index) % len(texts)]
+            for index in range(batch_size)]
+
+
+def benchmark_model(context: dict, args) -> dict:
+    ml_model = context["ml_model"]
+    cases = {}
+    for length, texts in context["length_texts"].items():
+        cases[f"predict_infer/{length}"] = run_case(
+            lambda iteration: ml_model.predict_infer(
+                texts[iteration % len(texts)]),
+            args.iterations, args.warmup)
+        for batch_size in args.batch_sizes:
+            cases[f"predict_infer_batch/{length}x{batch_size}"] = run_case(
+                lambda iteration: ml_model.predict_infer_batch(
+                    get_batch(texts, iteration, batch_size)),
+                args.iterations, args.warmup, items=batch_size)
+    return cases
+
+
+def check_status(response, status_code: int = 200):
+    if response.status_code != status_code:
+        raise RuntimeError(f"{response.request.method}"
+                           f" {response.request.url.path}:"
+                           f" HTTP {response.status_code}"
+                           f" {response.text[:200]}")
+
+
+def benchmark_routes(context: dict, args) -> dict:
+    from fastapi.testclient import TestClient
+
+    from .main import app
+
+    cases = {}
+    # The lifespan runs the server warm-up
+    with TestClient(app) as client:
+        deadline = time.monotonic() + args.ready_timeout
+        while client.get("/ready").status_code != 200:
+            if time.monotonic() > deadline:
+                raise RuntimeError("The server was not ready in"
+                                   f" {args.ready_timeout}s")
+            time.sleep(0.1)
+
+        cases["POST /predict"] = run_case(
+            lambda iteration: check_status(client.post(
+                "/predict", json=get_next_article(context))),
+            args.iterations, args.warmup)
+        for route in DASHBOARD_ROUTES:
+            cases[f"GET {route}"] = run_case(
+                lambda iteration: check_status(client.get(route)),
+                args.iterations, args.warmup)
+        etag = client.get("/dashboard/metrics").headers.get("etag")
+        if etag:
+            cases["GET /dashboard/metrics (If-None-Match)"] = run_case(
+                lambda iteration: check_status(client.get(
+                    "/dashboard/metrics",
+                    headers={"If-None-Match": etag}), 304),
+                args.iterations, args.warmup)
+    return cases
+
+
+def benchmark_pdfread(context: dict, args) -> dict:
+    from .endpoint_methods import pdfread_tool
+
+    title, abstract = context["articles"][0]
+    text_file = f"{title}\n\n{abstract}\n".encode("utf-8")
+    # The file content is sent to the LLM as is (base64 encoded)
+    pdf_file = b"%PDF-1.4\n" + os.urandom(1024 * 1024)
+
+    def pdfread(file_name: str, content: bytes):
+        response = pdfread_tool(content, file_name, source="benchmark")
+        if response["error"]:
+            raise RuntimeError(response["error_message"])
+
+    return {
+        f"pdfread_tool/txt_{len(text_file) // 1024}kb": run_case(
+            lambda iteration: pdfread("article.txt", text_file),
+            args.iterations, args.warmup),
+        "pdfread_tool/pdf_1mb": run_case(
+            lambda iteration: pdfread("article.pdf", pdf_file),
+            args.iterations, args.warmup),
+    }
+
+
+def load_mcp_server(path: str) -> ModuleType:
+    """
+    Import the MCP server module, with its `lib.api` imports resolved to
+    this api package (the copy made by link_common_assets.sh), so the
+    tools share the model and data of the other suites.
+    """
+    import fastmcp  # noqa: F401 (the MCP server dependency)
+
+    if not os.path.exists(path):
+        raise ImportError(f"MCP server not found: {path}")
+    if "lib.api" not in sys.modules and __package__ != "lib.api":
+        for name in ("endpoint_methods", "types", "utilities"):
+            importlib.import_module(f"{__package__}.{name}")
+        lib = ModuleType("lib")
+        lib.__path__ = []
+        sys.modules["lib"] = lib
+        sys.modules["lib.api"] = sys.modules[__package__]
+        for name, module in list(sys.modules.items()):
+            if name.startswith(f"{__package__}."):
+                sys.modules[f"lib.{name}"] = module
+    spec = importlib.util.spec_from_file_location("mcp_server", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def benchmark_mcp(context: dict, args) -> dict:
+    from fastmcp import Client
+
+    mcp_server = load_mcp_server(args.mcp_server)
+    loop = asyncio.new_event_loop()
+    client = Client(mcp_server.mcp)
+    loop.run_until_complete(client.__aenter__())
+    try:
+        def call_tool(name: str, arguments: dict = None):
+            loop.run_until_complete(client.call_tool(name, arguments or {}))
+
+        return {
+            "mcp_health": run_case(
+                lambda iteration: call_tool("mcp_health"),
+                args.iterations, args.warmup),
+            "mcp_predict": run_case(
+                lambda iteration: call_tool(
+                    "mcp_predict", get_next_article(context)),
+                args.iterations, args.warmup),
+            "mcp_dashboard_metrics": run_case(
+                lambda iteration: call_tool("mcp_dashboard_metrics"),
+                args.iterations, args.warmup),
+        }
+    finally:
+        loop.run_until_complete(client.__aexit__(None, None, None))
+        loop.close()
+
+
+SUITE_FUNCTIONS = {
+    "tokenizer": benchmark_tokenizer,
+    "model": benchmark_model,
+    "routes": benchmark_routes,
+    "pdfread": benchmark_pdfread,
+    "mcp": benchmark_mcp,
+}
+
+
+def get_environment(ml_model, version: str) -> dict:
+    import torch
+    import transformers
+
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "torch": torch.__version__,
+        "transformers": transformers.__version__,
+        "torch_threads": torch.get_num_threads(),
+        "model_version": version,
+        "model": type(ml_model.model).__name__,
+        "model_parameters": sum(parameter.numel() for parameter
+                                in ml_model.model.parameters()),
+        "inference_mode": (ml_model.inference or {}).get("mode"),
+    }
+
+
+def run_benchmark(args) -> dict:
+    """
+    Run the selected suites and get the report.
+    """
+    articles = load_articles(args.data)
+    title, abstract = articles[0]
+    stand_in = LLMStandIn({"title": title, "abstract": abstract},
+                          args.llm_latency_ms / 1000)
+    data_dir = tempfile.mkdtemp(prefix="benchmark-")
+    # Registered first, so it runs after the data stores are closed
+    atexit.register(shutil.rmtree, data_dir, ignore_errors=True)
+    set_benchmark_environment(data_dir, stand_in.base_url)
+    report = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "settings": {
+            "suites": args.suites,
+            "iterations": args.iterations,
+            "warmup": args.warmup,
+            "lengths": args.lengths,
+            "batch_sizes": args.batch_sizes,
+            "llm_latency_ms": args.llm_latency_ms,
+        },
+        "suites": {},
+    }
+    try:
+        with open(os.devnull, "w") as devnull, \
+                contextlib.redirect_stdout(devnull):
+            from .model_registry import get_model_registry
+
+            log_progress("Loading the model")
+            model_registry = get_model_registry()
+            ml_model = model_registry.warm_up()
+            report["environment"] = get_environment(
+                ml_model, model_registry.active.name)
+            max_length = min(
+                ml_model.model.config.max_position_embeddings,
+                ml_model.tokenizer.model_max_length)
+            context = {
+                "ml_model": ml_model,
+                "articles": articles,
+                "article_position": 0,
+                "length_texts": {
+                    length: get_length_texts(
+                        ml_model.tokenizer, articles, length,
+                        max(args.batch_sizes + [16]))
+                    for length in args.lengths if length <= max_length
+                },
+            }
+            skipped_lengths = [length for length in args.lengths
+                               if length > max_length]
+            if skipped_lengths:
+                report["settings"]["skipped_lengths"] = skipped_lengths
+                log_progress(f"Lengths {skipped_lengths} skipped (the"
+                             f" model max length is {max_length})")
+
+            for suite in args.suites:
+                log_progress(f"Running the {suite} suite")
+                start_time = time.perf_counter()
+                try:
+                    cases = SUITE_FUNCTIONS[suite](context, args)
+                except ImportError as e:
+                    log_progress(f"The {suite} suite is skipped: {e}")
+                    report["suites"][suite] = {"skipped": str(e)}
+                    continue
+                report["suites"][suite] = {
+                    "cases": cases,
+                    "elapsed": round(time.perf_counter() - start_time, 3),
+                    # Peak of the process so far
+                    "peak_rss_mb": get_peak_rss_mb(),
+                }
+    finally:
+        stand_in.close()
+    report["llm_stand_in_requests"] = stand_in.requests
+    report["peak_rss_mb"] = get_peak_rss_mb()
+    return report
+
+
+def get_metrics(report: dict) -> dict:
+    """
+    Flatten the compared metrics of a report ("suite/case/metric").
+    """
+    metrics = {"peak_rss_mb": report.get("peak_rss_mb")}
+    for suite, suite_report in report.get("suites", {}).items():
+        for case, stats in suite_report.get("cases", {}).items():
+            key = f"{suite}/{case}"
+            metrics[f"{key}/throughput"] = stats["throughput"]
+            metrics[f"{key}/errors"] = stats["errors"]
+            for name, value in stats["latency_ms"].items():
+                metrics[f"{key}/{name}"] = value
+    return metrics
+
+
+def compare_reports(baseline: dict, report: dict, tolerance: float,
+                    min_delta_ms: float, compared: list) -> dict:
+    """
+    Compare a report with a baseline one. A metric regresses when it is
+    worse by more than `tolerance` (relative), and the latencies by more
+    than `min_delta_ms` too, so the noise of sub-millisecond cases is not
+    a regression. New errors are always a regression.
+    """
+    baseline_metrics = get_metrics(baseline)
+    metrics = get_metrics(report)
+    regressions = []
+    changes = {}
+    missing = []
+    for key, baseline_value in baseline_metrics.items():
+        name = key.rsplit("/", 1)[-1]
+        value = metrics.get(key)
+        if value is None:
+            missing.append(key)
+            continue
+        if name == "errors":
+            if value > baseline_value:
+                regressions.append({"metric": key, "baseline":
+                                    baseline_value, "current": value})
+            continue
+        if name not in compared or baseline_value is None:
+            continue
+        change = (value - baseline_value) / baseline_value \
+            if baseline_value else 0.0
+        changes[key] = round(change, 4)
+        if COMPARED_METRICS[name]:
+            # The time per item, for the absolute threshold
+            regressed = change < -tolerance and value > 0 and (
+                1 / value - 1 / baseline_value) * 1000 > min_delta_ms
+        elif name == "peak_rss_mb":
+            regressed = change > tolerance
+        else:
+            regressed = change > tolerance \
+                and value - baseline_value > min_delta_ms
+        if regressed:
+            regressions.append({"metric": key, "baseline": baseline_value,
+                                "current": value, "change": round(change, 4)})
+    environment_changes = {
+        name: {"baseline": value,
+               "current": report.get("environment", {}).get(name)}
+        for name, value in baseline.get("environment", {}).items()
+        if report.get("environment", {}).get(name) != value
+    }
+    return {
+        "baseline_created_at": baseline.get("created_at"),
+        "tolerance": tolerance,
+        "min_delta_ms": min_delta_ms,
+        "metrics": compared,
+        "regressions": regressions,
+        "changes": changes,
+        "missing": missing,
+        "environment_changes": environment_changes,
+    }
+
+
+def print_summary(report: dict):
+    lines = [f"{'case':<58} {'items/s':>10} {'p50 ms':>9} {'p95 ms':>9}"
+             f" {'p99 ms':>9} {'errors':>6}"]
+    for suite, suite_report in report["suites"].items():
+        if "skipped" in suite_report:
+            lines.append(f"{suite}: skipped ({suite_report['skipped']})")
+            continue
+        for case, stats in suite_report["cases"].items():
+            latency = stats["latency_ms"]
+            lines.append(
+                f"{suite + '/' + case:<58} {stats['throughput']:>10.1f}"
+                f" {latency.get('p50', 0):>9.2f}"
+                f" {latency.get('p95', 0):>9.2f}"
+                f" {latency.get('p99', 0):>9.2f} {stats['errors']:>6}")
+    lines.append(f"Peak RSS: {report['peak_rss_mb']} MB")
+    comparison = report.get("comparison")
+    if comparison:
+        for name, change in comparison["environment_changes"].items():
+            lines.append(f"Warning: {name} changed since the baseline"
+                         f" ({change['baseline']} -> {change['current']})")
+        for regression in comparison["regressions"]:
+            lines.append(f"REGRESSION {regression['metric']}:"
+                         f" {regression['baseline']} ->"
+                         f" {regression['current']}")
+        lines.append(f"{len(comparison['regressions'])} regressions"
+                     f" (tolerance {comparison['tolerance']:.0%})")
+    print("\n".join(lines), file=sys.stderr)
+
+
+def get_int_list(value: str) -> list:
+    return [int(item) for item in value.split(",") if item.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the model, routes, pdfread and MCP tools,"
+                    " and compare the results with a baseline")
+    parser.add_argument(
+        "--suites", default=",".join(SUITES),
+        help=f"comma separated suites (default: {','.join(SUITES)})")
+    parser.add_argument("--iterations", type=int, default=30,
+                        help="timed calls per case (default: 30)")
+    parser.add_argument("--warmup", type=int, default=3,
+                        help="untimed calls per case (default: 3)")
+    parser.add_argument(
+        "--lengths", type=get_int_list, default=DEFAULT_LENGTHS,
+        help=f"input lengths in tokens (default: {DEFAULT_LENGTHS})")
+    parser.add_argument(
+        "--batch-sizes", type=get_int_list, default=DEFAULT_BATCH_SIZES,
+        help=f"batch sizes (default: {DEFAULT_BATCH_SIZES})")
+    parser.add_argument("--llm-latency-ms", type=float, default=0,
+                        help="simulated LLM latency of the pdfread stand-in")
+    parser.add_argument("--ready-timeout", type=float, default=300,
+                        help="seconds to wait for the server warm-up")
+    parser.add_argument("--data", default=DEFAULT_DATA_PATH,
+                        help="challenge data CSV (the benchmark articles)")
+    parser.add_argument("--mcp-server", default=MCP_SERVER_PATH,
+                        help="MCP server module path")
+    parser.add_argument("--output",
+                        help="report JSON file (default: standard output)")
+    parser.add_argument(
+        "--compare",
+        help="baseline report: exit with 1 on a regression beyond"
+             " --tolerance")
+    parser.add_argument(
+        "--report",
+        help="with --compare, compare this report instead of running the"
+             " benchmark")
+    parser.add_argument(
+        "--tolerance", type=float,
+        default=float(get_non_empty_value("BENCHMARK_TOLERANCE", "0.2")),
+        help="relative regression tolerance (default: BENCHMARK_TOLERANCE"
+             " or 0.2)")
+    parser.add_argument(
+        "--min-delta-ms", type=float,
+        default=float(get_non_empty_value("BENCHMARK_MIN_DELTA_MS", "0.5")),
+        help="latency regressions below this are ignored (default:"
+             " BENCHMARK_MIN_DELTA_MS or 0.5)")
+    parser.add_argument(
+        "--metrics", default=DEFAULT_COMPARED_METRICS,
+        help="compared metrics, among"
+             f" {','.join(COMPARED_METRICS)} (default:"
+             f" {DEFAULT_COMPARED_METRICS})")
+    args = parser.parse_args()
+    args.suites = [suite.strip() for suite in args.suites.split(",")
+                   if suite.strip()]
+    unknown = set(args.suites) - set(SUITES) \
+        or set(args.metrics.split(",")) - set(COMPARED_METRICS)
+    if unknown:
+        parser.error(f"Unknown suites or metrics: {sorted(unknown)}")
+    if args.report and not args.compare:
+        parser.error("--report needs --compare")
+
+    if args.report:
+        with open(args.report, "rb") as file:
+            report = orjson.loads(file.read())
+    else:
+        report = run_benchmark(args)
+    if args.compare:
+        with open(args.compare, "rb") as file:
+            baseline = orjson.loads(file.read())
+        report["comparison"] = compare_reports(
+            baseline, report, args.tolerance, args.min_delta_ms,
+            args.metrics.split(","))
+
+    output = orjson.dumps(report, option=orjson.OPT_INDENT_2)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)),
+                    exist_ok=True)
+        with open(args.output, "wb") as file:
+            file.write(output)
+    else:
+        sys.stdout.buffer.write(output + b"\n")
+    print_summary(report)
+    if report.get("comparison", {}).get("regressions"):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
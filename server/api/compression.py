@@ -0,0 +1,119 @@
+import gzip
+
+import brotli
+from starlette.datastructures import Headers, MutableHeaders
+
+from .utilities import get_non_empty_value
+
+# Supported content codings, by order of preference
+ENCODINGS = ["br", "gzip"]
+BROTLI_QUALITY = 5
+GZIP_LEVEL = 6
+
+COMPRESSIBLE_CONTENT_TYPES = [
+    "application/json",
+    "application/javascript",
+    "text/",
+]
+# Streams must be flushed event by event: never buffered to compress them
+EXCLUDED_CONTENT_TYPES = ["text/event-stream"]
+
+
+def get_compression_min_size() -> int:
+    """
+    Responses smaller than COMPRESSION_MIN_SIZE bytes are not compressed
+    (0 disables the compression).
+    """
+    return int(get_non_empty_value("COMPRESSION_MIN_SIZE", "1024"))
+
+
+def negotiate_encoding(accept_encoding: str) -> str:
+    """
+    Pick the preferred supported content coding from an Accept-Encoding
+    header, or None for the identity coding.
+    """
+    if not accept_encoding:
+        return None
+    accepted = {}
+    for item in accept_encoding.split(","):
+        coding, _, params = item.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[coding.strip().lower()] = quality
+    for encoding in ENCODINGS:
+        if accepted.get(encoding, accepted.get("*", 0)) > 0:
+            return encoding
+    return None
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+
+def is_compressible(content_type: str) -> bool:
+    if not content_type:
+        return False
+    return not any(content_type.startswith(excluded)
+                   for excluded in EXCLUDED_CONTENT_TYPES) \
+        and any(content_type.startswith(compressible)
+                for compressible in COMPRESSIBLE_CONTENT_TYPES)
+
+
+class CompressionMiddleware:
+    """
+    ASGI middleware that compresses the responses with brotli or gzip, as
+    negotiated with the Accept-Encoding header.
+
+    Only complete (non streaming) responses of COMPRESSION_MIN_SIZE bytes
+    or more are compressed. Responses that already have a
+    Content-Encoding (e.g. the cached dashboard payloads, compressed once
+    per version) are sent as they are.
+    """
+
+    def __init__(self, app, minimum_size: int = None):
+        self.app = app
+        self.minimum_size = get_compression_min_size() \
+            if minimum_size is None else minimum_size
+
+    async def __call__(self, scope, receive, send):
+        encoding = None
+        if scope["type"] == "http" and self.minimum_size > 0:
+            encoding = negotiate_encoding(
+                Headers(scope=scope).get("accept-encoding"))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+
+        async def send_compressed(message):
+            nonlocal start_message
+            if message["type"] == "http.response.start":
+                # Wait for the body to decide on the headers
+                start_message = message
+                return
+            if message["type"] == "http.response.body" \
+               and start_message is not None:
+                headers = MutableHeaders(raw=start_message["headers"])
+                body = message.get("body", b"")
+                if not message.get("more_body", False) \
+                   and len(body) >= self.minimum_size \
+                   and "content-encoding" not in headers \
+                   and is_compressible(headers.get("content-type")):
+                    body = compress(body, encoding)
+                    headers["Content-Encoding"] = encoding
+                    headers["Content-Length"] = str(len(body))
+                    headers.add_vary_header("Accept-Encoding")
+                    message = {**message, "body": body}
+                await send(start_message)
+                start_message = None
+            await send(message)
+
+        await self.app(scope, receive, send_compressed)
@@ -1,13 +1,31 @@
 import os
 
-from .json_models import get_all_training_metrics
+from .history_query import HistoryQuery, parse_iso_date
+from .json_models import get_training_metrics_source
+from .metrics_engine import ClassificationMetrics
+from .utilities import get_serialized_payload
 
 
 class BaseDashboardMetrics:
+    # Payload name -> method that computes it. The payloads are computed
+    # and serialized once, when the metrics are loaded.
+    payload_methods = {}
+    # Payload name -> training metrics sections it is derived from. Only
+    # the payloads whose sections changed are rebuilt on reload.
+    payload_sections = {}
+
     def __init__(self):
         self.debug = os.environ.get("SERVER_DEBUG", "0") == "1"
-        self.metrics = get_all_training_metrics()
+        metrics_source = get_training_metrics_source()
+        self.set_metrics(metrics_source.get_metrics())
+        self.payloads = {}
+        self.build_dashboard_payloads()
+        metrics_source.add_listener(self.on_metrics_reload)
+
+    def set_metrics(self, metrics: dict):
+        self.metrics = metrics
         self.cm = self.metrics["confusion_matrix"]
+        self.engine = ClassificationMetrics.from_dict(self.cm)
 
     def get_metrics(self):
         return self.metrics
@@ -15,40 +33,74 @@ class BaseDashboardMetrics:
     def get_confusion_matrix(self):
         return self.cm
 
+    def build_dashboard_payloads(self):
+        """
+        Compute and serialize all the dashboard payloads.
+        """
+        self.payloads = {
+            name: get_serialized_payload(getattr(self, method_name)())
+            for name, method_name in self.payload_methods.items()
+        }
+
+    def on_metrics_reload(self, old_metrics: dict, new_metrics: dict):
+        """
+        Rebuild the payloads derived from the training metrics sections
+        that changed, and swap them in atomically.
+        """
+        changed_sections = {
+            key for key in set(old_metrics or {}) | set(new_metrics)
+            if (old_metrics or {}).get(key) != new_metrics.get(key)
+        }
+        self.set_metrics(new_metrics)
+        payloads = dict(self.payloads)
+        for name, method_name in self.payload_methods.items():
+            if changed_sections & set(self.payload_sections.get(name, [])):
+                payloads[name] = get_serialized_payload(
+                    getattr(self, method_name)())
+        self.payloads = payloads
+        if self.debug:
+            print(">> on_metrics_reload | changed sections:",
+                  changed_sections)
+
+    def get_dashboard_payload(self, name: str) -> dict:
+        """
+        Get a precomputed dashboard payload
+        (dict with "data", "body" and "etag").
+        """
+        return self.payloads[name]
+
 
 class StaticDashboardMetrics(BaseDashboardMetrics):
+    # The "metrics" payload (training metrics plus the live serving
+    # metrics) is served by DashboardMetricsFromDb
+    payload_methods = {
+        "confusion-matrix": "get_dashboard_confusion_matrix",
+        "performance": "get_dashboard_performance",
+        "distribution": "get_dashboard_distribution",
+    }
+    payload_sections = {
+        "confusion-matrix": ["confusion_matrix"],
+        "performance": ["confusion_matrix"],
+        "distribution": ["confusion_matrix"],
+    }
+
     def __init__(self):
         super().__init__()
 
     def get_precision(self):
-        return {label: value for label, value in zip(self.cm.keys(), [
-            self.cm[category][0][0] / (self.cm[category][0][0]
-                + self.cm[category][0][1])
-            for category in self.cm.keys()])}
+        return self.engine.per_class(self.engine.precision)
 
     def get_recall(self):
-        return {label: value for label, value in zip(self.cm.keys(), [
-            self.cm[category][0][0] / (self.cm[category][0][0]
-                + self.cm[category][1][0])
-            for category in self.cm.keys()])}
+        return self.engine.per_class(self.engine.recall)
 
     def get_f1_score(self):
-        results = {}
-        for category, matrix in self.cm.items():
-            tp = matrix[0][0]
-            fp = matrix[0][1]
-            fn = matrix[1][0]
-            denominator = 2 * tp + fp + fn
-            results[category] = (2 * tp) / denominator if denominator > 0 \
-                else 0.0
-        return results
+        return self.engine.per_class(self.engine.f1_score)
 
     def get_accuracy_per_category(self):
-        return {label: value for label, value in zip(self.cm.keys(), [
-            (self.cm[category][0][0] + self.cm[category][1][1]) / (
-                self.cm[category][0][0] + self.cm[category][0][1]
-                + self.cm[category][1][0] + self.cm[category][1][1])
-            for category in self.cm.keys()])}
+        return self.engine.per_class(self.engine.accuracy)
+
+    def get_averages(self):
+        return self.engine.averages
 
     def get_total_articles(self):
         return self.metrics["training_output"]["global_step"]
@@ -73,10 +125,7 @@ class StaticDashboardMetrics(BaseDashboardMetrics):
         return self.metrics["training_output"]
 
     def get_total_predictions(self):
-        return sum(
-            matrix[0][0] + matrix[0][1] + matrix[1][0] + matrix[1][1]
-            for matrix in self.cm.values()
-        )
+        return self.engine.total_predictions
 
     # ----- Functions for the API endpoints -----
 
@@ -94,72 +143,76 @@ class StaticDashboardMetrics(BaseDashboardMetrics):
             "recall": self.get_recall(),
             "avg_processing_time":
                 self.get_avg_processing_time(),
+            "averages": self.get_averages(),
         }
         return result
 
-    def get_dashboard_confusion_matrix(self):
+    def get_dashboard_confusion_matrix(
+        self,
+        engine: ClassificationMetrics = None,
+    ):
         """
-        Get the dashboard confusion matrix.
+        Get the dashboard confusion matrix (from the training metrics, or
+        from the given metrics engine).
         """
+        if engine is None:
+            engine = self.engine
+            matrix = self.cm
+        else:
+            matrix = engine.to_label_matrices()
         result = {
-            "matrix": self.cm,
-            "categories": list(self.cm.keys()),
-            "total_predictions": self.get_total_predictions(),
-            "accuracy_per_category": self.get_accuracy_per_category(),
+            "matrix": matrix,
+            "categories": list(engine.labels),
+            "total_predictions": engine.total_predictions,
+            "accuracy_per_category": engine.per_class(engine.accuracy),
         }
         if self.debug:
             print(">> get_dashboard_confusion_matrix | result:", result)
         return result
 
-    def get_dashboard_performance(self):
+    def get_dashboard_performance(
+        self,
+        engine: ClassificationMetrics = None,
+    ):
         """
-        Get the dashboard performance.
+        Get the dashboard performance (from the training metrics, or from
+        the given metrics engine).
         """
-        result = []
-        total_predictions_all_cats = self.get_total_predictions()
-
-        for category, matrix in self.cm.items():
-            tp = matrix[0][0]
-            fp = matrix[0][1]
-            fn = matrix[1][0]
-            tn = matrix[1][1]
-
-            precision_denom = tp + fp
-            recall_denom = tp + fn
-            f1_denom = 2 * tp + fp + fn
-            accuracy_denom = tp + fp + fn + tn
-
-            result.append({
+        if engine is None:
+            engine = self.engine
+        total_predictions_all_cats = engine.total_predictions
+        return [
+            {
                 "category": category,
-                "accuracy": (tp + tn) / accuracy_denom if accuracy_denom > 0
-                else 0,
-                "f1_score": (2 * tp) / f1_denom if f1_denom > 0 else 0,
-                "precision": tp / precision_denom if precision_denom > 0
-                else 0,
-                "recall": tp / recall_denom if recall_denom > 0 else 0,
+                "accuracy": accuracy,
+                "f1_score": f1_score,
+                "precision": precision,
+                "recall": recall,
                 "total_predictions": total_predictions_all_cats,
                 "correct_predictions": tp,
-            })
-        return result
+            }
+            for category, accuracy, f1_score, precision, recall, tp in zip(
+                engine.labels, engine.accuracy.tolist(),
+                engine.f1_score.tolist(), engine.precision.tolist(),
+                engine.recall.tolist(), engine.tp.tolist())
+        ]
 
     def get_dashboard_distribution(self):
         """
         Get the dashboard distribution.
         """
-        result = []
-        total_predictions_all_cats = self.get_total_predictions()
-        for category in self.cm.keys():
-            result.append({
+        engine = self.engine
+        percentages = engine.counts / max(engine.total_predictions, 1) * 100
+        return [
+            {
                 "category": category,
-                "count": (self.cm[category][0][0] + self.cm[category][0][1] +
-                          self.cm[category][1][0] + self.cm[category][1][1]),
-                "percentage": (
-                    self.cm[category][0][0] + self.cm[category][0][1] +
-                    self.cm[category][1][0] + self.cm[category][1][1]
-                ) / total_predictions_all_cats * 100,
+                "count": count,
+                "percentage": percentage,
                 "trend": 0,
-            })
-        return result
+            }
+            for category, count, percentage in zip(
+                engine.labels, engine.counts.tolist(), percentages.tolist())
+        ]
 
     def get_dashboard_analytics(self):
         """
@@ -179,20 +232,28 @@ class StaticDashboardMetrics(BaseDashboardMetrics):
         }
         return result
 
-    def get_dashboard_classification_history(self):
-        """
-        Get the dashboard classification history.
-        """
-        result = []
-        for item in self.metrics["classification_history"]:
-            result.append({
-                "id": item["id"],
-                "title": item["title"],
-                "abstract": item["abstract"],
-                "category": item["category"],
-                "confidence": item["confidence"],
-                "date": item["date"],
-                "processing_time": item["processing_time"],
-                "status": item["status"],
-            })
-        return result
+    def get_dashboard_classification_history(
+        self,
+        query: HistoryQuery = None,
+    ):
+        """
+        Get a page of the dashboard classification history.
+        """
+        if query is None:
+            query = HistoryQuery()
+        items = sorted(
+            (
+                (parse_iso_date(item["date"]), item)
+                for item in self.metrics["classification_history"]
+            ),
+            key=lambda entry: (entry[0], entry[1]["id"]),
+            reverse=True,
+        )
+        total = sum(
+            1 for timestamp, item in items
+            if query.matches(item, timestamp, use_cursor=False))
+        items = [
+            (timestamp, item) for timestamp, item in items
+            if query.matches(item, timestamp)
+        ]
+        return query.get_page(items[:query.limit + 1], total)
@@ -1,42 +1,224 @@
-from .dashboard_metrics import BaseDashboardMetrics
+import threading
+import time
 
+from .dashboard_metrics import StaticDashboardMetrics
+from .history_query import HistoryQuery
+from .latency_sketch import LatencySketch
+from .prediction_log import get_prediction_log
+from .prediction_rollups import NO_CATEGORY, PDFREAD_CATEGORY
+from .serving_rollups import parse_window
+from .utilities import get_non_empty_value, get_serialized_payload
+
+SECONDS_PER_MINUTE = 60
+SECONDS_PER_HOUR = 3600
+SECONDS_PER_DAY = 86400
+
+
+class DashboardMetricsFromDb(StaticDashboardMetrics):
+    payload_methods = {
+        "metrics": "get_dashboard_metrics",
+        "analytics": "get_dashboard_analytics",
+        "classification-history": "get_dashboard_classification_history",
+    }
+    payload_sections = {
+        "metrics": ["confusion_matrix", "training_output"],
+        "analytics": ["confusion_matrix"],
+    }
 
-class DashboardMetricsFromDb(BaseDashboardMetrics):
     def __init__(self):
+        self.prediction_log = get_prediction_log()
+        self.payloads_version = None
+        self.payloads_lock = threading.Lock()
+        self.analytics_days = int(get_non_empty_value(
+            "DASHBOARD_ANALYTICS_DAYS", "7"))
+        self.history_limit = int(get_non_empty_value(
+            "DASHBOARD_HISTORY_LIMIT", "20"))
+        windows = get_non_empty_value(
+            "DASHBOARD_SERVING_WINDOWS", "5m,1h,24h")
+        self.serving_windows = {
+            window.strip(): parse_window(window)
+            for window in windows.split(",") if window.strip()
+        }
         super().__init__()
 
+    def get_labels(self):
+        return list(self.cm.keys())
+
+    def get_payloads_version(self) -> tuple:
+        """
+        The payloads change when new predictions are logged, and when the
+        minute changes (the serving and analytics windows move, and other
+        workers may have logged predictions).
+        """
+        return (self.prediction_log.version,
+                int(time.time() // SECONDS_PER_MINUTE))
+
+    def build_dashboard_payloads(self):
+        """
+        Compute and serialize the payloads for the current version of the
+        prediction log.
+        """
+        version = self.get_payloads_version()
+        super().build_dashboard_payloads()
+        self.payloads_version = version
+
+    def get_dashboard_payload(self, name: str) -> dict:
+        """
+        Get a dashboard payload, rebuilding the payloads only when they
+        are stale.
+        """
+        if self.payloads_version != self.get_payloads_version():
+            with self.payloads_lock:
+                if self.payloads_version != self.get_payloads_version():
+                    self.build_dashboard_payloads()
+        return self.payloads[name]
+
+    def get_rollup_trend(self, table: str, bucket_size: int,
+                         buckets: int) -> dict:
+        """
+        Aggregate the last `buckets` rollup buckets of `table` (oldest
+        first) into per-bucket series.
+        """
+        labels = self.get_labels()
+        first_bucket = int(time.time() // bucket_size) - buckets + 1
+        trend = {
+            "count": [0] * buckets,
+            "error_count": [0] * buckets,
+            # Classification requests (not the PDF reads), and their
+            # processing time
+            "classifications": [0] * buckets,
+            "classification_time_sum": [0.0] * buckets,
+            "classified": [0] * buckets,
+            "confidence_sum": [0.0] * buckets,
+            "processing_time_sum": [0.0] * buckets,
+            "categories": {label: [0] * buckets for label in labels},
+            "latency_sketch": [LatencySketch() for _ in range(buckets)],
+        }
+        rows = self.prediction_log.rollups.get_buckets(
+            table, first_bucket * bucket_size)
+        for row in rows:
+            index = row["bucket_start"] // bucket_size - first_bucket
+            if index < 0 or index >= buckets:
+                continue
+            trend["count"][index] += row["count"]
+            trend["error_count"][index] += row["error_count"]
+            trend["processing_time_sum"][index] += row["processing_time_sum"]
+            trend["latency_sketch"][index].merge(row["latency_sketch"])
+            if row["category"] == PDFREAD_CATEGORY:
+                continue
+            trend["classifications"][index] += row["count"]
+            trend["classification_time_sum"][index] += \
+                row["processing_time_sum"]
+            if row["category"] == NO_CATEGORY:
+                continue
+            classified = row["count"] - row["error_count"]
+            trend["classified"][index] += classified
+            trend["confidence_sum"][index] += row["confidence_sum"]
+            if row["category"] in trend["categories"]:
+                trend["categories"][row["category"]][index] += classified
+        return trend
+
+    def get_serving_metrics(self) -> dict:
+        """
+        Get the live serving metrics of all the workers for each window of
+        DASHBOARD_SERVING_WINDOWS: per endpoint ("predict", "pdfread")
+        request and error counts, articles per second and latency
+        percentiles in milliseconds.
+        """
+        return {
+            name: self.prediction_log.serving_rollups.get_window_stats(
+                window)
+            for name, window in self.serving_windows.items()
+        }
+
+    def get_dashboard_metrics(self):
+        """
+        Get the dashboard metrics: the model quality from the training
+        metrics, and the processing speed from the live /predict traffic
+        (first window of DASHBOARD_SERVING_WINDOWS).
+        """
+        result = super().get_dashboard_metrics()
+        serving = self.get_serving_metrics()
+        predict = next(iter(serving.values()), {}).get("predict", {})
+        mean_latency = predict.get("latency_ms", {}).get("mean") or 0
+        result["processing_speed"] = mean_latency
+        result["avg_processing_time"] = mean_latency / 1000
+        result["serving"] = serving
+        return result
+
     def get_dashboard_analytics(self):
         """
-        Get the dashboard analytics.
+        Get the dashboard analytics: one value per day for the last
+        DASHBOARD_ANALYTICS_DAYS days (oldest first), read from the daily
+        rollups, plus the hourly counts for the last 24 hours.
         """
+        daily = self.get_rollup_trend(
+            "prediction_rollups_daily", SECONDS_PER_DAY,
+            self.analytics_days)
+        hourly = self.get_rollup_trend(
+            "prediction_rollups_hourly", SECONDS_PER_HOUR, 24)
+        percentiles = [
+            sketch.get_percentiles() for sketch in daily["latency_sketch"]
+        ]
         result = {
-            "daily_classifications": [],
-            "accuracy_trend": [],
-            "categories_trend": {
-                "cardiovascular": [],
-                "neurological": [],
-                "hepatorenal": [],
-                "oncological": [],
+            # Classification requests (successful or failed)
+            "daily_classifications": daily["classifications"],
+            # Mean confidence of the successful classifications (there are
+            # no ground-truth labels for the live traffic).
+            "accuracy_trend": [
+                confidence_sum / count if count else 0
+                for confidence_sum, count in zip(
+                    daily["confidence_sum"], daily["classified"])
+            ],
+            "categories_trend": daily["categories"],
+            # Articles classified per second
+            "processing_speed_trend": [
+                count / processing_time if processing_time else 0
+                for count, processing_time in zip(
+                    daily["classified"], daily["classification_time_sum"])
+            ],
+            # Percentage of failed requests
+            "error_rate_trend": [
+                errors / count * 100 if count else 0
+                for errors, count in zip(
+                    daily["error_count"], daily["count"])
+            ],
+            # Processing time percentiles (seconds)
+            "processing_time_percentiles_trend": {
+                key: [item[key] for item in percentiles]
+                for key in ("p50", "p95", "p99")
             },
-            "processing_speed_trend": [],
-            "error_rate_trend": [],
+            "hourly_classifications": hourly["classifications"],
         }
         return result
 
-    def get_dashboard_classification_history(self):
-        """
-        Get the dashboard classification history.
-        """
-        return [
-            {
-                "id": item["id"],
-                "title": item["title"],
-                "abstract": item["abstract"],
-                "category": item["category"],
-                "confidence": item["confidence"],
-                "date": item["date"],
-                "processing_time": item["processing_time"],
-                "status": item["status"],
-            }
-            for item in self.metrics["classification_history"]
-        ]
+    def get_dashboard_classification_history(
+        self,
+        query: HistoryQuery = None,
+    ):
+        """
+        Get a page of the dashboard classification history. The
+        "duplicate_of" field is the id of the earlier prediction of a
+        near-duplicate article.
+        """
+        if query is None:
+            query = HistoryQuery(limit=self.history_limit)
+        items = self.prediction_log.get_history(query)
+        if "duplicate_of" in query.fields:
+            duplicates = self.prediction_log.near_duplicates.get_duplicates(
+                [item["id"] for _, item in items])
+            for _, item in items:
+                item["duplicate_of"] = duplicates.get(
+                    item["id"], (None,))[0]
+        return query.get_page(
+            items, self.prediction_log.estimate_history_count(query))
+
+    def get_history_payload(self, query: HistoryQuery) -> dict:
+        """
+        Get the serialized classification history page. The default page
+        is precomputed.
+        """
+        if query.is_default_page(self.history_limit):
+            return self.get_dashboard_payload("classification-history")
+        return get_serialized_payload(
+            self.get_dashboard_classification_history(query))
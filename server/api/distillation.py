@@ -0,0 +1,344 @@
+"""
+Knowledge distillation of the classification model into a compact
+student.
+
+The student keeps a subset of the teacher transformer layers (e.g. 4 or 6
+of the 12 BioBERT layers), initialized from them, and is trained on the
+challenge data to match the teacher's (temperature softened) label
+probabilities and the true labels, with the multi-label setup of the
+training notebook:
+
+    python -m api.distillation [--layers 4] [--epochs 3] [--snapshot]
+
+The articles are tokenized once, in the tokenized dataset cache (see
+tokenized_dataset.py). The student is saved in --output (servable with
+USE_LOCAL_MODEL=1 and LOCAL_MODEL_PATH), or as an offline snapshot with
+--snapshot (servable with MODEL_SNAPSHOT_PATH or registered in the model
+registry). The report (accuracy, F1 and throughput of the teacher and
+the student) is printed and saved in the output directory.
+"""
+import argparse
+import json
+import os
+import random
+import time
+
+import numpy as np
+
+from .metrics_engine import ClassificationMetrics
+from .ml_models import DEFAULT_LABELS
+from .model_snapshot import DEFAULT_SNAPSHOT_DIR, create_snapshot
+from .tokenized_dataset import (
+    DEFAULT_DATA_PATH,
+    get_tokenized_dataset,
+    split_dataset,
+)
+from .utilities import get_non_empty_value, log_info
+
+DEFAULT_STUDENT_PATH = "/code/saved_models/student"
+REPORT_FILE = "distillation_report.json"
+
+
+def load_teacher(model_name: str, labels: list):
+    """
+    Load the teacher model. A PEFT adapter (such as the LoRA fine-tuned
+    Hiver77/MDT) is merged into its base model.
+    """
+    from transformers import AutoModelForSequenceClassification
+    try:
+        from peft import AutoPeftModelForSequenceClassification
+        model = AutoPeftModelForSequenceClassification.from_pretrained(
+            model_name, num_labels=len(labels)).merge_and_unload()
+    except (ImportError, ValueError, OSError):
+        model = AutoModelForSequenceClassification.from_pretrained(
+            model_name, num_labels=len(labels))
+    return model.eval()
+
+
+def get_student_layers(teacher_layers: int, student_layers: int) -> list:
+    """
+    Get the teacher layers kept in the student, evenly spread (always
+    including the first and the last one).
+    """
+    return sorted({int(layer) for layer in np.linspace(
+        0, teacher_layers - 1, student_layers).round()})
+
+
+def build_student(teacher, student_layers: int, labels: list):
+    """
+    Build the student: the teacher configuration with fewer layers,
+    initialized with the teacher embeddings, kept layers, pooler and
+    classification head.
+    """
+    import copy
+    from transformers import AutoModelForSequenceClassification
+
+    config = copy.deepcopy(teacher.config)
+    kept_layers = get_student_layers(config.num_hidden_layers,
+                                     student_layers)
+    config.num_hidden_layers = len(kept_layers)
+    config.id2label = dict(enumerate(labels))
+    config.label2id = {label: index for index, label in enumerate(labels)}
+    student = AutoModelForSequenceClassification.from_config(config)
+
+    layer_prefix = f"{student.base_model_prefix}.encoder.layer."
+    state_dict = {}
+    for name, value in teacher.state_dict().items():
+        if not name.startswith(layer_prefix):
+            state_dict[name] = value
+            continue
+        index, rest = name[len(layer_prefix):].split(".", 1)
+        if int(index) in kept_layers:
+            student_index = kept_layers.index(int(index))
+            state_dict[f"{layer_prefix}{student_index}.{rest}"] = value
+    student.load_state_dict(state_dict, strict=False)
+    return student, kept_layers
+
+
+def get_logits(model, dataset, indexes: list,
+               batch_size: int = 32) -> np.ndarray:
+    """
+    Get the logits of the dataset indexes (batched by token length).
+    """
+    import torch
+
+    model.eval()
+    logits = np.empty((len(indexes), model.config.num_labels),
+                      dtype=np.float32)
+    with torch.inference_mode():
+        for positions, inputs in dataset.iter_batches(indexes, batch_size):
+            logits[positions] = model(**inputs).logits.float().numpy()
+    return logits
+
+
+def evaluate(model, dataset, indexes: list, labels: list) -> dict:
+    """
+    Get the multi-label metrics (0.5 sigmoid threshold, as in the training
+    notebook), the top-1 accuracy (the served prediction is the top
+    label) and the throughput of a model on the evaluation set.
+    """
+    start_time = time.perf_counter()
+    logits = get_logits(model, dataset, indexes, batch_size=8)
+    elapsed = time.perf_counter() - start_time
+
+    predicted = 1 / (1 + np.exp(-logits)) > 0.5
+    actual = dataset.targets[indexes] > 0.5
+    matrices = [
+        [[int((predicted[:, index] & actual[:, index]).sum()),
+          int((predicted[:, index] & ~actual[:, index]).sum())],
+         [int((~predicted[:, index] & actual[:, index]).sum()),
+          int((~predicted[:, index] & ~actual[:, index]).sum())]]
+        for index in range(len(labels))
+    ]
+    metrics = ClassificationMetrics.from_multilabel(matrices, labels)
+    top_label = logits.argmax(axis=1)
+    return {
+        "parameters": sum(parameter.numel()
+                          for parameter in model.parameters()),
+        "layers": model.config.num_hidden_layers,
+        "accuracy": metrics.averages["accuracy"],
+        "top1_accuracy": float(
+            actual[np.arange(len(top_label)), top_label].mean()),
+        "f1_micro": metrics.averages["micro"]["f1_score"],
+        "f1_macro": metrics.averages["macro"]["f1_score"],
+        "f1_per_class": metrics.per_class(metrics.f1_score),
+        "articles_per_second": len(indexes) / elapsed,
+        "latency_ms": elapsed / len(indexes) * 1000,
+    }
+
+
+def train_student(student, dataset, indexes: list,
+                  teacher_logits: np.ndarray, args) -> list:
+    """
+    Train the student on the teacher soft labels (binary cross entropy
+    with the temperature softened teacher probabilities, scaled by T^2)
+    and the true labels, weighted by --alpha. Returns the mean loss of
+    each epoch.
+    """
+    import torch
+    import torch.nn.functional as F
+
+    torch.manual_seed(args.seed)
+    optimizer = torch.optim.AdamW(student.parameters(),
+                                  lr=args.learning_rate, weight_decay=0.01)
+    steps = args.epochs * ((len(indexes) + args.batch_size - 1)
+                           // args.batch_size)
+    scheduler = torch.optim.lr_scheduler.LambdaLR(
+        optimizer, lambda step: max(0.0, 1 - step / max(1, steps)))
+    temperature = args.temperature
+    targets = dataset.targets[indexes]
+    order = list(range(len(indexes)))
+    epoch_losses = []
+    for epoch in range(args.epochs):
+        student.train()
+        random.Random(args.seed + epoch).shuffle(order)
+        total_loss = 0.0
+        for start in range(0, len(order), args.batch_size):
+            batch = order[start:start + args.batch_size]
+            inputs = dataset.get_batch([indexes[position]
+                                        for position in batch])
+            logits = student(**inputs).logits
+            soft_targets = torch.sigmoid(
+                torch.from_numpy(teacher_logits[batch]) / temperature)
+            distillation_loss = F.binary_cross_entropy_with_logits(
+                logits / temperature, soft_targets) * temperature ** 2
+            label_loss = F.binary_cross_entropy_with_logits(
+                logits, torch.from_numpy(targets[batch]))
+            loss = args.alpha * distillation_loss \
+                + (1 - args.alpha) * label_loss
+            optimizer.zero_grad()
+            loss.backward()
+            torch.nn.utils.clip_grad_norm_(student.parameters(), 1.0)
+            optimizer.step()
+            scheduler.step()
+            total_loss += loss.item() * len(batch)
+        epoch_losses.append(total_loss / len(order))
+        log_info(f"Epoch {epoch + 1}/{args.epochs}:"
+                 f" loss {epoch_losses[-1]:.4f}")
+    return epoch_losses
+
+
+def print_report(report: dict):
+    teacher, student = report["teacher"], report["student"]
+    print(f"\n{'':24}{'teacher':>12}{'student':>12}")
+    for name, key, template in (
+        ("Layers", "layers", "{:>12d}"),
+        ("Parameters (M)", "parameters", "{:>12.1f}"),
+        ("Accuracy", "accuracy", "{:>12.4f}"),
+        ("Top-1 accuracy", "top1_accuracy", "{:>12.4f}"),
+        ("F1 micro", "f1_micro", "{:>12.4f}"),
+        ("F1 macro", "f1_macro", "{:>12.4f}"),
+        ("Articles/sec", "articles_per_second", "{:>12.1f}"),
+        ("Latency (ms/article)", "latency_ms", "{:>12.1f}"),
+    ):
+        values = [teacher[key], student[key]]
+        if key == "parameters":
+            values = [value / 1e6 for value in values]
+        print(f"{name:24}" + "".join(template.format(value)
+                                     for value in values))
+    print(f"\nSpeedup: {report['speedup']:.2f}x,"
+          f" F1 macro change: {report['f1_macro_change']:+.4f}")
+
+
+def main():
+    use_local_model = get_non_empty_value("USE_LOCAL_MODEL", "0") == "1"
+    parser = argparse.ArgumentParser(
+        description="Distill the classification model into a compact"
+                    " student")
+    parser.add_argument(
+        "--teacher",
+        default=get_non_empty_value("LOCAL_MODEL_PATH", "/code/saved_models")
+        if use_local_model
+        else get_non_empty_value("CLOUD_MODEL_NAME", "Hiver77/MDT"),
+        help="teacher model name or path (default: CLOUD_MODEL_NAME, or"
+             " LOCAL_MODEL_PATH with USE_LOCAL_MODEL=1)")
+    parser.add_argument(
+        "--tokenizer",
+        default=get_non_empty_value("BASE_MODEL_NAME",
+                                    "dmis-lab/biobert-v1.1"),
+        help="tokenizer name or path (default: BASE_MODEL_NAME)")
+    parser.add_argument("--data", default=DEFAULT_DATA_PATH,
+                        help="challenge data CSV")
+    parser.add_argument("--output", default=DEFAULT_STUDENT_PATH,
+                        help="student model directory")
+    parser.add_argument("--layers", type=int, default=4,
+                        help="student transformer layers (default: 4)")
+    parser.add_argument("--epochs", type=int, default=3)
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--learning-rate", type=float, default=5e-5)
+    parser.add_argument("--temperature", type=float, default=2.0,
+                        help="distillation temperature (default: 2)")
+    parser.add_argument("--alpha", type=float, default=0.5,
+                        help="weight of the teacher soft labels in the"
+                             " loss, against the true labels")
+    parser.add_argument("--max-length", type=int, default=256,
+                        help="max tokens per article (default: 256)")
+    parser.add_argument("--eval-fraction", type=float, default=0.2)
+    parser.add_argument("--limit", type=int,
+                        help="use only the first N articles (quick runs)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument(
+        "--snapshot", action="store_true",
+        help="also save the student as an offline snapshot in"
+             " MODEL_SNAPSHOT_DIR")
+    parser.add_argument("--snapshot-version",
+                        help="snapshot version (default: a timestamp)")
+    args = parser.parse_args()
+
+    import torch
+    from transformers import AutoTokenizer
+
+    labels = list(DEFAULT_LABELS)
+    tokenizer = AutoTokenizer.from_pretrained(args.tokenizer)
+    dataset = get_tokenized_dataset(args.data, tokenizer, args.max_length,
+                                    labels)
+    size = min(args.limit or len(dataset), len(dataset))
+    train_indexes, eval_indexes = split_dataset(
+        size, args.eval_fraction, args.seed)
+    log_info(f"{len(train_indexes)} training and {len(eval_indexes)}"
+             f" evaluation articles")
+
+    teacher = load_teacher(args.teacher, labels)
+    teacher_metrics = evaluate(teacher, dataset, eval_indexes, labels)
+    log_info(f"Teacher: {teacher_metrics}")
+    teacher_logits = get_logits(teacher, dataset, train_indexes)
+
+    student, kept_layers = build_student(teacher, args.layers, labels)
+    del teacher
+    log_info(f"Student: teacher layers {kept_layers}")
+    start_time = time.perf_counter()
+    losses = train_student(student, dataset, train_indexes,
+                           teacher_logits, args)
+    training_time = time.perf_counter() - start_time
+    student.eval()
+    student_metrics = evaluate(student, dataset, eval_indexes, labels)
+
+    os.makedirs(args.output, exist_ok=True)
+    student.save_pretrained(args.output, safe_serialization=True)
+    tokenizer.save_pretrained(args.output)
+    report = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "teacher_name": args.teacher,
+        "student_path": args.output,
+        "data": args.data,
+        "tokenized_dataset": dataset.path,
+        "train_size": len(train_indexes),
+        "eval_size": len(eval_indexes),
+        "kept_layers": kept_layers,
+        "settings": {
+            key: getattr(args, key) for key in (
+                "epochs", "batch_size", "learning_rate", "temperature",
+                "alpha", "max_length", "seed")
+        },
+        "torch_threads": torch.get_num_threads(),
+        "training_time": training_time,
+        "epoch_losses": losses,
+        "teacher": teacher_metrics,
+        "student": student_metrics,
+        "speedup": student_metrics["articles_per_second"]
+        / teacher_metrics["articles_per_second"],
+        "f1_macro_change": student_metrics["f1_macro"]
+        - teacher_metrics["f1_macro"],
+    }
+    if args.snapshot:
+        report["snapshot_path"] = create_snapshot(
+            tokenizer_name=args.output,
+            model_name=args.output,
+            snapshot_dir=get_non_empty_value("MODEL_SNAPSHOT_DIR",
+                                             DEFAULT_SNAPSHOT_DIR),
+            labels=labels,
+            version=args.snapshot_version,
+            # Served once activated (model registry or
+            # MODEL_SNAPSHOT_PATH), not as the "current" snapshot
+            set_current=False,
+        )
+    with open(os.path.join(args.output, REPORT_FILE), "w") as file:
+        json.dump(report, file, indent=2)
+
+    print_report(report)
+    print(f"\nStudent saved in {args.output}"
+          + (f" and {report['snapshot_path']}" if args.snapshot else ""))
+
+
+if __name__ == "__main__":
+    main()
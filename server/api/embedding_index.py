@@ -0,0 +1,515 @@
+"""
+Nearest-neighbour index of the classified articles.
+
+Every prediction of the classification model also returns the pooled
+embedding of the article (see InferenceRunner), from the same forward
+pass. The embeddings are L2-normalized and stored, in EMBEDDING_INDEX_DTYPE
+("float16", or "int8" with a scale per row), in a file memory-mapped by
+the worker processes. The article metadata (content hash, title, category)
+is in a SQLite database next to it. The search is a vectorized cosine
+similarity scan, or, from EMBEDDING_INDEX_IVF_MIN articles, an IVF search
+of the EMBEDDING_INDEX_IVF_PROBES partitions (k-means) nearest to the
+query.
+
+Each model version has its own index (EMBEDDING_INDEX_DIR/<version>), as
+the embeddings of different models cannot be compared.
+"""
+import atexit
+import os
+import queue
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+import numpy as np
+
+from .single_flight import get_content_hash, normalize_text
+from .utilities import get_non_empty_value, log_info
+
+DEFAULT_EMBEDDING_INDEX_DIR = "/code/data/embedding_index"
+INDEX_DTYPES = ["float16", "int8"]
+VECTORS_FILE = "vectors.bin"
+SCALES_FILE = "scales.bin"
+METADATA_FILE = "embeddings.db"
+# Rows of the vectors file allocated at once
+MIN_CAPACITY = 1024
+# Rows scored per matrix product of the exact search
+SEARCH_CHUNK_SIZE = 16384
+KMEANS_ITERATIONS = 10
+KMEANS_SAMPLE_SIZE = 20000
+
+EMBEDDINGS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS embeddings (
+    row INTEGER PRIMARY KEY,
+    content_hash TEXT NOT NULL UNIQUE,
+    created_at REAL NOT NULL,
+    title TEXT,
+    category TEXT,
+    confidence REAL
+);
+CREATE TABLE IF NOT EXISTS settings (
+    name TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+def get_article_hash(title: str, abstract: str) -> str:
+    """
+    Get the key of an article (same normalized title and abstract, same
+    key).
+    """
+    return get_content_hash(normalize_text(title), normalize_text(abstract))
+
+
+def get_top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """
+    Get the indexes of the k highest scores, highest first.
+    """
+    if len(scores) > k:
+        indexes = np.argpartition(-scores, k - 1)[:k]
+    else:
+        indexes = np.arange(len(scores))
+    return indexes[np.argsort(-scores[indexes], kind="stable")]
+
+
+class EmbeddingIndex:
+    """
+    Embedding index of the articles classified by one model version.
+
+    `add()` only puts the embedding in a queue: a background writer thread
+    stores the queued embeddings in batches. The writers of the worker
+    processes are serialized by the SQLite write lock, each batch takes
+    the next rows of the vectors file. An article already in the index
+    (same content hash) is not added again.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.default_dtype = get_non_empty_value("EMBEDDING_INDEX_DTYPE",
+                                                 "float16")
+        if self.default_dtype not in INDEX_DTYPES:
+            raise ValueError(f"Invalid EMBEDDING_INDEX_DTYPE:"
+                             f" {self.default_dtype}. Valid types:"
+                             f" {', '.join(INDEX_DTYPES)}")
+        self.ivf_min = int(get_non_empty_value("EMBEDDING_INDEX_IVF_MIN",
+                                               "50000"))
+        self.ivf_probes = int(get_non_empty_value(
+            "EMBEDDING_INDEX_IVF_PROBES", "8"))
+        self.batch_size = int(get_non_empty_value(
+            "EMBEDDING_INDEX_BATCH_SIZE", "100"))
+        self.queue = queue.Queue()
+        # Queued embeddings (content hash -> normalized vector), found by
+        # `get_vector()` before they are written
+        self.pending = {}
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        # Serializes the refreshes, which train the partitions without
+        # holding `lock` (taken by `add()`)
+        self.refresh_lock = threading.Lock()
+        self.thread = None
+        # Read view: memory-mapped vectors (and int8 scales) of `size`
+        # rows, and the IVF partitions
+        self.dtype = None
+        self.dimension = None
+        self.vectors = None
+        self.scales = None
+        self.size = 0
+        self.centroids = None
+        self.partitions = None
+        self.trained_size = 0
+
+        os.makedirs(path, exist_ok=True)
+        connection = self.connect()
+        connection.executescript(EMBEDDINGS_SCHEMA)
+        connection.close()
+
+    def connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(os.path.join(self.path, METADATA_FILE),
+                                     timeout=30, check_same_thread=False)
+        connection.row_factory = sqlite3.Row
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    def query(self, sql: str, params: list = None) -> list:
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = self.connect()
+            self.local.connection = connection
+        return connection.execute(sql, params or []).fetchall()
+
+    def get_settings(self, connection=None) -> dict:
+        rows = (connection.execute("SELECT name, value FROM settings")
+                .fetchall() if connection else
+                self.query("SELECT name, value FROM settings"))
+        return {row["name"]: row["value"] for row in rows}
+
+    # --------- Writer ---------
+
+    def add(self, title: str, abstract: str, embedding, category: str = None,
+            confidence: float = None):
+        """
+        Queue the embedding of a classified article to be stored.
+        """
+        vector = np.asarray(embedding, dtype=np.float32)
+        vector = vector / max(float(np.linalg.norm(vector)), 1e-12)
+        content_hash = get_article_hash(title, abstract)
+        with self.lock:
+            self.pending[content_hash] = vector
+        self.start()
+        self.queue.put({
+            "content_hash": content_hash,
+            "created_at": time.time(),
+            "title": title,
+            "category": category,
+            "confidence": confidence,
+            "vector": vector,
+        })
+
+    def start(self):
+        with self.lock:
+            if self.thread is not None:
+                return
+            self.thread = threading.Thread(
+                target=self.write_loop, name="embedding-index-writer",
+                daemon=True)
+            self.thread.start()
+        atexit.register(self.close)
+
+    def get_batch(self) -> list:
+        """
+        Wait for the first queued embedding, then take all the others
+        available, up to the batch size.
+        """
+        batch = [self.queue.get()]
+        while len(batch) < self.batch_size and batch[-1] is not None:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def write_loop(self):
+        connection = self.connect()
+        stop = False
+        while not stop:
+            batch = self.get_batch()
+            records = [record for record in batch if record is not None]
+            stop = len(records) < len(batch)
+            try:
+                if records:
+                    self.write_batch(connection, records)
+            except Exception as e:
+                log_info(f"Error writing {len(records)} embeddings: {e}")
+            finally:
+                with self.lock:
+                    for record in records:
+                        self.pending.pop(record["content_hash"], None)
+                for _ in batch:
+                    self.queue.task_done()
+        connection.close()
+
+    def write_batch(self, connection: sqlite3.Connection, records: list):
+        """
+        Store a batch of embeddings in the next rows of the vectors file,
+        then commit their metadata (so the readers never see a row before
+        its vector).
+        """
+        # Takes the write lock of the database (all the processes)
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            settings = self.get_settings(connection)
+            if not settings:
+                settings = {"dtype": self.default_dtype,
+                            "dimension": str(len(records[0]["vector"]))}
+                connection.executemany(
+                    "INSERT INTO settings (name, value) VALUES (?, ?)",
+                    list(settings.items()))
+            dimension = int(settings["dimension"])
+
+            unique = {}
+            for record in records:
+                if len(record["vector"]) == dimension:
+                    unique.setdefault(record["content_hash"], record)
+            existing = {
+                row["content_hash"] for row in connection.execute(
+                    "SELECT content_hash FROM embeddings WHERE content_hash"
+                    f" IN ({', '.join('?' * len(unique))})", list(unique))
+            } if unique else set()
+            records = [record for content_hash, record in unique.items()
+                       if content_hash not in existing]
+            if records:
+                start = connection.execute(
+                    "SELECT COALESCE(MAX(row) + 1, 0) FROM embeddings"
+                ).fetchone()[0]
+                self.write_vectors(settings["dtype"], dimension, start,
+                                   np.stack([record["vector"]
+                                             for record in records]))
+                connection.executemany(
+                    "INSERT INTO embeddings (row, content_hash, created_at,"
+                    " title, category, confidence) VALUES (?, ?, ?, ?, ?, ?)",
+                    [[start + index, record["content_hash"],
+                      record["created_at"], record["title"],
+                      record["category"], record["confidence"]]
+                     for index, record in enumerate(records)])
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+
+    def write_vectors(self, dtype: str, dimension: int, start: int,
+                      vectors: np.ndarray):
+        """
+        Write vectors from the `start` row, growing the files (doubling
+        their capacity) when needed.
+        """
+        if dtype == "int8":
+            scales = np.maximum(np.abs(vectors).max(axis=1), 1e-12) / 127
+            values = np.round(vectors / scales[:, None]).astype(np.int8)
+            files = [(VECTORS_FILE, values),
+                     (SCALES_FILE, scales.astype(np.float32)[:, None])]
+        else:
+            files = [(VECTORS_FILE, vectors.astype(np.float16))]
+        end = start + len(vectors)
+        for file_name, values in files:
+            path = os.path.join(self.path, file_name)
+            row_size = values.shape[1] * values.itemsize
+            with open(path, "ab") as file:
+                capacity = file.tell() // row_size
+                if end > capacity:
+                    file.truncate(max(end, 2 * capacity, MIN_CAPACITY)
+                                  * row_size)
+            array = np.memmap(path, dtype=values.dtype, mode="r+",
+                              offset=start * row_size,
+                              shape=values.shape)
+            array[:] = values
+            array.flush()
+            del array
+
+    def flush(self):
+        """
+        Wait until all the queued embeddings are written.
+        """
+        self.queue.join()
+
+    def close(self):
+        if self.thread is not None and self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join(timeout=10)
+
+    # --------- Readers ---------
+
+    def refresh(self):
+        """
+        Map the rows written since the last refresh (also by the other
+        processes), and update the IVF partitions. The partitions are
+        computed without holding the lock, then swapped in with the new
+        size.
+        """
+        size = self.query("SELECT COALESCE(MAX(row) + 1, 0) AS size"
+                          " FROM embeddings")[0]["size"]
+        if size == self.size:
+            return
+        with self.refresh_lock:
+            if size <= self.size:
+                return
+            with self.lock:
+                if self.dtype is None:
+                    settings = self.get_settings()
+                    self.dtype = settings["dtype"]
+                    self.dimension = int(settings["dimension"])
+                if self.vectors is None or size > len(self.vectors):
+                    # The new mapping has the same first rows
+                    self.vectors = np.memmap(
+                        os.path.join(self.path, VECTORS_FILE), mode="r",
+                        dtype=np.int8 if self.dtype == "int8"
+                        else np.float16
+                    ).reshape(-1, self.dimension)
+                    if self.dtype == "int8":
+                        self.scales = np.memmap(
+                            os.path.join(self.path, SCALES_FILE), mode="r",
+                            dtype=np.float32)
+
+            centroids, partitions = self.centroids, self.partitions
+            trained_size = self.trained_size
+            if size < self.ivf_min:
+                centroids = partitions = None
+            elif centroids is None or size >= 2 * trained_size:
+                centroids, partitions = self.train_partitions(size)
+                trained_size = size
+            else:
+                partitions = np.concatenate([
+                    partitions,
+                    self.assign_partitions(centroids, self.size, size)])
+
+            with self.lock:
+                self.size = size
+                self.centroids = centroids
+                self.partitions = partitions
+                self.trained_size = trained_size
+
+    def get_vectors(self, start: int, end: int) -> np.ndarray:
+        """
+        Get the normalized float32 vectors of a range of rows.
+        """
+        vectors = np.asarray(self.vectors[start:end], dtype=np.float32)
+        if self.dtype == "int8":
+            vectors *= self.scales[start:end, None]
+        return vectors
+
+    def get_scores(self, vector: np.ndarray, rows=None) -> np.ndarray:
+        """
+        Get the cosine similarities of a vector with the indexed rows
+        (all of them, or the `rows` array), one chunk at a time.
+        """
+        size = self.size if rows is None else len(rows)
+        scores = np.empty(size, dtype=np.float32)
+        for start in range(0, size, SEARCH_CHUNK_SIZE):
+            end = min(start + SEARCH_CHUNK_SIZE, size)
+            if rows is None:
+                vectors = self.get_vectors(start, end)
+            else:
+                chunk = rows[start:end]
+                vectors = np.asarray(self.vectors[chunk], dtype=np.float32)
+                if self.dtype == "int8":
+                    vectors *= self.scales[chunk, None]
+            scores[start:end] = vectors @ vector
+        return scores
+
+    def train_partitions(self, size: int) -> tuple:
+        """
+        Cluster the first `size` vectors (k-means on a sample, sqrt(size)
+        partitions). Returns the centroids and the nearest centroid of
+        every row.
+        """
+        start_time = time.perf_counter()
+        count = int(np.sqrt(size))
+        rng = np.random.default_rng(0)
+        sample = self.get_vectors(0, size)[np.sort(rng.choice(
+            size, min(size, KMEANS_SAMPLE_SIZE), replace=False))]
+        centroids = sample[rng.choice(len(sample), count, replace=False)]
+        for _ in range(KMEANS_ITERATIONS):
+            assignments = np.argmax(sample @ centroids.T, axis=1)
+            for partition in range(count):
+                members = sample[assignments == partition]
+                if len(members):
+                    centroids[partition] = members.mean(axis=0)
+            centroids /= np.maximum(
+                np.linalg.norm(centroids, axis=1, keepdims=True), 1e-12)
+        partitions = self.assign_partitions(centroids, 0, size)
+        log_info(f"Embedding index {self.path}: {count} partitions trained"
+                 f" in {time.perf_counter() - start_time:.2f}s")
+        return centroids, partitions
+
+    def assign_partitions(self, centroids: np.ndarray, start: int,
+                          end: int) -> np.ndarray:
+        partitions = [
+            np.argmax(self.get_vectors(
+                chunk, min(chunk + SEARCH_CHUNK_SIZE, end))
+                @ centroids.T, axis=1)
+            for chunk in range(start, end, SEARCH_CHUNK_SIZE)
+        ]
+        return np.concatenate(partitions) if partitions \
+            else np.empty(0, dtype=np.int64)
+
+    def get_vector(self, content_hash: str) -> Optional[np.ndarray]:
+        """
+        Get the stored (or queued) vector of an article, None if it is not
+        in the index.
+        """
+        with self.lock:
+            vector = self.pending.get(content_hash)
+        if vector is not None:
+            return vector
+        rows = self.query("SELECT row FROM embeddings WHERE content_hash = ?",
+                          [content_hash])
+        if not rows:
+            return None
+        self.refresh()
+        row = rows[0]["row"]
+        return self.get_vectors(row, row + 1)[0]
+
+    def search(self, vector: np.ndarray, k: int = 10,
+               exclude: str = None) -> dict:
+        """
+        Get the k articles most similar to a normalized vector (cosine
+        similarity), without the `exclude` content hash.
+        """
+        self.refresh()
+        with self.lock:
+            size = self.size
+            centroids = self.centroids
+            partitions = self.partitions
+        if not size:
+            return {"mode": "exact", "size": 0, "candidates": 0,
+                    "neighbors": []}
+
+        rows = None
+        if centroids is not None:
+            probes = get_top_k(centroids @ vector,
+                               min(self.ivf_probes, len(centroids)))
+            rows = np.flatnonzero(np.isin(partitions[:size], probes))
+        scores = self.get_scores(vector, rows)
+        # One more, in case the query article is among them
+        top = get_top_k(scores, k + 1)
+        top_rows = [int(rows[index] if rows is not None else index)
+                    for index in top]
+        metadata = {
+            row["row"]: row for row in self.query(
+                "SELECT row, content_hash, created_at, title, category,"
+                " confidence FROM embeddings WHERE row IN"
+                f" ({', '.join('?' * len(top_rows))})", top_rows)
+        }
+        neighbors = [
+            {
+                "id": row,
+                "title": metadata[row]["title"],
+                "category": metadata[row]["category"],
+                "confidence": metadata[row]["confidence"],
+                "created_at": metadata[row]["created_at"],
+                "score": float(score),
+            }
+            for row, score in zip(top_rows, scores[top])
+            if row in metadata and metadata[row]["content_hash"] != exclude
+        ][:k]
+        return {
+            "mode": "ivf" if rows is not None else "exact",
+            "size": size,
+            "candidates": size if rows is None else len(rows),
+            "neighbors": neighbors,
+        }
+
+    def get_status(self) -> dict:
+        self.refresh()
+        with self.lock:
+            return {
+                "path": self.path,
+                "size": self.size,
+                "dtype": self.dtype or self.default_dtype,
+                "dimension": self.dimension,
+                "partitions": len(self.centroids)
+                if self.centroids is not None else 0,
+                "pending": len(self.pending),
+            }
+
+
+embedding_indexes = {}
+embedding_indexes_lock = threading.Lock()
+
+
+def get_embedding_index(version: str) -> Optional[EmbeddingIndex]:
+    """
+    Get the embedding index of a model version, None if the index is
+    disabled (EMBEDDING_INDEX=0).
+    """
+    if get_non_empty_value("EMBEDDING_INDEX", "1") != "1":
+        return None
+    with embedding_indexes_lock:
+        if version not in embedding_indexes:
+            embedding_indexes[version] = EmbeddingIndex(os.path.join(
+                get_non_empty_value("EMBEDDING_INDEX_DIR",
+                                    DEFAULT_EMBEDDING_INDEX_DIR),
+                version))
+    return embedding_indexes[version]
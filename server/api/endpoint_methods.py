@@ -1,32 +1,57 @@
 import os
 import base64
 import json
-from typing import Union
+import time
+from typing import Optional, Union
 
 
 from .ai_models import AIModels
-from .ml_models import MLModels
-from .json_models import get_all_training_metrics
-from .types import Article
+from .json_models import (
+    get_all_training_metrics,
+    get_training_metrics_source,
+)
+from .types import Article, Feedback
+from .history_query import HistoryQuery
 from .utilities import (
     SERVER_DEBUG as DEBUG,
     remove_temp_file,
     get_temp_random_file_path,
-    get_standard_response
+    get_standard_response,
+    get_serialized_payload,
+    get_non_empty_value,
+    log_info,
 )
 from .dashboard_metrics import StaticDashboardMetrics
 from .dashboard_metrics_from_db import DashboardMetricsFromDb
+from .prediction_log import get_prediction_log
+from .feedback_metrics import get_feedback_metrics
+from .batch_jobs import BatchJobs, RESULT_FORMATS
+from .single_flight import SingleFlight, get_content_hash, normalize_text
+from .admission import get_admission_controllers
+from .rate_limit import get_api_keys, get_rate_limiter
+from .startup_profile import get_startup_report, startup_phase
+from .model_registry import get_model_registry
+from .adapter_pool import get_adapter_pool
+from .embedding_index import get_article_hash, get_embedding_index
 
 
 PDFREAD_USE_URL = os.environ.get("PDFREAD_USE_URL", "0") == "1"
 
-ml_model = MLModels()
-
 ai_model_params = {}
 ai_model = AIModels(params=ai_model_params)
 
 dashboard_metrics_handler = StaticDashboardMetrics()
 dashboard_metrics_from_db_handler = DashboardMetricsFromDb()
+prediction_log = get_prediction_log()
+feedback_metrics = get_feedback_metrics()
+
+# Concurrent identical requests share one computation
+predict_flights = SingleFlight()
+pdfread_flights = SingleFlight()
+
+# Dashboard payloads that can also be computed from the feedback
+FEEDBACK_DASHBOARD_PAYLOADS = ["confusion-matrix", "performance"]
+DASHBOARD_SOURCES = ["training", "feedback"]
 
 
 def read_root_tool() -> dict[str, str]:
@@ -41,16 +66,97 @@ def training_metrics_tool() -> dict[str, str]:
     return metrics
 
 
-def predict_tool(article: Article) -> dict[str, str]:
+def training_metrics_payload_tool() -> dict:
+    """
+    Get the serialized training metrics (dict with "data", "body" and
+    "etag"), rebuilt only when the metrics file changes.
+    """
+    return get_training_metrics_source().get_payload()
+
+
+def predict_tool(
+    article: Article,
+    source: str = "api",
+    adapter: Optional[str] = None,
+    cache: bool = True,
+) -> dict[str, str]:
     """
     Predict categories for a biomedical article.
 
     Accepts a JSON body with `title` and `abstract`.
 
     Returns a JSON object with the predicted category and confidence.
+
+    The prediction is recorded in the prediction log, tagged with the
+    `source` ("api" or "mcp").
+
+    With an `adapter`, the article is classified by that PEFT adapter of
+    the adapter pool instead of the active model.
+
+    Concurrent requests for the same article (same normalized title and
+    abstract) and adapter share one prediction. A near-duplicate of an
+    article classified by the same model is answered with its logged
+    predictions, unless `cache` is False.
     """
+    start_time = time.perf_counter()
+    model = get_prediction_model(adapter)
+    try:
+        key = get_content_hash(normalize_text(article.title),
+                               normalize_text(article.abstract),
+                               adapter or "", "" if cache else "no-cache")
+        response = predict_flights.do(
+            key, lambda: predict_article(article, adapter, cache))
+    except Exception as e:
+        response = get_standard_response(
+            error=True,
+            status_code=500,
+            error_message=f"Prediction error: {e}"
+        )
+    processing_time = time.perf_counter() - start_time
 
-    if ml_model.model is None:
+    resultset = response["resultset"] if not response["error"] else []
+    best = max(resultset, key=lambda item: item["score"]) \
+        if resultset else {}
+    prediction_log.record(
+        source=f"{source}_predict",
+        status="error" if response["error"] else "success",
+        title=article.title if article else None,
+        abstract=article.abstract if article else None,
+        category=best.get("label"),
+        confidence=best.get("score"),
+        predictions=resultset or None,
+        processing_time=processing_time,
+        error_message=response["error_message"],
+        model=model,
+    )
+    return response
+
+
+def get_prediction_model(adapter: Optional[str] = None) -> str:
+    """
+    Get the name of the model that predicts: the active model version, or
+    the adapter.
+    """
+    if adapter:
+        return f"adapter:{adapter}"
+    return get_model_registry().active.name
+
+
+def predict_article(
+    article: Article,
+    adapter: Optional[str] = None,
+    cache: bool = True,
+) -> dict[str, str]:
+    """
+    Run the model prediction for a biomedical article (active model
+    version, or the `adapter` of the adapter pool), or get the cached
+    predictions of a near-duplicate.
+    """
+    model_registry = get_model_registry()
+    version = model_registry.active.name
+    # The adapter pool has its own base model
+    ml_model = model_registry.get_active_model() if not adapter else None
+    if ml_model is not None and ml_model.model is None:
         return get_standard_response(
             error=True,
             status_code=500,
@@ -75,26 +181,222 @@ def predict_tool(article: Article) -> dict[str, str]:
                           " upload a text file via multipart/form-data.",
         )
 
+    # Answer a near-duplicate of a classified article with its predictions
+    if cache:
+        cached = prediction_log.near_duplicates.get_cached_predictions(
+            resolved_title, resolved_abstract,
+            get_prediction_model(adapter))
+        if cached is not None:
+            return get_standard_response(resultset=cached)
+
     # Perform prediction
     text = (resolved_title or "") + " " + (resolved_abstract or "")
+    if adapter:
+        try:
+            predictions = get_adapter_pool().predict(text, adapter)
+        except LookupError as e:
+            return get_standard_response(
+                error=True, status_code=404, error_message=str(e))
+        return get_standard_response(
+            resultset=predictions["predicted_labels"]
+        )
+
+    start_time = time.perf_counter()
     predictions = ml_model.predict_infer(text)
+    model_registry.shadow_predictions(
+        [text], [predictions], time.perf_counter() - start_time)
+    index_embeddings(version, [article], [predictions])
 
     return get_standard_response(
         resultset=predictions["predicted_labels"]
     )
 
 
+def predict_articles(articles: list) -> list:
+    """
+    Run the model prediction for a batch of articles in one forward pass.
+
+    Returns a standard response per article, like `predict_article()`.
+    """
+    model_registry = get_model_registry()
+    version = model_registry.active.name
+    ml_model = model_registry.get_active_model()
+    if ml_model.model is None:
+        return [
+            get_standard_response(
+                error=True,
+                status_code=500,
+                error_message="Model not loaded"
+            )
+        ] * len(articles)
+
+    texts = []
+    predicted_articles = []
+    responses = []
+    for article in articles:
+        text = (article.title.strip() + " " + article.abstract.strip()) \
+            .strip()
+        if not text:
+            responses.append(get_standard_response(
+                error=True,
+                status_code=400,
+                error_message="No input provided: the article has no"
+                              " title or abstract",
+            ))
+            continue
+        texts.append(text)
+        predicted_articles.append(article)
+        responses.append(None)
+
+    start_time = time.perf_counter()
+    results = ml_model.predict_infer_batch(texts) if texts else []
+    model_registry.shadow_predictions(
+        texts, results, time.perf_counter() - start_time)
+    index_embeddings(version, predicted_articles, results)
+    predictions = iter(results)
+    return [
+        response or get_standard_response(
+            resultset=next(predictions)["predicted_labels"])
+        for response in responses
+    ]
+
+
+def index_embeddings(version: str, articles: list, predictions: list):
+    """
+    Add the pooled embeddings of the classified articles (from the
+    prediction forward pass) to the embedding index of the model version.
+    """
+    index = get_embedding_index(version)
+    if index is None:
+        return
+    for article, prediction in zip(articles, predictions):
+        try:
+            index.add(article.title, article.abstract,
+                      prediction["embedding"],
+                      category=prediction["predicted_label"],
+                      confidence=max(prediction["predictions"]))
+        except Exception as e:
+            log_info(f"Error indexing the article embedding: {e}")
+
+
+def similar_tool(
+    article: Article,
+    k: int = 10,
+    source: str = "api",
+) -> dict:
+    """
+    Get the k previously classified articles most similar to an article
+    (cosine similarity of the pooled embeddings of the active model).
+
+    The embedding of an article that was already classified is read from
+    the embedding index. Otherwise the article is classified first, like
+    `predict_tool()` (without the near-duplicate cache), which indexes its
+    embedding: the similarity search itself never runs the model.
+    """
+    if not article or not (article.title.strip() or article.abstract.strip()):
+        return get_standard_response(
+            error=True,
+            status_code=400,
+            error_message="No input provided. Send JSON with title/abstract.",
+        )
+    if k < 1 or k > 100:
+        return get_standard_response(
+            error=True,
+            status_code=400,
+            error_message="k must be between 1 and 100",
+        )
+    version = get_model_registry().active.name
+    index = get_embedding_index(version)
+    if index is None:
+        return get_standard_response(
+            error=True,
+            status_code=404,
+            error_message="The embedding index is disabled",
+        )
+
+    content_hash = get_article_hash(article.title, article.abstract)
+    vector = index.get_vector(content_hash)
+    predicted_labels = None
+    if vector is None:
+        response = predict_tool(article, source=source, cache=False)
+        if response["error"]:
+            return response
+        predicted_labels = response["resultset"]
+        vector = index.get_vector(content_hash)
+        if vector is None:
+            return get_standard_response(
+                error=True,
+                status_code=500,
+                error_message="The article embedding could not be indexed",
+            )
+
+    result = index.search(vector, k, exclude=content_hash)
+    return get_standard_response(resultset={
+        "model_version": version,
+        "indexed": predicted_labels is None,
+        "predicted_labels": predicted_labels,
+        **result,
+    })
+
+
+def embedding_index_status_tool() -> dict:
+    """
+    Get the size, storage type and IVF partitions of the embedding index
+    of the active model version.
+    """
+    index = get_embedding_index(get_model_registry().active.name)
+    return get_standard_response(
+        resultset=index.get_status() if index is not None else None)
+
+
 def pdfread_tool(
     raw_bytes: Union[bytes, str],
     file_name: str,
+    source: str = "api",
 ) -> dict[str, str]:
     """
     Read a PDF file and extract the title and abstract.
     Args:
         raw_bytes (bytes | str): The raw bytes of the file.
         file_name (str): The name of the file.
+        source (str): "api" or "mcp", recorded in the prediction log.
 
     Returns a JSON object with the title and abstract.
+
+    Concurrent requests for the same file content share one extraction.
+    """
+    start_time = time.perf_counter()
+    try:
+        key = get_content_hash(
+            raw_bytes, os.path.splitext(file_name or "")[1].lower())
+        response = pdfread_flights.do(
+            key, lambda: pdfread_extract(raw_bytes, file_name))
+    except Exception as e:
+        response = get_standard_response(
+            error=True,
+            status_code=500,
+            error_message=f"Error reading the file: {e}"
+        )
+    processing_time = time.perf_counter() - start_time
+
+    resultset = response["resultset"] if not response["error"] else {}
+    prediction_log.record(
+        source=f"{source}_pdfread",
+        status="error" if response["error"] else "success",
+        title=resultset.get("title"),
+        abstract=resultset.get("abstract"),
+        processing_time=processing_time,
+        error_message=response["error_message"],
+    )
+    return response
+
+
+def pdfread_extract(
+    raw_bytes: Union[bytes, str],
+    file_name: str,
+) -> dict[str, str]:
+    """
+    Extract the title and abstract from a file using the AI model.
     """
 
     if PDFREAD_USE_URL:
@@ -255,60 +557,477 @@ def health_tool() -> dict[str, str]:
     return {"status": "ok"}
 
 
+# Warm-up state of this server process, see readiness_tool()
+server_readiness = {"ready": False, "warmup_time": None, "error": None}
+
+
+def warmup_tool() -> dict:
+    """
+    Load the active model version and run a warm-up inference (the first
+    forward pass is much slower than the next ones), then report this
+    server process as ready. SERVER_WARMUP=0 skips the inference.
+    """
+    start_time = time.perf_counter()
+    try:
+        if get_non_empty_value("SERVER_WARMUP", "1") == "1":
+            with startup_phase("warmup"):
+                get_model_registry().warm_up()
+        else:
+            get_model_registry().start()
+        server_readiness.update(
+            ready=True, error=None,
+            warmup_time=time.perf_counter() - start_time)
+        log_info(f"Warm-up done in {server_readiness['warmup_time']:.2f}s."
+                 f" Startup phases (seconds): {get_startup_report()}")
+    except Exception as e:
+        server_readiness.update(ready=False, error=str(e))
+        log_info(f"Warm-up failed: {e}")
+    return server_readiness
+
+
+def readiness_tool() -> dict:
+    """
+    Readiness check: ready only after the warm-up inference is done.
+    """
+    if not server_readiness["ready"]:
+        return get_standard_response(
+            error=True,
+            status_code=503,
+            error_message="Not ready: "
+            + (server_readiness["error"] or "warming up")
+        )
+    return get_standard_response(
+        resultset={"status": "ready",
+                   "warmup_time": server_readiness["warmup_time"]}
+    )
+
+
+def dashboard_payload_tool(
+    name: str,
+    source: str = "training",
+    window_days: Optional[int] = None,
+) -> dict:
+    """
+    Get a precomputed dashboard payload (dict with "data", "body" and
+    "etag"), ready to be served without recomputing or re-serializing it.
+
+    The confusion matrix and performance payloads can be computed from the
+    reviewers' feedback (`source="feedback"`), all-time or for the last
+    `window_days` days. Returns an error response for invalid parameters.
+    """
+    if source not in DASHBOARD_SOURCES:
+        return get_standard_response(
+            error=True,
+            status_code=400,
+            error_message="source must be one of: "
+                          f"{', '.join(DASHBOARD_SOURCES)}"
+        )
+    if source == "feedback" and name in FEEDBACK_DASHBOARD_PAYLOADS:
+        return dashboard_feedback_payload(name, window_days)
+    if name in dashboard_metrics_handler.payload_methods:
+        return dashboard_metrics_handler.get_dashboard_payload(name)
+    return dashboard_metrics_from_db_handler.get_dashboard_payload(name)
+
+
+def dashboard_feedback_payload(
+    name: str,
+    window_days: Optional[int] = None,
+) -> dict:
+    """
+    Get a dashboard payload computed from the feedback confusion matrix.
+    """
+    if window_days is not None and \
+       not 1 <= window_days <= feedback_metrics.window_days:
+        return get_standard_response(
+            error=True,
+            status_code=400,
+            error_message="window_days must be between 1 and "
+                          f"{feedback_metrics.window_days}"
+        )
+    method = getattr(dashboard_metrics_handler,
+                     dashboard_metrics_handler.payload_methods[name])
+    return feedback_metrics.get_payload(
+        (name, window_days),
+        lambda: get_serialized_payload(
+            method(feedback_metrics.get_engine(window_days))))
+
+
 def dashboard_metrics_tool() -> dict[str, str]:
     """
     Dashboard metrics endpoint.
     """
-    return dashboard_metrics_handler.get_dashboard_metrics()
+    return dashboard_payload_tool("metrics")["data"]
 
 
-def dashboard_confusion_matrix_tool() -> dict[str, str]:
+def dashboard_confusion_matrix_tool(
+    source: str = "training",
+    window_days: Optional[int] = None,
+) -> dict[str, str]:
     """
     Dashboard confusion matrix endpoint.
     """
-    return dashboard_metrics_handler.get_dashboard_confusion_matrix()
+    result = dashboard_payload_tool("confusion-matrix", source, window_days)
+    if result.get("error"):
+        return result
+    return result["data"]
 
 
-def dashboard_performance_tool() -> dict[str, str]:
+def dashboard_performance_tool(
+    source: str = "training",
+    window_days: Optional[int] = None,
+) -> dict[str, str]:
     """
     Dashboard performance endpoint.
     """
-    return dashboard_metrics_handler.get_dashboard_performance()
+    result = dashboard_payload_tool("performance", source, window_days)
+    if result.get("error"):
+        return result
+    return result["data"]
 
 
 def dashboard_distribution_tool() -> dict[str, str]:
     """
     Dashboard distribution endpoint.
     """
-    return dashboard_metrics_handler.get_dashboard_distribution()
+    return dashboard_payload_tool("distribution")["data"]
 
 
 def dashboard_analytics_tool() -> dict[str, str]:
     """
     Dashboard analytics endpoint.
     """
-    return dashboard_metrics_from_db_handler \
-        .get_dashboard_analytics()
+    return dashboard_payload_tool("analytics")["data"]
+
+
+def dashboard_classification_history_payload_tool(
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    category: Optional[str] = None,
+    status: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    min_confidence: Optional[float] = None,
+    max_confidence: Optional[float] = None,
+    fields: Optional[str] = None,
+) -> dict:
+    """
+    Get a serialized page of the classification history (dict with "data",
+    "body" and "etag"), or an error response for invalid parameters.
+    """
+    try:
+        query = HistoryQuery(
+            limit=limit or dashboard_metrics_from_db_handler.history_limit,
+            cursor=cursor,
+            category=category,
+            status=status,
+            date_from=date_from,
+            date_to=date_to,
+            min_confidence=min_confidence,
+            max_confidence=max_confidence,
+            fields=fields,
+        )
+    except ValueError as e:
+        return get_standard_response(
+            error=True,
+            status_code=400,
+            error_message=str(e)
+        )
+    return dashboard_metrics_from_db_handler.get_history_payload(query)
 
 
-def dashboard_classification_history_tool() -> dict[str, str]:
+def dashboard_classification_history_tool(**params) -> dict[str, str]:
     """
     Dashboard classification history endpoint.
+
+    Returns a page with "data" (the history items, newest first),
+    "next_cursor" (to get the next page, None on the last one) and
+    "total_estimate". See `dashboard_classification_history_payload_tool`
+    for the parameters.
+    """
+    result = dashboard_classification_history_payload_tool(**params)
+    if result.get("error"):
+        return result
+    return result["data"]
+
+
+def dashboard_live_feed_tool(is_disconnected):
+    """
+    Dashboard live feed: async iterator of Server-Sent Events with the new
+    predictions of all the workers ("predictions") and the metric
+    increments of each batch ("metrics_delta").
+    """
+    return prediction_log.live_feed.stream(is_disconnected)
+
+
+def dashboard_runtime_tool() -> dict:
+    """
+    Dashboard runtime gauges of this server process: admission control
+    (in flight, queue depth, rejections), rate limiter counters per client,
+    single-flight coalescing counters of /predict and /pdfread, the
+    startup phases timing, the inference mode of the active model, its
+    embedding index, and the near-duplicate index.
+    """
+    active_model = get_model_registry().active.model
+    return {
+        "startup": get_startup_report(),
+        "inference": active_model.inference if active_model else None,
+        "admission": {
+            path.strip("/"): controller.get_stats()
+            for path, controller in get_admission_controllers().items()
+        },
+        "rate_limit": get_rate_limiter().get_stats(),
+        "single_flight": {
+            "predict": predict_flights.get_stats(),
+            "pdfread": pdfread_flights.get_stats(),
+        },
+        "embedding_index": embedding_index_status_tool()["resultset"],
+        "near_duplicates": prediction_log.near_duplicates.get_status(),
+    }
+
+
+def feedback_tool(feedback: Feedback) -> dict[str, str]:
+    """
+    Record the reviewer's category for a logged prediction (by the id of
+    the classification history), confirming or correcting it.
+
+    Returns the predicted and the reviewed categories.
+    """
+    try:
+        result = feedback_metrics.add_feedback(
+            feedback.prediction_id, feedback.category.strip())
+    except ValueError as e:
+        return get_standard_response(
+            error=True,
+            status_code=400,
+            error_message=str(e)
+        )
+    except LookupError as e:
+        return get_standard_response(
+            error=True,
+            status_code=404,
+            error_message=str(e)
+        )
+    return get_standard_response(resultset=result)
+
+
+# Batch jobs, processed with the batched model path by worker threads
+# started explicitly (never on import, so the processes that only submit
+# or read jobs do not load the model)
+batch_jobs = BatchJobs(
+    predict_articles=predict_articles,
+    read_file=pdfread_extract,
+    prediction_log=prediction_log,
+)
+
+
+def batch_job_workers_start_tool(workers: int = None):
+    """
+    Start the batch job worker threads of this process (BATCH_JOB_WORKERS
+    by default).
+    """
+    batch_jobs.start(workers)
+
+
+def batch_job_submit_tool(files: list, source: str = "api") -> dict:
+    """
+    Submit a batch job from a list of (file_name, raw_bytes): CSV (with
+    "title" and "abstract" columns) or NDJSON article lists, or a set of
+    article files (PDF, ...).
+
+    Returns the job status. The job runs in the background: poll it with
+    `batch_job_status_tool()`.
+    """
+    try:
+        job = batch_jobs.submit(files, source=source)
+    except ValueError as e:
+        return get_standard_response(
+            error=True,
+            status_code=400,
+            error_message=str(e)
+        )
+    return get_standard_response(resultset=job)
+
+
+def batch_job_status_tool(job_id: str) -> dict:
+    """
+    Get the status, progress, throughput and ETA of a batch job.
+    """
+    job = batch_jobs.get_job(job_id)
+    if job is None:
+        return get_standard_response(
+            error=True,
+            status_code=404,
+            error_message=f"Batch job not found: {job_id}"
+        )
+    return get_standard_response(resultset=job)
+
+
+def batch_job_cancel_tool(job_id: str) -> dict:
     """
-    return dashboard_metrics_from_db_handler \
-        .get_dashboard_classification_history()
+    Cancel a batch job (a running job stops after its current chunk).
+    """
+    job = batch_jobs.cancel(job_id)
+    if job is None:
+        return get_standard_response(
+            error=True,
+            status_code=404,
+            error_message=f"Batch job not found: {job_id}"
+        )
+    return get_standard_response(resultset=job)
+
+
+def batch_job_results_tool(
+    job_id: str,
+    result_format: str = "ndjson",
+) -> dict:
+    """
+    Get the results of a batch job as a stream of NDJSON or CSV chunks
+    (the processed items so far, in input order).
+    """
+    if result_format not in RESULT_FORMATS:
+        return get_standard_response(
+            error=True,
+            status_code=400,
+            error_message="format must be one of: "
+                          f"{', '.join(RESULT_FORMATS)}"
+        )
+    result = batch_job_status_tool(job_id)
+    if result["error"]:
+        return result
+    return get_standard_response(
+        resultset={
+            "content": batch_jobs.iter_results(job_id, result_format),
+            "media_type": RESULT_FORMATS[result_format],
+        }
+    )
+
+
+def batch_job_items_tool(
+    job_id: str,
+    offset: int = 0,
+    limit: int = 100,
+) -> dict:
+    """
+    Get a page of the processed items of a batch job, from the item
+    index `offset` on.
+    """
+    result = batch_job_status_tool(job_id)
+    if result["error"]:
+        return result
+    return get_standard_response(
+        resultset=batch_jobs.get_items(job_id, offset, min(limit, 500)))
 
 
 def authentication_tool(api_key: str) -> dict[str, str]:
     """
-    Authenticate the user.
+    Authenticate the user with any of the configured API keys
+    (AG_API_KEY or AG_API_KEYS).
     """
-    if api_key != os.environ.get("AG_API_KEY"):
+    client = get_api_keys().get(api_key) if api_key else None
+    if client is None:
         return get_standard_response(
             error=True,
             status_code=401,
             error_message="Invalid API key"
         )
     return get_standard_response(
-        resultset={"authenticated": True}
+        resultset={"authenticated": True, "client": client}
     )
+
+
+def model_admin_error(api_key: Optional[str]) -> Optional[dict]:
+    """
+    Get the error response if the API key is not one of a model admin
+    client (MODEL_ADMIN_CLIENTS, comma separated client names).
+    """
+    admin_clients = [
+        client.strip() for client in get_non_empty_value(
+            "MODEL_ADMIN_CLIENTS", "default").split(",")
+    ]
+    client = get_api_keys().get(api_key) if api_key else None
+    if client is None or client not in admin_clients:
+        return get_standard_response(
+            error=True,
+            status_code=403,
+            error_message="A model admin API key is required"
+        )
+    return None
+
+
+def model_registry_tool(action, api_key: Optional[str] = None) -> dict:
+    """
+    Run a model registry action, checking the admin API key first.
+    """
+    error = model_admin_error(api_key)
+    if error:
+        return error
+    try:
+        return get_standard_response(resultset=action())
+    except LookupError as e:
+        return get_standard_response(
+            error=True, status_code=404, error_message=str(e))
+    except ValueError as e:
+        return get_standard_response(
+            error=True, status_code=400, error_message=str(e))
+
+
+def model_registry_status_tool() -> dict:
+    """
+    Get the model versions of this server process, the active one and the
+    shadow evaluation results (agreement with the active model and
+    latency of both).
+    """
+    return get_standard_response(resultset=get_model_registry().get_status())
+
+
+def model_register_tool(
+    name: str,
+    source: str,
+    path: Optional[str] = None,
+    api_key: Optional[str] = None,
+) -> dict:
+    """
+    Register a model version ("snapshot", "local" or "cloud" `source`),
+    loaded and warmed up in the background.
+    """
+    return model_registry_tool(
+        lambda: get_model_registry().register(name, source, path), api_key)
+
+
+def model_activate_tool(name: str, api_key: Optional[str] = None) -> dict:
+    """
+    Make a model version the active one. The server swaps to it as soon
+    as it is loaded and warmed up, without dropping requests.
+    """
+    return model_registry_tool(
+        lambda: get_model_registry().activate(name), api_key)
+
+
+def model_shadow_tool(
+    name: Optional[str],
+    sample_rate: float = 0.1,
+    api_key: Optional[str] = None,
+) -> dict:
+    """
+    Shadow-evaluate a model version on a sample of the live predictions
+    (`name` None stops the shadow evaluation).
+    """
+    return model_registry_tool(
+        lambda: get_model_registry().set_shadow(name, sample_rate), api_key)
+
+
+def model_remove_tool(name: str, api_key: Optional[str] = None) -> dict:
+    """
+    Remove a model version (not the active one).
+    """
+    return model_registry_tool(
+        lambda: get_model_registry().remove(name), api_key)
+
+
+def adapters_tool() -> dict:
+    """
+    Get the PEFT adapters of the adapter pool: the available ones, the
+    loaded ones (least recently used first) with their memory size, and
+    the batching counters.
+    """
+    return get_standard_response(resultset=get_adapter_pool().get_status())
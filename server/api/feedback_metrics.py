@@ -0,0 +1,293 @@
+import threading
+import time
+from typing import Optional
+
+import numpy as np
+
+from .json_models import get_training_metrics_source
+from .metrics_engine import ClassificationMetrics
+from .prediction_log import get_prediction_log
+from .utilities import get_non_empty_value
+
+SECONDS_PER_DAY = 86400
+
+FEEDBACK_SCHEMA = """
+CREATE TABLE IF NOT EXISTS prediction_feedback (
+    prediction_id INTEGER PRIMARY KEY,
+    predicted_category TEXT NOT NULL,
+    category TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS feedback_counts (
+    day INTEGER NOT NULL,
+    category TEXT NOT NULL,
+    predicted_category TEXT NOT NULL,
+    count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, category, predicted_category)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS feedback_state (
+    name TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+class OnlineConfusionMatrix:
+    """
+    Streaming multiclass confusion matrix (rows: true category, columns:
+    predicted category).
+
+    Besides the all-time matrix, it keeps one matrix per day for the last
+    `window_days` days in a ring buffer, so the sliding-window matrices
+    (last N days) are available without recomputing from the raw events.
+    Each event updates one cell of the all-time matrix and one cell of
+    the current day's slot: O(1).
+    """
+
+    def __init__(self, labels: list, window_days: int):
+        self.labels = list(labels)
+        self.label_index = {label: i for i, label in enumerate(self.labels)}
+        self.window_days = window_days
+        size = len(self.labels)
+        self.matrix = np.zeros((size, size), dtype=np.int64)
+        self.ring = np.zeros((window_days, size, size), dtype=np.int64)
+        # Day number (epoch days) stored in each ring slot
+        self.ring_days = np.full(window_days, -1, dtype=np.int64)
+
+    def get_index(self, label: str) -> int:
+        """
+        Get the index of a label, growing the matrices for a new label.
+        """
+        index = self.label_index.get(label)
+        if index is None:
+            index = len(self.labels)
+            self.labels.append(label)
+            self.label_index[label] = index
+            self.matrix = np.pad(self.matrix, ((0, 1), (0, 1)))
+            self.ring = np.pad(self.ring, ((0, 0), (0, 1), (0, 1)))
+        return index
+
+    def add(self, true_label: str, predicted_label: str, timestamp: float,
+            count: int = 1):
+        """
+        Add (or remove, with a negative `count`) a feedback event.
+        """
+        true_index = self.get_index(true_label)
+        predicted_index = self.get_index(predicted_label)
+        self.matrix[true_index, predicted_index] += count
+
+        day = int(timestamp // SECONDS_PER_DAY)
+        slot = day % self.window_days
+        if self.ring_days[slot] != day:
+            if self.ring_days[slot] > day:
+                # Older than the ring: only in the all-time matrix
+                return
+            self.ring[slot] = 0
+            self.ring_days[slot] = day
+        self.ring[slot, true_index, predicted_index] += count
+
+    def get_matrix(self, window_days: Optional[int] = None) -> np.ndarray:
+        """
+        Get the all-time matrix, or the matrix for the last `window_days`
+        days (including today).
+        """
+        if window_days is None:
+            return self.matrix.copy()
+        today = int(time.time() // SECONDS_PER_DAY)
+        in_window = self.ring_days > today - window_days
+        return self.ring[in_window].sum(axis=0)
+
+    def get_engine(self, window_days: Optional[int] = None
+                   ) -> ClassificationMetrics:
+        return ClassificationMetrics.from_multiclass(
+            self.get_matrix(window_days), self.labels)
+
+    def load_counts(self, rows: list):
+        """
+        Add the (day, category, predicted_category, count) rows of the
+        feedback counts table, in day order.
+        """
+        for row in rows:
+            self.add(row["category"], row["predicted_category"],
+                     row["day"] * SECONDS_PER_DAY, row["count"])
+
+
+class FeedbackMetrics:
+    """
+    Production quality metrics from the reviewers' feedback.
+
+    A feedback event confirms or corrects the category of a logged
+    prediction. It is written, in one transaction, to the feedback rows
+    and to the per-day confusion matrix counts of the shared database, so
+    the metrics cover the feedback received by all the workers. Each
+    worker rebuilds its online confusion matrix from the counts when they
+    change.
+    """
+
+    def __init__(self, prediction_log, labels: list):
+        self.prediction_log = prediction_log
+        self.labels = list(labels)
+        self.window_days = int(get_non_empty_value(
+            "FEEDBACK_WINDOW_DAYS", "30"))
+        self.lock = threading.Lock()
+        self.online_matrix = OnlineConfusionMatrix(
+            self.labels, self.window_days)
+        # (feedback version, day) the online matrix was built for
+        self.matrix_version = None
+        self.payloads = {}
+
+        connection = prediction_log.connect()
+        connection.executescript(FEEDBACK_SCHEMA)
+        with connection:
+            connection.execute("BEGIN IMMEDIATE")
+            self.backfill(connection)
+        connection.close()
+
+    def backfill(self, connection):
+        """
+        Build the counts from the feedback rows when they are missing
+        (the feedback was saved before the counts existed).
+        """
+        has_counts = connection.execute(
+            "SELECT 1 FROM feedback_counts LIMIT 1").fetchone()
+        if has_counts is not None:
+            return
+        connection.execute(
+            "INSERT INTO feedback_counts"
+            " (day, category, predicted_category, count)"
+            f" SELECT CAST(created_at / {SECONDS_PER_DAY} AS INTEGER),"
+            " category, predicted_category, COUNT(*)"
+            " FROM prediction_feedback GROUP BY 1, 2, 3")
+        # Snapshot of the counts kept in memory by older versions
+        connection.execute(
+            "DELETE FROM feedback_state WHERE name = ?",
+            ["online_confusion_matrix"])
+
+    def add_feedback(self, prediction_id: int, category: str) -> dict:
+        """
+        Record the reviewer's category for a logged prediction. A new
+        feedback for the same prediction replaces the previous one.
+
+        Raises ValueError for an unknown category and LookupError if the
+        prediction has no logged category.
+        """
+        if category not in self.labels:
+            raise ValueError(f"Unknown category: {category}")
+        created_at = time.time()
+        connection = self.prediction_log.connect()
+        try:
+            with connection:
+                # Serialize the feedback writers of all the workers, so
+                # the replaced feedback is the last committed one
+                connection.execute("BEGIN IMMEDIATE")
+                row = connection.execute(
+                    "SELECT category FROM predictions WHERE id = ?",
+                    [prediction_id]).fetchone()
+                if row is None or row["category"] is None:
+                    raise LookupError(
+                        f"Prediction {prediction_id} not found or not"
+                        " classified")
+                predicted_category = row["category"]
+                previous = connection.execute(
+                    "SELECT predicted_category, category, created_at"
+                    " FROM prediction_feedback WHERE prediction_id = ?",
+                    [prediction_id]).fetchone()
+                if previous is not None:
+                    self.add_count(
+                        connection, previous["created_at"],
+                        previous["category"],
+                        previous["predicted_category"], -1)
+                self.add_count(connection, created_at, category,
+                               predicted_category, 1)
+                connection.execute(
+                    "INSERT OR REPLACE INTO prediction_feedback"
+                    " (prediction_id, predicted_category, category,"
+                    " created_at) VALUES (?, ?, ?, ?)",
+                    [prediction_id, predicted_category, category,
+                     created_at])
+                connection.execute(
+                    "INSERT INTO feedback_state (name, value)"
+                    " VALUES ('version', 1) ON CONFLICT (name)"
+                    " DO UPDATE SET value = value + 1")
+        finally:
+            connection.close()
+        return {
+            "prediction_id": prediction_id,
+            "predicted_category": predicted_category,
+            "category": category,
+            "correct": predicted_category == category,
+        }
+
+    def add_count(self, connection, timestamp: float, category: str,
+                  predicted_category: str, count: int):
+        connection.execute(
+            "INSERT INTO feedback_counts"
+            " (day, category, predicted_category, count)"
+            " VALUES (?, ?, ?, ?) ON CONFLICT"
+            " (day, category, predicted_category)"
+            " DO UPDATE SET count = count + excluded.count",
+            [int(timestamp // SECONDS_PER_DAY), category,
+             predicted_category, count])
+
+    def get_version(self) -> tuple:
+        """
+        Get the (feedback version, day) of the shared counts.
+        """
+        rows = self.prediction_log.query(
+            "SELECT value FROM feedback_state WHERE name = 'version'")
+        return (int(rows[0]["value"]) if rows else 0,
+                int(time.time() // SECONDS_PER_DAY))
+
+    def refresh(self, version: tuple):
+        """
+        Rebuild the online confusion matrix from the shared counts if they
+        changed since it was built. The days before the window are added
+        together.
+        """
+        if version == self.matrix_version:
+            return
+        rows = self.prediction_log.query(
+            "SELECT MAX(day, ?) AS day, category, predicted_category,"
+            " SUM(count) AS count FROM feedback_counts"
+            " GROUP BY 1, 2, 3 ORDER BY 1",
+            [version[1] - self.window_days])
+        online_matrix = OnlineConfusionMatrix(self.labels, self.window_days)
+        online_matrix.load_counts(rows)
+        self.online_matrix = online_matrix
+        self.matrix_version = version
+
+    def get_engine(self, window_days: Optional[int] = None
+                   ) -> ClassificationMetrics:
+        with self.lock:
+            self.refresh(self.get_version())
+            return self.online_matrix.get_engine(window_days)
+
+    def get_payload(self, key: tuple, build_payload) -> dict:
+        """
+        Get a cached payload for `key`, built with `build_payload()` only
+        when there was new feedback (or a new day) since it was built.
+        """
+        version = self.get_version()
+        cached = self.payloads.get(key)
+        if cached is None or cached[0] != version:
+            cached = (version, build_payload())
+            self.payloads[key] = cached
+        return cached[1]
+
+
+feedback_metrics = None
+feedback_metrics_lock = threading.Lock()
+
+
+def get_feedback_metrics() -> FeedbackMetrics:
+    """
+    Get the shared feedback metrics, with the categories of the training
+    confusion matrix.
+    """
+    global feedback_metrics
+    with feedback_metrics_lock:
+        if feedback_metrics is None:
+            labels = list(get_training_metrics_source().get_metrics()[
+                "confusion_matrix"].keys())
+            feedback_metrics = FeedbackMetrics(get_prediction_log(), labels)
+    return feedback_metrics
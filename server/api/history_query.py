@@ -0,0 +1,150 @@
+import base64
+import json
+from datetime import datetime, timezone
+from typing import Optional
+
+HISTORY_FIELDS = [
+    "id", "title", "abstract", "category", "confidence", "date",
+    "processing_time", "status", "duplicate_of",
+]
+# The abstracts are the bulk of the history: only sent when requested
+DEFAULT_HISTORY_FIELDS = [
+    field for field in HISTORY_FIELDS if field != "abstract"
+]
+HISTORY_STATUSES = ["success", "error", "pending"]
+MAX_HISTORY_LIMIT = 500
+
+
+def parse_iso_date(value: str) -> float:
+    """
+    Parse an ISO 8601 date or datetime (UTC if no timezone is given) to
+    an epoch timestamp.
+    """
+    if value.endswith("Z"):
+        value = value[:-1] + "+00:00"
+    date = datetime.fromisoformat(value)
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return date.timestamp()
+
+
+def encode_cursor(timestamp: float, item_id: int) -> str:
+    """
+    Encode the position of the last returned item (the keyset).
+    """
+    return base64.urlsafe_b64encode(
+        json.dumps([timestamp, item_id]).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> tuple:
+    try:
+        timestamp, item_id = json.loads(
+            base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return float(timestamp), int(item_id)
+    except Exception:
+        raise ValueError(f"Invalid cursor: {cursor}")
+
+
+class HistoryQuery:
+    """
+    Classification history query: keyset pagination (newest first),
+    filters and field projection.
+
+    Raises ValueError for invalid parameters.
+    """
+
+    def __init__(
+        self,
+        limit: int = 20,
+        cursor: Optional[str] = None,
+        category: Optional[str] = None,
+        status: Optional[str] = None,
+        date_from: Optional[str] = None,
+        date_to: Optional[str] = None,
+        min_confidence: Optional[float] = None,
+        max_confidence: Optional[float] = None,
+        fields: Optional[str] = None,
+    ):
+        if limit < 1 or limit > MAX_HISTORY_LIMIT:
+            raise ValueError(
+                f"limit must be between 1 and {MAX_HISTORY_LIMIT}")
+        if status is not None and status not in HISTORY_STATUSES:
+            raise ValueError(
+                f"status must be one of: {', '.join(HISTORY_STATUSES)}")
+        self.limit = limit
+        self.cursor = decode_cursor(cursor) if cursor else None
+        self.category = category
+        self.status = status
+        try:
+            self.date_from = parse_iso_date(date_from) \
+                if date_from else None
+            self.date_to = parse_iso_date(date_to) if date_to else None
+        except ValueError:
+            raise ValueError("date_from and date_to must be ISO 8601 dates")
+        self.min_confidence = min_confidence
+        self.max_confidence = max_confidence
+        if fields:
+            self.fields = [field.strip() for field in fields.split(",")
+                           if field.strip()]
+            invalid_fields = set(self.fields) - set(HISTORY_FIELDS)
+            if invalid_fields:
+                raise ValueError(
+                    f"Invalid fields: {', '.join(sorted(invalid_fields))}")
+        else:
+            self.fields = DEFAULT_HISTORY_FIELDS
+
+    def is_default_page(self, default_limit: int) -> bool:
+        """
+        First page, without filters and with the default fields.
+        """
+        return (self.limit == default_limit and self.cursor is None
+                and not self.has_filters()
+                and self.fields == DEFAULT_HISTORY_FIELDS)
+
+    def has_filters(self) -> bool:
+        return any(value is not None for value in [
+            self.category, self.status, self.date_from, self.date_to,
+            self.min_confidence, self.max_confidence])
+
+    def matches(self, item: dict, timestamp: float,
+                use_cursor: bool = True) -> bool:
+        """
+        Check an in-memory history item against the filters and cursor.
+        """
+        confidence = item.get("confidence")
+        return not (
+            (self.category is not None
+             and item.get("category") != self.category)
+            or (self.status is not None
+                and item.get("status") != self.status)
+            or (self.date_from is not None and timestamp < self.date_from)
+            or (self.date_to is not None and timestamp > self.date_to)
+            or (self.min_confidence is not None
+                and (confidence is None
+                     or confidence < self.min_confidence))
+            or (self.max_confidence is not None
+                and (confidence is None
+                     or confidence > self.max_confidence))
+            or (use_cursor and self.cursor is not None
+                and (timestamp, item["id"]) >= self.cursor)
+        )
+
+    def project(self, item: dict) -> dict:
+        return {field: item.get(field) for field in self.fields}
+
+    def get_page(self, items: list, total_estimate: int) -> dict:
+        """
+        Build the response page from up to `limit + 1` items, each given
+        as (timestamp, item) in newest-first order.
+        """
+        has_more = len(items) > self.limit
+        items = items[:self.limit]
+        next_cursor = None
+        if has_more:
+            timestamp, item = items[-1]
+            next_cursor = encode_cursor(timestamp, item["id"])
+        return {
+            "data": [self.project(item) for _, item in items],
+            "next_cursor": next_cursor,
+            "total_estimate": total_estimate,
+        }
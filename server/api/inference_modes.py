@@ -0,0 +1,359 @@
+"""
+Execution modes of the classification model forward pass.
+
+INFERENCE_MODE is "default" (eager, fp32), one or two options joined with
+"+" (e.g. "trace+bf16"), or "auto":
+
+- "bf16": bfloat16 autocast, on CPUs with native bfloat16 support.
+- "trace": TorchScript graphs traced for a fixed set of input length
+  buckets (INFERENCE_LENGTH_BUCKETS), the inputs are padded to their
+  bucket.
+- "compile": `torch.compile` graphs, with the same length buckets.
+- "auto": benchmark the INFERENCE_BENCHMARK_MODES candidates on the host
+  and pick the fastest. The result is saved in INFERENCE_BENCHMARK_PATH,
+  so the other worker processes reuse it.
+
+A mode that fails to build, or whose predictions differ from the default
+mode, falls back to the default mode. The attention implementation
+(INFERENCE_ATTENTION, "sdpa" or "eager") is chosen when the model is
+loaded, see MLModels.
+"""
+import fcntl
+import json
+import os
+import time
+
+from .utilities import get_non_empty_value, log_info
+
+DEFAULT_MODE = "default"
+INFERENCE_OPTIONS = ["bf16", "trace", "compile"]
+DEFAULT_LENGTH_BUCKETS = "64,128,256,512"
+DEFAULT_BENCHMARK_MODES = "default,bf16,trace,trace+bf16"
+DEFAULT_BENCHMARK_PATH = "/code/data/inference_benchmark.json"
+# Max difference of the class probabilities with the default mode
+MODE_TOLERANCES = {"fp32": 1e-3, "bf16": 5e-2}
+BENCHMARK_TEXT = (
+    "Background: beta-blockers reduce mortality in chronic heart failure,"
+    " but their effect on renal function and on hepatic enzymes in older"
+    " patients with comorbid kidney disease is unclear. Methods: we"
+    " randomized adults to bisoprolol or placebo and followed them for"
+    " two years. Results: the treatment was well tolerated."
+)
+
+
+def parse_mode(mode: str) -> set:
+    """
+    Get the options of an inference mode ("default" has none).
+    """
+    options = set() if mode == DEFAULT_MODE else set(mode.split("+"))
+    unknown = options - set(INFERENCE_OPTIONS)
+    if unknown:
+        raise ValueError(f"Unknown inference options: {sorted(unknown)}."
+                         f" Valid options: {', '.join(INFERENCE_OPTIONS)}")
+    if {"trace", "compile"} <= options:
+        raise ValueError("The trace and compile options are exclusive")
+    return options
+
+
+def is_bf16_supported() -> bool:
+    """
+    Whether the CPU runs bfloat16 natively (AVX512-BF16 or AMX), where
+    bf16 autocast is faster than fp32.
+    """
+    import torch
+    try:
+        return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except Exception:
+        return False
+
+
+class InferenceRunner:
+    """
+    Run the forward pass of a model in an inference mode.
+    """
+
+    def __init__(self, model, tokenizer, mode: str = DEFAULT_MODE):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.mode = mode
+        self.options = parse_mode(mode)
+        max_length = min(
+            getattr(model.config, "max_position_embeddings", 512),
+            getattr(tokenizer, "model_max_length", 512) or 512)
+        self.buckets = sorted(
+            bucket for bucket in (
+                int(item) for item in get_non_empty_value(
+                    "INFERENCE_LENGTH_BUCKETS",
+                    DEFAULT_LENGTH_BUCKETS).split(",") if item.strip())
+            if bucket <= max_length
+        ) or [max_length]
+        # Length bucket -> traced or compiled graph
+        self.graphs = {}
+
+    def prepare(self):
+        """
+        Build the graphs of the length buckets and run them once.
+        """
+        import torch
+
+        if "bf16" in self.options and not is_bf16_supported():
+            raise RuntimeError("bfloat16 is not supported by this CPU")
+        if "compile" in self.options:
+            compiled = torch.compile(self.model)
+        for bucket in self.buckets:
+            inputs = self.get_example_inputs(bucket)
+            with torch.inference_mode(), self.autocast():
+                if "trace" in self.options:
+                    graph = torch.jit.trace(
+                        get_logits_module(self.model),
+                        tuple(inputs.values()), check_trace=False)
+                    self.graphs[bucket] = torch.jit.freeze(graph)
+                elif "compile" in self.options:
+                    self.graphs[bucket] = compiled
+                else:
+                    continue
+            self.forward(inputs)
+
+    def get_example_inputs(self, length: int) -> dict:
+        inputs = self.tokenizer([BENCHMARK_TEXT], return_tensors="pt",
+                                padding="max_length", max_length=length,
+                                truncation=True)
+        return {name: inputs[name] for name in self.get_input_names(inputs)}
+
+    @staticmethod
+    def get_input_names(inputs) -> list:
+        return [name for name in ("input_ids", "attention_mask",
+                                  "token_type_ids") if name in inputs]
+
+    def autocast(self):
+        import torch
+        return torch.autocast("cpu", dtype=torch.bfloat16,
+                              enabled="bf16" in self.options)
+
+    def forward(self, inputs):
+        """
+        Get the fp32 logits of tokenized inputs.
+        """
+        return self.forward_outputs(inputs)[0]
+
+    def forward_outputs(self, inputs) -> tuple:
+        """
+        Get the fp32 logits and pooled embeddings (mean of the last hidden
+        states) of tokenized inputs, from the same forward pass. With
+        graphs, the inputs are padded to their length bucket (inputs
+        longer than the last bucket run eagerly).
+        """
+        import torch
+
+        length = inputs["input_ids"].shape[1]
+        bucket = next((bucket for bucket in self.buckets
+                       if bucket >= length), None)
+        graph = self.graphs.get(bucket)
+        with torch.inference_mode(), self.autocast():
+            if graph is None:
+                outputs = self.model(**inputs, output_hidden_states=True)
+                return outputs.logits.float(), get_pooled_embeddings(
+                    outputs.hidden_states[-1], inputs["attention_mask"])
+            padded = []
+            for name in self.get_input_names(inputs):
+                value = (self.tokenizer.pad_token_id or 0) \
+                    if name == "input_ids" else 0
+                padded.append(torch.nn.functional.pad(
+                    inputs[name], (0, bucket - length), value=value))
+            if "compile" in self.options:
+                outputs = graph(**dict(zip(self.get_input_names(inputs),
+                                           padded)),
+                                output_hidden_states=True)
+                return outputs.logits.float(), get_pooled_embeddings(
+                    outputs.hidden_states[-1], padded[1])
+            logits, embeddings = graph(*padded)
+            return logits.float(), embeddings.float()
+
+    def predict(self, texts: list) -> list:
+        """
+        Get the class probabilities of a batch of texts.
+        """
+        return self.predict_with_embeddings(texts)[0]
+
+    def predict_with_embeddings(self, texts: list) -> tuple:
+        """
+        Get the class probabilities and the pooled embeddings (float32
+        numpy array) of a batch of texts.
+        """
+        import torch
+
+        inputs = self.tokenizer(texts, return_tensors="pt", padding=True,
+                                truncation=True)
+        logits, embeddings = self.forward_outputs(inputs)
+        return torch.softmax(logits, dim=-1).tolist(), embeddings.numpy()
+
+
+def get_pooled_embeddings(hidden_states, attention_mask):
+    """
+    Average the hidden states of the tokens (not the padding).
+    """
+    mask = attention_mask.unsqueeze(-1).to(hidden_states.dtype)
+    return ((hidden_states * mask).sum(dim=1)
+            / mask.sum(dim=1).clamp(min=1)).float()
+
+
+def get_logits_module(model):
+    """
+    Wrap a model in a traceable module, with positional inputs and the
+    logits and pooled embeddings as outputs.
+    """
+    import torch
+
+    class LogitsModule(torch.nn.Module):
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, input_ids, attention_mask, token_type_ids=None):
+            outputs = self.model(input_ids=input_ids,
+                                 attention_mask=attention_mask,
+                                 token_type_ids=token_type_ids,
+                                 output_hidden_states=True)
+            return outputs.logits, get_pooled_embeddings(
+                outputs.hidden_states[-1], attention_mask)
+
+    return LogitsModule(model).eval()
+
+
+def check_runner(runner: InferenceRunner, reference: list):
+    """
+    Check that the predictions of a mode match the default mode ones.
+    """
+    probabilities = runner.predict([BENCHMARK_TEXT, "heart failure"])
+    difference = max(
+        abs(value - expected)
+        for row, expected_row in zip(probabilities, reference)
+        for value, expected in zip(row, expected_row))
+    tolerance = MODE_TOLERANCES["bf16" if "bf16" in runner.options
+                                else "fp32"]
+    if difference > tolerance:
+        raise RuntimeError(f"Predictions differ from the default mode by"
+                           f" {difference:.4f}")
+
+
+def time_runner(runner: InferenceRunner, repeat: int = 3) -> float:
+    """
+    Get the mean seconds per article of a mode, for a single article and
+    a batch of 8.
+    """
+    durations = []
+    for batch_size in (1, 8):
+        texts = [BENCHMARK_TEXT] * batch_size
+        runner.predict(texts)
+        start_time = time.perf_counter()
+        for _ in range(repeat):
+            runner.predict(texts)
+        durations.append((time.perf_counter() - start_time)
+                         / repeat / batch_size)
+    return sum(durations) / len(durations)
+
+
+def get_benchmark_key(model, tokenizer) -> str:
+    import torch
+    return "|".join([
+        str(getattr(model.config, "_name_or_path", "")),
+        str(getattr(model.config, "_attn_implementation", "")),
+        torch.__version__,
+        str(torch.get_num_threads()),
+        get_non_empty_value("INFERENCE_BENCHMARK_MODES",
+                            DEFAULT_BENCHMARK_MODES),
+        get_non_empty_value("INFERENCE_LENGTH_BUCKETS",
+                            DEFAULT_LENGTH_BUCKETS),
+    ])
+
+
+def benchmark_modes(model, tokenizer) -> dict:
+    """
+    Time the INFERENCE_BENCHMARK_MODES candidates (checked against the
+    default mode). Returns the mode -> seconds per article (or error).
+    """
+    default = InferenceRunner(model, tokenizer)
+    reference = default.predict([BENCHMARK_TEXT, "heart failure"])
+    results = {}
+    for mode in get_non_empty_value("INFERENCE_BENCHMARK_MODES",
+                                    DEFAULT_BENCHMARK_MODES).split(","):
+        mode = mode.strip()
+        try:
+            runner = InferenceRunner(model, tokenizer, mode)
+            runner.prepare()
+            check_runner(runner, reference)
+            results[mode] = time_runner(runner)
+        except Exception as e:
+            results[mode] = f"error: {e}"
+        log_info(f"Inference mode {mode}: {results[mode]}")
+    return results
+
+
+def get_benchmark(model, tokenizer) -> dict:
+    """
+    Get the benchmark of the host, run by the first process and saved in
+    INFERENCE_BENCHMARK_PATH for the others (locked, so the processes do
+    not benchmark at the same time).
+    """
+    benchmark_path = get_non_empty_value("INFERENCE_BENCHMARK_PATH",
+                                         DEFAULT_BENCHMARK_PATH)
+    key = get_benchmark_key(model, tokenizer)
+    benchmark_dir = os.path.dirname(benchmark_path)
+    if benchmark_dir:
+        os.makedirs(benchmark_dir, exist_ok=True)
+    with open(f"{benchmark_path}.lock", "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            with open(benchmark_path) as file:
+                saved = json.load(file)
+        except (FileNotFoundError, ValueError):
+            saved = {}
+        if key in saved:
+            return saved[key]
+        benchmark = {"created_at": time.time(),
+                     "results": benchmark_modes(model, tokenizer)}
+        saved[key] = benchmark
+        temp_path = f"{benchmark_path}.{os.getpid()}.tmp"
+        with open(temp_path, "w") as file:
+            json.dump(saved, file, indent=2)
+        os.replace(temp_path, benchmark_path)
+        return benchmark
+
+
+def get_inference_runner(model, tokenizer, mode: str) -> tuple:
+    """
+    Build the runner of an inference mode ("auto" benchmarks the host),
+    falling back to the default mode if the mode cannot be used.
+
+    Returns the runner and a report of the selection.
+    """
+    report = {"requested": mode, "mode": DEFAULT_MODE, "error": None,
+              "benchmark": None}
+    default = InferenceRunner(model, tokenizer)
+    if mode == "auto":
+        try:
+            benchmark = get_benchmark(model, tokenizer)
+        except Exception as e:
+            report["error"] = f"Benchmark failed: {e}"
+            log_info(report["error"])
+            return default, report
+        report["benchmark"] = benchmark["results"]
+        timings = {mode: seconds
+                   for mode, seconds in benchmark["results"].items()
+                   if isinstance(seconds, float)}
+        mode = min(timings, key=timings.get) if timings else DEFAULT_MODE
+    if mode == DEFAULT_MODE:
+        return default, report
+
+    try:
+        runner = InferenceRunner(model, tokenizer, mode)
+        runner.prepare()
+        check_runner(runner, default.predict([BENCHMARK_TEXT,
+                                              "heart failure"]))
+    except Exception as e:
+        report["error"] = f"Inference mode {mode} unavailable: {e}"
+        log_info(f"{report['error']}. Using the default mode")
+        return default, report
+    report["mode"] = mode
+    log_info(f"Inference mode: {mode}")
+    return runner, report
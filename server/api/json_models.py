@@ -1,16 +1,162 @@
 import json
 import os
+import threading
+import time
+from typing import Callable, Optional
 
+from .types import Metrics
+from .utilities import (
+    get_non_empty_value,
+    get_serialized_payload,
+    log_info,
+)
 
-def get_all_training_metrics() -> dict:
+
+def get_training_metrics_file_path() -> str:
     """
-    Get the training metrics for the model.
+    Get the path of the training metrics JSON file.
     """
     dir_path = os.path.dirname(os.path.realpath(__file__))
-    file_path = os.path.join(
+    return os.path.join(
         dir_path, "..", "data",
         "model_training_data.json")
-    if not os.path.exists(file_path):
-        raise FileNotFoundError(f"File not found: {file_path}")
-    with open(file_path) as f:
-        return json.load(f)
+
+
+class TrainingMetricsSource:
+    """
+    Single source of the training metrics (model_training_data.json).
+
+    The file is read once, then a background thread watches its mtime
+    and reloads it only when it changes. The new metrics are swapped in
+    atomically and the listeners are notified with the old and new
+    metrics, so derived views can be rebuilt.
+    """
+
+    def __init__(self, file_path: str = None):
+        self.debug = os.environ.get("SERVER_DEBUG", "0") == "1"
+        self.file_path = file_path or get_training_metrics_file_path()
+        self.poll_interval = float(get_non_empty_value(
+            "METRICS_RELOAD_INTERVAL", "5"))
+        self.metrics = None
+        self.payload = None
+        self.file_stat = None
+        self.listeners = []
+        self.lock = threading.Lock()
+        self.thread = None
+
+        if not os.path.exists(self.file_path):
+            raise FileNotFoundError(f"File not found: {self.file_path}")
+        self.reload_if_changed()
+
+    def get_metrics(self) -> dict:
+        return self.metrics
+
+    def get_payload(self) -> dict:
+        """
+        Get the serialized /training_metrics response, validated against
+        the `Metrics` model once per load instead of on every request.
+        """
+        return self.payload
+
+    def add_listener(self, listener: Callable[[dict, dict], None]):
+        """
+        Register a function called as `listener(old_metrics, new_metrics)`
+        after each reload.
+        """
+        self.listeners.append(listener)
+
+    def get_file_stat(self) -> Optional[tuple]:
+        try:
+            stat = os.stat(self.file_path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def reload_if_changed(self) -> bool:
+        """
+        Reload the metrics if the file changed since the last load.
+        Returns True if the metrics were reloaded.
+        """
+        with self.lock:
+            file_stat = self.get_file_stat()
+            if file_stat is None or file_stat == self.file_stat:
+                return False
+            try:
+                with open(self.file_path) as f:
+                    new_metrics = json.load(f)
+            except ValueError as e:
+                # The file may be in the middle of a write: keep serving
+                # the current metrics and retry on the next check.
+                if self.metrics is None:
+                    raise
+                log_info(f"Error reloading {self.file_path}: {e}")
+                return False
+            try:
+                payload = get_serialized_payload(
+                    Metrics.model_validate(new_metrics).model_dump())
+            except ValueError as e:
+                if self.metrics is None:
+                    raise
+                log_info(f"Invalid training metrics in {self.file_path}:"
+                         f" {e}")
+                return False
+            old_metrics = self.metrics
+            self.metrics = new_metrics
+            self.payload = payload
+            self.file_stat = file_stat
+
+        if old_metrics is not None:
+            log_info(f"Training metrics reloaded from {self.file_path}")
+        for listener in self.listeners:
+            try:
+                listener(old_metrics, new_metrics)
+            except Exception as e:
+                log_info(f"Error in training metrics listener: {e}")
+        return True
+
+    def watch(self):
+        while True:
+            time.sleep(self.poll_interval)
+            try:
+                self.reload_if_changed()
+            except Exception as e:
+                log_info(f"Error watching {self.file_path}: {e}")
+
+    def start(self):
+        """
+        Start the background watcher thread (METRICS_RELOAD_INTERVAL=0
+        disables it).
+        """
+        if self.thread is not None or self.poll_interval <= 0:
+            return
+        self.thread = threading.Thread(
+            target=self.watch, name="training-metrics-watcher",
+            daemon=True)
+        self.thread.start()
+        if self.debug:
+            print(f">> TrainingMetricsSource | watching {self.file_path}"
+                  f" every {self.poll_interval}s")
+
+
+training_metrics_source = None
+training_metrics_source_lock = threading.Lock()
+
+
+def get_training_metrics_source() -> TrainingMetricsSource:
+    """
+    Get the shared training metrics source, starting its watcher on the
+    first call.
+    """
+    global training_metrics_source
+    with training_metrics_source_lock:
+        if training_metrics_source is None:
+            training_metrics_source = TrainingMetricsSource()
+            training_metrics_source.start()
+    return training_metrics_source
+
+
+def get_all_training_metrics() -> dict:
+    """
+    Get the training metrics for the model.
+    """
+    return get_training_metrics_source().get_metrics()
@@ -0,0 +1,117 @@
+import math
+from typing import Optional
+
+DEFAULT_RELATIVE_ACCURACY = 0.01
+
+
+class LatencySketch:
+    """
+    Mergeable quantile sketch for latencies (DDSketch-style).
+
+    Values are counted in logarithmic buckets, so any quantile is
+    returned with a bounded relative error (`relative_accuracy`), the
+    size stays small (a few hundred buckets cover microseconds to hours)
+    and two sketches are merged by adding their bucket counts. That makes
+    it suitable to aggregate per time bucket and across workers.
+    """
+
+    def __init__(self, relative_accuracy: float = DEFAULT_RELATIVE_ACCURACY):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.bins = {}
+        self.zero_count = 0
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def get_index(self, value: float) -> int:
+        return math.ceil(math.log(value) / self.log_gamma)
+
+    def get_value(self, index: int) -> float:
+        # Middle of the bucket (gamma^(i-1), gamma^i], in the relative
+        # error sense
+        return 2 * self.gamma ** index / (self.gamma + 1)
+
+    def add(self, value: float, count: int = 1):
+        if value is None or count <= 0:
+            return
+        if value <= 0:
+            self.zero_count += count
+            value = 0.0
+        else:
+            index = self.get_index(value)
+            self.bins[index] = self.bins.get(index, 0) + count
+        self.count += count
+        self.sum += value * count
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def merge(self, other: "LatencySketch"):
+        if other.gamma != self.gamma:
+            raise ValueError("Cannot merge sketches with different accuracy")
+        for index, count in other.bins.items():
+            self.bins[index] = self.bins.get(index, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.sum += other.sum
+        if other.min is not None:
+            self.min = other.min if self.min is None \
+                else min(self.min, other.min)
+        if other.max is not None:
+            self.max = other.max if self.max is None \
+                else max(self.max, other.max)
+
+    def quantile(self, q: float) -> Optional[float]:
+        """
+        Get the value at quantile `q` (0 <= q <= 1), or None if empty.
+        """
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        if rank < self.zero_count:
+            return 0.0
+        seen = self.zero_count
+        for index in sorted(self.bins):
+            seen += self.bins[index]
+            if seen > rank:
+                return min(max(self.get_value(index), self.min), self.max)
+        return self.max
+
+    def get_percentiles(self, percentiles: tuple = (50, 95, 99)) -> dict:
+        """
+        Get the percentiles as {"p50": value, ...}.
+        """
+        return {
+            f"p{percentile}": self.quantile(percentile / 100)
+            for percentile in percentiles
+        }
+
+    def mean(self) -> Optional[float]:
+        return self.sum / self.count if self.count else None
+
+    def to_dict(self) -> dict:
+        return {
+            "relative_accuracy": self.relative_accuracy,
+            "bins": {str(index): count for index, count in self.bins.items()},
+            "zero_count": self.zero_count,
+            "count": self.count,
+            "sum": self.sum,
+            "min": self.min,
+            "max": self.max,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "LatencySketch":
+        sketch = cls(data.get("relative_accuracy",
+                              DEFAULT_RELATIVE_ACCURACY))
+        sketch.bins = {
+            int(index): count for index, count in data["bins"].items()
+        }
+        sketch.zero_count = data["zero_count"]
+        sketch.count = data["count"]
+        sketch.sum = data["sum"]
+        sketch.min = data["min"]
+        sketch.max = data["max"]
+        return sketch
@@ -0,0 +1,220 @@
+import asyncio
+import json
+import threading
+import time
+from typing import AsyncIterator
+
+from .utilities import get_non_empty_value, log_info
+
+# Seconds without events before a keep-alive comment is sent
+KEEPALIVE_INTERVAL = 15
+
+# Fields of the prediction records sent in the "predictions" events (the
+# abstracts are left out, like in the classification history)
+PREDICTION_EVENT_FIELDS = [
+    "id", "created_at", "source", "title", "category", "confidence",
+    "processing_time", "status",
+]
+# Maximum number of predictions read by a poll
+POLL_BATCH_SIZE = 500
+
+
+class LiveFeedSubscriber:
+    """
+    A live feed subscriber, consumed from its event loop.
+
+    Each subscriber has a bounded buffer. A subscriber that falls behind
+    (its buffer is full) is dropped instead of slowing down the others or
+    growing without limit.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, buffer_size: int):
+        self.loop = loop
+        self.buffer_size = buffer_size
+        # One extra slot for the end-of-stream marker
+        self.queue = asyncio.Queue(maxsize=buffer_size + 1)
+        self.closed = False
+
+    def offer(self, event: dict) -> bool:
+        """
+        Add an event to the buffer (called in the subscriber's loop).
+        Returns False if the subscriber was dropped.
+        """
+        if self.closed:
+            return False
+        if self.queue.qsize() >= self.buffer_size:
+            self.close()
+            return False
+        self.queue.put_nowait(event)
+        return True
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.queue.put_nowait(None)
+
+    async def get_event(self, timeout: float):
+        """
+        Wait for the next event. Returns None at the end of the stream and
+        {} on timeout.
+        """
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return {}
+
+
+class LiveFeed:
+    """
+    Fan-out of the live classification events to the connected clients.
+
+    The new predictions are read by id from the prediction log database,
+    which all the workers share, so the clients of any worker get the
+    predictions of all of them. A poller thread runs while there are
+    subscribers, and delivers the events to each subscriber's bounded
+    buffer.
+    """
+
+    def __init__(self, prediction_log):
+        self.prediction_log = prediction_log
+        self.buffer_size = int(get_non_empty_value(
+            "LIVE_FEED_BUFFER_SIZE", "100"))
+        self.poll_interval = float(get_non_empty_value(
+            "LIVE_FEED_POLL_INTERVAL", "0.5"))
+        self.subscribers = set()
+        self.lock = threading.Lock()
+        self.sequence = 0
+        self.dropped_subscribers = 0
+        self.thread = None
+        # Id of the last published prediction
+        self.last_id = None
+
+    def subscribe(self) -> LiveFeedSubscriber:
+        subscriber = LiveFeedSubscriber(
+            asyncio.get_running_loop(), self.buffer_size)
+        with self.lock:
+            self.subscribers.add(subscriber)
+            if self.thread is None:
+                self.thread = threading.Thread(
+                    target=self.poll_loop, name="live-feed-poller",
+                    daemon=True)
+                self.thread.start()
+        return subscriber
+
+    def unsubscribe(self, subscriber: LiveFeedSubscriber):
+        with self.lock:
+            self.subscribers.discard(subscriber)
+
+    def deliver(self, subscriber: LiveFeedSubscriber, event: dict):
+        if subscriber.offer(event):
+            return
+        with self.lock:
+            if subscriber not in self.subscribers:
+                return
+            self.subscribers.discard(subscriber)
+            self.dropped_subscribers += 1
+        log_info("Live feed: slow subscriber dropped")
+
+    def poll(self) -> list:
+        """
+        Get the predictions logged by any worker since the last poll (the
+        first poll only starts from the last logged one).
+        """
+        if self.last_id is None:
+            self.last_id = self.prediction_log.query(
+                "SELECT COALESCE(MAX(id), 0) AS id FROM predictions"
+            )[0]["id"]
+            return []
+        rows = self.prediction_log.query(
+            f"SELECT {', '.join(PREDICTION_EVENT_FIELDS)} FROM predictions"
+            " WHERE id > ? ORDER BY id LIMIT ?",
+            [self.last_id, POLL_BATCH_SIZE])
+        if rows:
+            self.last_id = rows[-1]["id"]
+        return [dict(row) for row in rows]
+
+    def poll_loop(self):
+        while True:
+            with self.lock:
+                if not self.subscribers:
+                    # Started again by the next subscriber
+                    self.thread = None
+                    self.last_id = None
+                    return
+            records = []
+            try:
+                records = self.poll()
+                if records:
+                    self.publish_predictions(records)
+            except Exception as e:
+                log_info(f"Live feed: error reading the predictions: {e}")
+            if len(records) < POLL_BATCH_SIZE:
+                time.sleep(self.poll_interval)
+
+    def publish(self, event_type: str, data):
+        """
+        Publish an event to all the subscribers.
+        """
+        with self.lock:
+            self.sequence += 1
+            event = {"id": self.sequence, "event": event_type, "data": data}
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.loop.call_soon_threadsafe(
+                    self.deliver, subscriber, event)
+            except RuntimeError:
+                # The subscriber's event loop is closed
+                self.unsubscribe(subscriber)
+
+    def publish_predictions(self, records: list):
+        """
+        Publish a batch of logged predictions: a "predictions" event with
+        the new records and a "metrics_delta" event with the batch totals,
+        so the clients can update their counters incrementally.
+        """
+        if not self.subscribers:
+            return
+        delta = {
+            "count": 0,
+            "error_count": 0,
+            "processing_time_sum": 0.0,
+            "categories": {},
+        }
+        for record in records:
+            delta["count"] += 1
+            delta["processing_time_sum"] += record["processing_time"] or 0
+            if record["status"] != "success":
+                delta["error_count"] += 1
+            elif record["category"]:
+                delta["categories"][record["category"]] = \
+                    delta["categories"].get(record["category"], 0) + 1
+        self.publish("predictions", [
+            {field: record.get(field) for field in PREDICTION_EVENT_FIELDS}
+            for record in records
+        ])
+        self.publish("metrics_delta", delta)
+
+    async def stream(self, is_disconnected) -> AsyncIterator[str]:
+        """
+        Stream the events in Server-Sent Events format until the client
+        disconnects (`is_disconnected` is an async callable) or is dropped.
+        """
+        subscriber = self.subscribe()
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                event = await subscriber.get_event(KEEPALIVE_INTERVAL)
+                if event is None:
+                    break
+                if await is_disconnected():
+                    break
+                if not event:
+                    yield ": keepalive\n\n"
+                    continue
+                yield (f"id: {event['id']}\n"
+                       f"event: {event['event']}\n"
+                       f"data: {json.dumps(event['data'])}\n\n")
+        finally:
+            self.unsubscribe(subscriber)
+            subscriber.closed = True
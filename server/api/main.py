@@ -1,45 +1,81 @@
 import os
+import threading
+import time
+from contextlib import asynccontextmanager
 from typing import Optional
 
-from fastapi import FastAPI, HTTPException, Body
+# Imported first, so the startup report covers the whole app import
+from .startup_profile import STARTUP_START_TIME, record_startup_phase
+
+from fastapi import FastAPI, HTTPException, Body, Header, Request
 from fastapi import UploadFile, File
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 
-from .ai_models import AIModels
-from .ml_models import MLModels
-from .types import Metrics, Prediction, Article
-from .dashboard_metrics import StaticDashboardMetrics
-from .dashboard_metrics_from_db import DashboardMetricsFromDb
+from .types import (
+    Metrics,
+    Prediction,
+    Article,
+    Feedback,
+    ModelVersionSpec,
+    ShadowConfig,
+)
 from .endpoint_methods import (
     read_root_tool,
-    training_metrics_tool,
+    training_metrics_payload_tool,
     predict_tool,
     pdfread_tool,
     ai_model_params_tool,
     get_assets_tool,
     health_tool,
-    dashboard_metrics_tool,
-    dashboard_confusion_matrix_tool,
-    dashboard_performance_tool,
-    dashboard_distribution_tool,
-    dashboard_analytics_tool,
-    dashboard_classification_history_tool,
+    readiness_tool,
+    warmup_tool,
+    dashboard_payload_tool,
+    dashboard_classification_history_payload_tool,
+    dashboard_live_feed_tool,
+    dashboard_runtime_tool,
+    feedback_tool,
+    batch_job_submit_tool,
+    batch_job_status_tool,
+    batch_job_cancel_tool,
+    batch_job_results_tool,
+    batch_job_workers_start_tool,
+    model_registry_status_tool,
+    model_register_tool,
+    model_activate_tool,
+    model_shadow_tool,
+    model_remove_tool,
+    adapters_tool,
+    similar_tool,
 )
 from .utilities import log_info
+from .responses import FastJSONResponse, get_cached_response
+from .compression import CompressionMiddleware
+from .admission import AdmissionMiddleware
+from .rate_limit import RateLimitMiddleware
 
-PDFREAD_USE_URL = os.environ.get("PDFREAD_USE_URL", "0") == "1"
-
-ml_model = MLModels()
 
-ai_model_params = {}
-ai_model = AIModels(params=ai_model_params)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Warm up in the background: /health answers meanwhile, and /ready
+    # once the warm-up inference is done
+    threading.Thread(target=warmup_tool, name="warmup", daemon=True).start()
+    batch_job_workers_start_tool()
+    yield
 
-dashboard_metrics_handler = StaticDashboardMetrics()
-dashboard_metrics_from_db_handler = DashboardMetricsFromDb()
 
 # Initialize the FastAPI application
-app = FastAPI(title="Biomedical Article Classifier API")
+app = FastAPI(
+    title="Biomedical Article Classifier API",
+    default_response_class=FastJSONResponse,
+    lifespan=lifespan,
+)
+
+# Admission control of the inference routes (innermost, so the rejections
+# still get the CORS headers)
+app.add_middleware(AdmissionMiddleware)
+# Per API key quotas, checked before the requests take an admission slot
+app.add_middleware(RateLimitMiddleware)
 
 CORS_ORIGIN = os.environ.get("CORS_ORIGIN", "http://localhost:3000")
 app.add_middleware(
@@ -49,7 +85,9 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(CompressionMiddleware)
 
+record_startup_phase("app_import", time.perf_counter() - STARTUP_START_TIME)
 log_info(f"API ready. CORS_ORIGIN: {CORS_ORIGIN}")
 
 @app.get("/")
@@ -58,31 +96,58 @@ def read_root() -> dict[str, str]:
 
 
 @app.get("/training_metrics", response_model=Metrics)
-def training_metrics() -> dict[str, str]:
+def training_metrics(request: Request):
     """
     Get the training metrics for the model.
     """
-    return training_metrics_tool()
+    # Validated against `Metrics` and serialized once per metrics load
+    return get_cached_response(request, training_metrics_payload_tool())
 
 
 @app.post("/predict", response_model=list[Prediction])
 def predict(
     article: Article | None = Body(default=None),
+    adapter: Optional[str] = None,
 ) -> dict[str, str]:
     """
     Predict categories for a biomedical article.
 
-    Accepts a JSON body with `title` and `abstract`.
+    Accepts a JSON body with `title` and `abstract`, and an optional
+    `adapter` query parameter to classify it with that PEFT adapter
+    (see GET /adapters).
 
     Returns a JSON object with the predicted category and confidence.
     """
-    result = predict_tool(article)
+    result = predict_tool(article, adapter=adapter)
     if result.get("error"):
         raise HTTPException(
             status_code=result.get("status_code", 500),
             detail=result.get("error_message", "Internal server error [010]")
         )
-    return result.get("resultset")
+    # The predictions are built by the model code: skip the response
+    # model validation and serialization
+    return FastJSONResponse(result.get("resultset"))
+
+
+@app.post("/similar")
+def similar(
+    article: Article | None = Body(default=None),
+    k: int = 10,
+) -> dict:
+    """
+    Get the k previously classified articles most similar to an article.
+
+    Accepts a JSON body with `title` and `abstract`. An article that was
+    not classified yet is classified first (the prediction is included in
+    the response), the search itself runs no model inference.
+    """
+    result = similar_tool(article, k)
+    if result.get("error"):
+        raise HTTPException(
+            status_code=result.get("status_code", 500),
+            detail=result.get("error_message", "Internal server error [026]")
+        )
+    return result["resultset"]
 
 
 @app.post("/pdfread", response_model=Article)
@@ -131,6 +196,122 @@ def pdfread(
     return result.get("resultset")
 
 
+@app.post("/feedback")
+def feedback(
+    feedback: Feedback = Body(...),
+) -> dict:
+    """
+    Confirm or correct the category of a classified article.
+
+    Accepts a JSON body with `prediction_id` (the `id` of the
+    classification history item) and `category` (the right category).
+    A new feedback for the same prediction replaces the previous one.
+
+    Returns the predicted and the reviewed categories, and whether the
+    prediction was correct.
+    """
+    result = feedback_tool(feedback)
+    if result.get("error"):
+        raise HTTPException(
+            status_code=result.get("status_code", 500),
+            detail=result.get("error_message", "Internal server error [016]")
+        )
+    return result.get("resultset")
+
+
+@app.post("/batch-jobs", status_code=202)
+def batch_job_submit(
+    files: list[UploadFile] = File(...),
+) -> dict:
+    """
+    Submit a batch classification job.
+
+    Accepts:
+    - Multipart form-data with one or more `files`: CSV (with `title` and
+      `abstract` columns) or NDJSON (one `{"title": ..., "abstract": ...}`
+      per line) article lists, or article files (.pdf, .docx, ...).
+
+    Returns the job status (with its `id`). The job runs in the
+    background: poll GET /batch-jobs/{job_id} and download the results
+    from GET /batch-jobs/{job_id}/results.
+
+    Example:
+    curl -X POST -F "files=@articles.csv" http://localhost:8000/batch-jobs
+    """
+    submitted_files = []
+    for file in files:
+        try:
+            submitted_files.append((file.filename, file.file.read()))
+        except Exception as e:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Error reading file: {e}"
+            )
+        finally:
+            file.file.close()
+
+    result = batch_job_submit_tool(submitted_files)
+    if result.get("error"):
+        raise HTTPException(
+            status_code=result.get("status_code", 500),
+            detail=result.get("error_message", "Internal server error [017]")
+        )
+    return result.get("resultset")
+
+
+@app.get("/batch-jobs/{job_id}")
+def batch_job_status(job_id: str) -> dict:
+    """
+    Get the status of a batch job: `status` (queued, running, completed,
+    failed or cancelled), `progress` (0 to 1), `throughput` (articles per
+    second) and `eta` (seconds).
+    """
+    result = batch_job_status_tool(job_id)
+    if result.get("error"):
+        raise HTTPException(
+            status_code=result.get("status_code", 500),
+            detail=result.get("error_message", "Internal server error [018]")
+        )
+    return result.get("resultset")
+
+
+@app.post("/batch-jobs/{job_id}/cancel")
+def batch_job_cancel(job_id: str) -> dict:
+    """
+    Cancel a batch job. A running job stops after its current chunk.
+    """
+    result = batch_job_cancel_tool(job_id)
+    if result.get("error"):
+        raise HTTPException(
+            status_code=result.get("status_code", 500),
+            detail=result.get("error_message", "Internal server error [019]")
+        )
+    return result.get("resultset")
+
+
+@app.get("/batch-jobs/{job_id}/results")
+def batch_job_results(job_id: str, format: str = "ndjson"):
+    """
+    Download the results of a batch job (the processed articles so far,
+    in input order) as NDJSON (default) or CSV (`format=csv`).
+    """
+    result = batch_job_results_tool(job_id, format)
+    if result.get("error"):
+        raise HTTPException(
+            status_code=result.get("status_code", 500),
+            detail=result.get("error_message", "Internal server error [020]")
+        )
+    resultset = result.get("resultset")
+    return StreamingResponse(
+        resultset["content"],
+        media_type=resultset["media_type"],
+        headers={
+            "Content-Disposition":
+                f'attachment; filename="{job_id}.{format}"',
+        },
+    )
+
+
 @app.get("/ai_model_params")
 def ai_model_params():
     """
@@ -169,49 +350,262 @@ def health():
     return health_tool()
 
 
+@app.get("/ready")
+def ready() -> dict:
+    """
+    Readiness check: 503 until the warm-up inference of this worker is
+    done.
+    """
+    result = readiness_tool()
+    if result["error"]:
+        raise HTTPException(
+            status_code=result.get("status_code", 500),
+            detail=result.get("error_message", "Internal server error [021]")
+        )
+    return result["resultset"]
+
+
+@app.get("/adapters")
+def adapters() -> dict:
+    """
+    Get the PEFT adapters served on the shared base model by the worker
+    that answers: available and loaded adapters (least recently used
+    first), memory sizes and batching counters.
+    """
+    return adapters_tool()["resultset"]
+
+
+@app.get("/models")
+def models() -> dict:
+    """
+    Get the model versions of the worker that answers, the active one and
+    the shadow evaluation results.
+    """
+    return model_registry_status_tool()["resultset"]
+
+
+@app.post("/models", status_code=202)
+def model_register(
+    version: ModelVersionSpec = Body(...),
+    x_api_key: Optional[str] = Header(None),
+) -> dict:
+    """
+    Register a model version (admin API key required).
+
+    Accepts a JSON body with `name`, `source` ("snapshot", "local" or
+    "cloud") and `path` (snapshot directory, local model directory or
+    hub model name). The version is loaded and warmed up in the
+    background: poll GET /models for its status.
+    """
+    result = model_register_tool(version.name, version.source, version.path,
+                                 api_key=x_api_key)
+    if result.get("error"):
+        raise HTTPException(
+            status_code=result.get("status_code", 500),
+            detail=result.get("error_message", "Internal server error [022]")
+        )
+    return result.get("resultset")
+
+
+@app.post("/models/shadow")
+def model_shadow(
+    config: ShadowConfig = Body(...),
+    x_api_key: Optional[str] = Header(None),
+) -> dict:
+    """
+    Shadow-evaluate a model version on a `sample_rate` fraction of the
+    live predictions (admin API key required). A null `name` stops the
+    shadow evaluation.
+    """
+    result = model_shadow_tool(config.name, config.sample_rate,
+                               api_key=x_api_key)
+    if result.get("error"):
+        raise HTTPException(
+            status_code=result.get("status_code", 500),
+            detail=result.get("error_message", "Internal server error [023]")
+        )
+    return result.get("resultset")
+
+
+@app.post("/models/{name}/activate")
+def model_activate(
+    name: str,
+    x_api_key: Optional[str] = Header(None),
+) -> dict:
+    """
+    Make a model version the active one (admin API key required). Each
+    worker swaps to it once it is loaded and warmed up.
+    """
+    result = model_activate_tool(name, api_key=x_api_key)
+    if result.get("error"):
+        raise HTTPException(
+            status_code=result.get("status_code", 500),
+            detail=result.get("error_message", "Internal server error [024]")
+        )
+    return result.get("resultset")
+
+
+@app.delete("/models/{name}")
+def model_remove(
+    name: str,
+    x_api_key: Optional[str] = Header(None),
+) -> dict:
+    """
+    Remove a model version, not the active one (admin API key required).
+    """
+    result = model_remove_tool(name, api_key=x_api_key)
+    if result.get("error"):
+        raise HTTPException(
+            status_code=result.get("status_code", 500),
+            detail=result.get("error_message", "Internal server error [025]")
+        )
+    return result.get("resultset")
+
+
 @app.get("/dashboard/metrics")
-def dashboard_metrics():
+def dashboard_metrics(request: Request):
     """
     Dashboard metrics endpoint.
     """
-    return dashboard_metrics_tool()
+    return get_cached_response(request, dashboard_payload_tool("metrics"))
 
 
 @app.get("/dashboard/confusion-matrix")
-def dashboard_confusion_matrix():
+def dashboard_confusion_matrix(
+    request: Request,
+    source: str = "training",
+    window_days: Optional[int] = None,
+):
     """
     Dashboard confusion matrix endpoint.
+
+    Query parameters:
+    - source: "training" (default) or "feedback" (from the reviewers'
+      feedback sent to /feedback).
+    - window_days: with source=feedback, only the last N days.
     """
-    return dashboard_confusion_matrix_tool()
+    result = dashboard_payload_tool("confusion-matrix", source, window_days)
+    if result.get("error"):
+        raise HTTPException(
+            status_code=result.get("status_code", 500),
+            detail=result.get("error_message", "Internal server error [014]")
+        )
+    return get_cached_response(request, result)
 
 
 @app.get("/dashboard/performance")
-def dashboard_performance():
+def dashboard_performance(
+    request: Request,
+    source: str = "training",
+    window_days: Optional[int] = None,
+):
     """
     Dashboard performance endpoint.
+
+    Query parameters: same as /dashboard/confusion-matrix.
     """
-    return dashboard_performance_tool()
+    result = dashboard_payload_tool("performance", source, window_days)
+    if result.get("error"):
+        raise HTTPException(
+            status_code=result.get("status_code", 500),
+            detail=result.get("error_message", "Internal server error [015]")
+        )
+    return get_cached_response(request, result)
 
 
 @app.get("/dashboard/distribution")
-def dashboard_distribution():
+def dashboard_distribution(request: Request):
     """
     Dashboard distribution endpoint.
     """
-    return dashboard_distribution_tool()
+    return get_cached_response(
+        request, dashboard_payload_tool("distribution"))
 
 
 @app.get("/dashboard/analytics")
-def dashboard_analytics():
+def dashboard_analytics(request: Request):
     """
     Dashboard analytics endpoint.
     """
-    return dashboard_analytics_tool()
+    return get_cached_response(
+        request, dashboard_payload_tool("analytics"))
 
 
 @app.get("/dashboard/classification-history")
-def dashboard_classification_history():
+def dashboard_classification_history(
+    request: Request,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    category: Optional[str] = None,
+    status: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    min_confidence: Optional[float] = None,
+    max_confidence: Optional[float] = None,
+    fields: Optional[str] = None,
+):
     """
     Dashboard classification history endpoint.
+
+    Returns the history newest first, one page at a time:
+    `{"data": [...], "next_cursor": "...", "total_estimate": 123}`.
+    Pass `next_cursor` as `cursor` to get the next page.
+
+    Query parameters:
+    - limit: page size.
+    - category, status: filter by exact value.
+    - date_from, date_to: ISO 8601 date range.
+    - min_confidence, max_confidence: confidence range.
+    - fields: comma separated fields to return (the abstract is left out
+      by default).
+    """
+    result = dashboard_classification_history_payload_tool(
+        limit=limit,
+        cursor=cursor,
+        category=category,
+        status=status,
+        date_from=date_from,
+        date_to=date_to,
+        min_confidence=min_confidence,
+        max_confidence=max_confidence,
+        fields=fields,
+    )
+    if result.get("error"):
+        raise HTTPException(
+            status_code=result.get("status_code", 500),
+            detail=result.get("error_message", "Internal server error [013]")
+        )
+    return get_cached_response(request, result)
+
+
+@app.get("/dashboard/runtime")
+def dashboard_runtime() -> dict:
+    """
+    Dashboard runtime gauges of the server process that answers (e.g.
+    the admission queue depths, the rate limiter counters and the
+    single-flight coalescing counters of /predict and /pdfread).
+    """
+    return dashboard_runtime_tool()
+
+
+@app.get("/dashboard/live")
+async def dashboard_live(request: Request):
+    """
+    Dashboard live feed (Server-Sent Events).
+
+    Streams a "predictions" event with the new classifications and a
+    "metrics_delta" event with the counters increment of each logged
+    batch, instead of polling the /dashboard endpoints.
+
+    Example:
+    curl -N http://localhost:8000/dashboard/live
     """
-    return dashboard_classification_history_tool()
+    return StreamingResponse(
+        dashboard_live_feed_tool(request.is_disconnected),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            # Disable the Nginx proxy buffering for the stream
+            "X-Accel-Buffering": "no",
+        },
+    )
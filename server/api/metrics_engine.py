@@ -0,0 +1,138 @@
+import numpy as np
+
+
+def safe_divide(numerator, denominator) -> np.ndarray:
+    """
+    Element-wise division returning 0 where the denominator is 0.
+    """
+    numerator = np.asarray(numerator, dtype=np.float64)
+    denominator = np.asarray(denominator, dtype=np.float64)
+    return np.divide(numerator, denominator,
+                     out=np.zeros_like(numerator),
+                     where=denominator != 0)
+
+
+def mean_or_zero(values: np.ndarray) -> float:
+    return float(values.mean()) if values.size else 0.0
+
+
+class ClassificationMetrics:
+    """
+    Vectorized classification metrics engine.
+
+    Computes per-class and macro/micro/weighted precision, recall, F1,
+    accuracy and support in one pass over the per-class TP/FP/FN/TN
+    vectors, so it scales to hundreds of labels.
+
+    Build it with:
+      - `from_multiclass(matrix, labels)`: full NxN multiclass confusion
+        matrix (rows: true class, columns: predicted class).
+      - `from_multilabel(matrices, labels)`: (N, 2, 2) stack of per-label
+        matrices, in the `[[tp, fp], [fn, tn]]` layout used by
+        `model_training_data.json`.
+      - `from_dict(cm)`: the `confusion_matrix` dict from
+        `model_training_data.json` (category -> 2x2 matrix).
+    """
+
+    def __init__(self, labels: list, tp, fp, fn, tn, support, counts,
+                 multilabel: bool):
+        self.labels = list(labels)
+        self.multilabel = multilabel
+        self.tp = np.asarray(tp, dtype=np.int64)
+        self.fp = np.asarray(fp, dtype=np.int64)
+        self.fn = np.asarray(fn, dtype=np.int64)
+        self.tn = np.asarray(tn, dtype=np.int64)
+        self.support = np.asarray(support, dtype=np.int64)
+        # Examples evaluated per class: the whole per-label matrix for
+        # multilabel, the true-class support for multiclass.
+        self.counts = np.asarray(counts, dtype=np.int64)
+        self.compute()
+
+    @classmethod
+    def from_multiclass(cls, matrix, labels: list
+                        ) -> "ClassificationMetrics":
+        matrix = np.asarray(matrix, dtype=np.int64)
+        if matrix.ndim != 2 or matrix.shape[0] != matrix.shape[1]:
+            raise ValueError(
+                f"Expected a NxN confusion matrix, got {matrix.shape}")
+        tp = np.diag(matrix)
+        row_sum = matrix.sum(axis=1)
+        fp = matrix.sum(axis=0) - tp
+        fn = row_sum - tp
+        tn = matrix.sum() - tp - fp - fn
+        return cls(labels, tp, fp, fn, tn, support=row_sum, counts=row_sum,
+                   multilabel=False)
+
+    @classmethod
+    def from_multilabel(cls, matrices, labels: list
+                        ) -> "ClassificationMetrics":
+        matrices = np.asarray(matrices, dtype=np.int64).reshape(-1, 2, 2)
+        tp = matrices[:, 0, 0]
+        fp = matrices[:, 0, 1]
+        fn = matrices[:, 1, 0]
+        tn = matrices[:, 1, 1]
+        return cls(labels, tp, fp, fn, tn, support=tp + fn,
+                   counts=matrices.sum(axis=(1, 2)), multilabel=True)
+
+    @classmethod
+    def from_dict(cls, cm: dict) -> "ClassificationMetrics":
+        labels = list(cm.keys())
+        return cls.from_multilabel([cm[label] for label in labels], labels)
+
+    def compute(self):
+        tp, fp, fn, tn = self.tp, self.fp, self.fn, self.tn
+
+        self.precision = safe_divide(tp, tp + fp)
+        self.recall = safe_divide(tp, tp + fn)
+        self.f1_score = safe_divide(2 * tp, 2 * tp + fp + fn)
+        self.accuracy = safe_divide(tp + tn, tp + fp + fn + tn)
+        self.total_predictions = int(self.counts.sum())
+
+        weights = safe_divide(self.support, self.support.sum())
+        micro_tp, micro_fp, micro_fn = tp.sum(), fp.sum(), fn.sum()
+        micro_precision = safe_divide(micro_tp, micro_tp + micro_fp)
+        micro_recall = safe_divide(micro_tp, micro_tp + micro_fn)
+        if self.multilabel:
+            overall_accuracy = safe_divide((tp + tn).sum(),
+                                           (tp + fp + fn + tn).sum())
+        else:
+            overall_accuracy = safe_divide(micro_tp, self.support.sum())
+
+        self.averages = {
+            "macro": {
+                "precision": mean_or_zero(self.precision),
+                "recall": mean_or_zero(self.recall),
+                "f1_score": mean_or_zero(self.f1_score),
+            },
+            "micro": {
+                "precision": float(micro_precision),
+                "recall": float(micro_recall),
+                "f1_score": float(safe_divide(
+                    2 * micro_tp, 2 * micro_tp + micro_fp + micro_fn)),
+            },
+            "weighted": {
+                "precision": float((self.precision * weights).sum()),
+                "recall": float((self.recall * weights).sum()),
+                "f1_score": float((self.f1_score * weights).sum()),
+            },
+            "accuracy": float(overall_accuracy),
+            "support": int(self.support.sum()),
+        }
+
+    def per_class(self, values: np.ndarray) -> dict:
+        """
+        Map a per-class vector to a {label: value} dict of Python numbers.
+        """
+        return dict(zip(self.labels, values.tolist()))
+
+    def to_label_matrices(self) -> dict:
+        """
+        Get the per-label 2x2 matrices ({label: [[tp, fp], [fn, tn]]}),
+        the layout of `model_training_data.json`.
+        """
+        return {
+            label: [[tp, fp], [fn, tn]]
+            for label, tp, fp, fn, tn in zip(
+                self.labels, self.tp.tolist(), self.fp.tolist(),
+                self.fn.tolist(), self.tn.tolist())
+        }
@@ -1,17 +1,39 @@
 import os
+import threading
+import time
 
-from transformers import AutoModelForSequenceClassification, AutoTokenizer
-import torch
-
+from .startup_profile import startup_phase
 from .utilities import get_non_empty_value
 
+DEFAULT_LABELS = ["neurological", "hepatorenal", "cardiovascular",
+                  "oncological"]
+WARMUP_TEXT = "Warm-up: a randomized trial of beta-blockers in heart failure."
+
+
+def get_prediction_response(labels: list, predictions_list: list) -> dict:
+    """
+    Build the response of a prediction from the label probabilities.
+    """
+    best = max(range(len(predictions_list)), key=predictions_list.__getitem__)
+    return {
+        "predicted_label": labels[best],
+        "predicted_labels": [
+            {"label": label, "score": score}
+            for label, score in zip(labels, predictions_list)
+        ],
+        "predictions": predictions_list
+    }
+
 
 class MLModels:
-    def __init__(self):
+    def __init__(self, params: dict = None):
         self.tokenizer = None
         self.model = None
-        self.labels = ["neurological", "hepatorenal", "cardiovascular",
-                       "oncological"]
+        self.snapshot = None
+        self.runner = None
+        self.runner_lock = threading.Lock()
+        self.inference = None
+        self.labels = list(DEFAULT_LABELS)
         self.debug = os.environ.get("SERVER_DEBUG", "0") == "1"
         self.params = {
             "BASE_MODEL_NAME": get_non_empty_value("BASE_MODEL_NAME",
@@ -24,8 +46,21 @@ class MLModels:
                                                     "/code/saved_models"),
             "LOCAL_MODEL_TOKENIZER_PATH": get_non_empty_value(
                 "LOCAL_MODEL_TOKENIZER_PATH",
-                "/code/saved_models")
+                "/code/saved_models"),
+            # Offline snapshot (see model_snapshot.py), used instead of the
+            # models above when set
+            "MODEL_SNAPSHOT_PATH": get_non_empty_value(
+                "MODEL_SNAPSHOT_PATH", ""),
+            # Attention implementation, and forward pass mode (see
+            # inference_modes.py)
+            "INFERENCE_ATTENTION": get_non_empty_value(
+                "INFERENCE_ATTENTION", "sdpa"),
+            "INFERENCE_MODE": get_non_empty_value("INFERENCE_MODE",
+                                                  "default"),
         }
+        # Overrides of the environment configuration (e.g. a model
+        # registry version)
+        self.params.update(params or {})
 
         if self.debug:
             print(f"MLModels: {self.params}")
@@ -34,15 +69,18 @@ class MLModels:
         self.load_model()
 
     def load_model(self):
-        if self.params["USE_LOCAL_MODEL"]:
+        # Imported here, so only the processes that classify pay for them
+        with startup_phase("import_transformers"):
+            from transformers import AutoTokenizer
+        if self.params["MODEL_SNAPSHOT_PATH"]:
+            self.load_snapshot(self.params["MODEL_SNAPSHOT_PATH"])
+        elif self.params["USE_LOCAL_MODEL"]:
             # Load model from local path
             try:
                 self.tokenizer = AutoTokenizer.from_pretrained(
                     self.params["BASE_MODEL_NAME"])
-                self.model = \
-                    AutoModelForSequenceClassification.from_pretrained(
-                        self.params["LOCAL_MODEL_PATH"],
-                        num_labels=len(self.labels))
+                self.model = self.load_pretrained_model(
+                    self.params["LOCAL_MODEL_PATH"])
                 print("Local model loaded successfully")
             except Exception as e:
                 print(f"Error loading the local model: {e}")
@@ -51,15 +89,79 @@ class MLModels:
             try:
                 self.tokenizer = AutoTokenizer.from_pretrained(
                     self.params["BASE_MODEL_NAME"])
-                self.model = \
-                    AutoModelForSequenceClassification.from_pretrained(
-                        self.params["CLOUD_MODEL_NAME"],
-                        num_labels=len(self.labels))
+                self.model = self.load_pretrained_model(
+                    self.params["CLOUD_MODEL_NAME"])
                 print("HF model loaded successfully")
             except Exception as e:
                 print(f"Error loading the HF model: {e}")
 
+    def load_pretrained_model(self, model_name: str):
+        """
+        Load the classification model with the INFERENCE_ATTENTION
+        attention implementation, or the eager one if the model does not
+        support it.
+        """
+        from transformers import AutoModelForSequenceClassification
+
+        attention = self.params["INFERENCE_ATTENTION"]
+        try:
+            return AutoModelForSequenceClassification.from_pretrained(
+                model_name, num_labels=len(self.labels),
+                attn_implementation=attention)
+        except (ValueError, ImportError) as e:
+            if attention == "eager":
+                raise
+            print(f"Attention {attention} not supported ({e}), using eager")
+            return AutoModelForSequenceClassification.from_pretrained(
+                model_name, num_labels=len(self.labels),
+                attn_implementation="eager")
+
+    def load_snapshot(self, path: str):
+        """
+        Load the tokenizer and the model of an offline snapshot, with the
+        weights memory-mapped (no network access, and the processes of the
+        host share the weights pages).
+        """
+        from .model_snapshot import load_snapshot
+        try:
+            self.tokenizer, self.model, self.snapshot = load_snapshot(
+                path, self.params["INFERENCE_ATTENTION"])
+            self.labels = self.snapshot.get("labels") or self.labels
+            print(f"Model snapshot {self.snapshot['version']} loaded"
+                  f" successfully (memory-mapped: {self.snapshot['mmap']})")
+        except Exception as e:
+            print(f"Error loading the model snapshot {path}: {e}")
+
+    def warmup(self) -> float:
+        """
+        Run a warm-up inference (the first forward pass is much slower
+        than the next ones). Returns its duration in seconds.
+        """
+        if self.model is None:
+            raise RuntimeError("The model is not loaded")
+        self.get_runner()
+        start_time = time.perf_counter()
+        self.predict_infer_batch([WARMUP_TEXT])
+        return time.perf_counter() - start_time
+
+    def get_runner(self):
+        """
+        Get the runner of the forward pass in the INFERENCE_MODE mode,
+        built on first use ("auto" benchmarks the modes on the host).
+        """
+        with self.runner_lock:
+            if self.runner is None:
+                from .inference_modes import get_inference_runner
+                with startup_phase("inference_mode"):
+                    self.runner, self.inference = get_inference_runner(
+                        self.model, self.tokenizer,
+                        self.params["INFERENCE_MODE"])
+                self.inference["attention"] = getattr(
+                    self.model.config, "_attn_implementation", None)
+        return self.runner
+
     def predict_infer(self, text):
+        import torch
 
         print('>> predict_infer | Text:', text)
 
@@ -67,13 +169,13 @@ class MLModels:
         inputs = self.tokenizer(text, return_tensors="pt")
         print('>> predict_infer | Inputs:', inputs)
 
-        # Get model predictions
-        with torch.no_grad():
-            outputs = self.model(**inputs)
-        print('>> predict_infer | Outputs:', outputs)
+        # Get model predictions (in the inference mode), and the pooled
+        # embedding of the same forward pass
+        logits, embeddings = self.get_runner().forward_outputs(inputs)
+        print('>> predict_infer | Logits:', logits)
 
         # Apply softmax to get probabilities
-        predictions = torch.softmax(outputs.logits, dim=-1)
+        predictions = torch.softmax(logits, dim=-1)
         print('>> predict_infer | Predictions:', predictions)
 
         # Get the predicted class
@@ -99,7 +201,48 @@ class MLModels:
         response = {
             "predicted_label": predicted_label,
             "predicted_labels": predicted_labels,
-            "predictions": predictions_list
+            "predictions": predictions_list,
+            "embedding": embeddings.numpy()[0]
         }
 
         return response
+
+    def predict_infer_batch(self, texts: list) -> list:
+        """
+        Predict a batch of texts in one forward pass (padded to the
+        longest text, or to its length bucket in the graph modes, and
+        truncated to the model maximum length).
+
+        Returns one response per text, like `predict_infer()`, with the
+        pooled "embedding" of the text (numpy array) from the same forward
+        pass.
+        """
+        predictions, embeddings = \
+            self.get_runner().predict_with_embeddings(texts)
+
+        responses = [
+            {**get_prediction_response(self.labels, predictions_list),
+             "embedding": embedding}
+            for predictions_list, embedding in zip(predictions, embeddings)
+        ]
+        if self.debug:
+            print(f'>> predict_infer_batch | {len(texts)} texts predicted')
+        return responses
+
+
+ml_model = None
+ml_model_lock = threading.Lock()
+
+
+def get_ml_model() -> MLModels:
+    """
+    Get the shared classification model, loaded once per process. The
+    production server loads it in the master process, so the forked
+    workers share its weights.
+    """
+    global ml_model
+    with ml_model_lock:
+        if ml_model is None:
+            with startup_phase("model_load"):
+                ml_model = MLModels()
+    return ml_model
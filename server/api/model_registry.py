@@ -0,0 +1,448 @@
+import fcntl
+import json
+import os
+import queue
+import random
+import re
+import threading
+import time
+from typing import Optional
+
+from .latency_sketch import LatencySketch
+from .ml_models import MLModels, get_ml_model
+from .utilities import get_non_empty_value, log_info
+
+DEFAULT_MODEL_REGISTRY_PATH = "/code/data/model_registry.json"
+# Version of the model configured by the environment (see MLModels)
+DEFAULT_VERSION = "default"
+MODEL_SOURCES = ["snapshot", "local", "cloud"]
+VERSION_NAME_PATTERN = re.compile(r"^[A-Za-z0-9][A-Za-z0-9._-]{0,63}$")
+
+
+def get_version_params(source: str, path: Optional[str]) -> dict:
+    """
+    Get the MLModels parameters that load a model version.
+    """
+    if source == "snapshot":
+        return {"MODEL_SNAPSHOT_PATH": path}
+    params = {"MODEL_SNAPSHOT_PATH": "",
+              "USE_LOCAL_MODEL": source == "local"}
+    if path:
+        params["LOCAL_MODEL_PATH" if source == "local"
+               else "CLOUD_MODEL_NAME"] = path
+    return params
+
+
+class ModelVersion:
+    def __init__(self, name: str, source: str, path: Optional[str] = None):
+        self.name = name
+        self.source = source
+        self.path = path
+        self.status = "registered"
+        self.model = None
+        self.error = None
+        self.loaded_at = None
+        self.warmup_time = None
+
+    def load(self):
+        """
+        Load the model and run a warm-up inference, so the version is only
+        "ready" once it can serve at full speed.
+        """
+        self.status = "loading"
+        try:
+            model = get_ml_model() if self.name == DEFAULT_VERSION \
+                else MLModels(params=get_version_params(self.source,
+                                                        self.path))
+            self.warmup_time = model.warmup()
+            self.model = model
+            self.loaded_at = time.time()
+            self.status = "ready"
+            self.error = None
+        except Exception as e:
+            self.status = "failed"
+            self.error = str(e)
+            log_info(f"Model version {self.name} failed to load: {e}")
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "source": self.source,
+            "path": self.path,
+            "status": self.status,
+            "error": self.error,
+            "loaded_at": self.loaded_at,
+            "warmup_time": self.warmup_time,
+        }
+
+
+class ShadowEvaluation:
+    """
+    Run a candidate model on a sampled fraction of the live predictions,
+    in a background thread (off the request path), and record how often
+    it agrees with the active model and the latency of both.
+
+    The queue is bounded: samples are dropped rather than slowing down
+    the requests when the candidate cannot keep up.
+    """
+
+    def __init__(self, version: ModelVersion, active_name: str,
+                 sample_rate: float, queue_size: int):
+        self.version = version
+        self.active_name = active_name
+        self.sample_rate = sample_rate
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.lock = threading.Lock()
+        self.started_at = time.time()
+        self.samples = 0
+        self.agreements = 0
+        self.errors = 0
+        self.dropped = 0
+        self.active_latency = LatencySketch()
+        self.candidate_latency = LatencySketch()
+        self.thread = threading.Thread(
+            target=self.run, name=f"shadow-{version.name}", daemon=True)
+        self.thread.start()
+
+    def submit(self, texts: list, responses: list, latency: float):
+        """
+        Sample predictions of the active model (`latency` is the time of
+        the whole batch) for the candidate.
+        """
+        for text, response in zip(texts, responses):
+            if random.random() >= self.sample_rate:
+                continue
+            try:
+                self.queue.put_nowait((text, response["predicted_label"],
+                                       latency / len(texts)))
+            except queue.Full:
+                with self.lock:
+                    self.dropped += 1
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            text, active_label, active_latency = item
+            start_time = time.perf_counter()
+            try:
+                response = self.version.model.predict_infer_batch([text])[0]
+            except Exception as e:
+                with self.lock:
+                    self.errors += 1
+                log_info(f"Shadow model {self.version.name} error: {e}")
+                continue
+            candidate_latency = time.perf_counter() - start_time
+            with self.lock:
+                self.samples += 1
+                self.agreements += \
+                    response["predicted_label"] == active_label
+                self.active_latency.add(active_latency * 1000)
+                self.candidate_latency.add(candidate_latency * 1000)
+
+    def stop(self):
+        try:
+            self.queue.put_nowait(None)
+        except queue.Full:
+            # Let the thread finish the queued samples, then stop
+            threading.Thread(target=self.queue.put, args=[None],
+                             daemon=True).start()
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            return {
+                "candidate": self.version.name,
+                "active": self.active_name,
+                "sample_rate": self.sample_rate,
+                "started_at": self.started_at,
+                "samples": self.samples,
+                "agreements": self.agreements,
+                "agreement_rate": self.agreements / self.samples
+                if self.samples else None,
+                "errors": self.errors,
+                "dropped": self.dropped,
+                "latency_ms": {
+                    "active": {**self.active_latency.get_percentiles(),
+                               "mean": self.active_latency.mean()},
+                    "candidate": {**self.candidate_latency.get_percentiles(),
+                                  "mean": self.candidate_latency.mean()},
+                },
+            }
+
+
+class ModelRegistry:
+    """
+    Registry of the model versions served by this process.
+
+    The desired state (registered versions, active version and shadow
+    candidate) is kept in a JSON file (MODEL_REGISTRY_PATH) shared by the
+    worker processes, and each process converges to it: new versions are
+    loaded and warmed up in the background, and the active version is
+    swapped atomically once it is ready. Requests in flight finish with
+    the model they started with, so no request is dropped.
+    """
+
+    def __init__(self, state_path: str = None):
+        self.state_path = state_path or get_non_empty_value(
+            "MODEL_REGISTRY_PATH", DEFAULT_MODEL_REGISTRY_PATH)
+        self.poll_interval = float(get_non_empty_value(
+            "MODEL_REGISTRY_POLL_INTERVAL", "5"))
+        self.shadow_queue_size = int(get_non_empty_value(
+            "MODEL_SHADOW_QUEUE_SIZE", "100"))
+        self.lock = threading.RLock()
+        self.versions = {
+            DEFAULT_VERSION: ModelVersion(DEFAULT_VERSION, "default"),
+        }
+        self.active = self.versions[DEFAULT_VERSION]
+        self.shadow = None
+        self.state_mtime = None
+        self.thread = None
+
+        state_dir = os.path.dirname(self.state_path)
+        if state_dir:
+            os.makedirs(state_dir, exist_ok=True)
+
+    # --------- Desired state ---------
+
+    def read_state(self) -> dict:
+        state = {"versions": {}, "active": DEFAULT_VERSION, "shadow": None}
+        try:
+            with open(self.state_path) as file:
+                state.update(json.load(file))
+        except FileNotFoundError:
+            pass
+        return state
+
+    def update_state(self, update) -> dict:
+        """
+        Apply `update(state)` to the desired state file, locked against
+        the other processes.
+        """
+        with open(f"{self.state_path}.lock", "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            state = self.read_state()
+            update(state)
+            state["updated_at"] = time.time()
+            temp_path = f"{self.state_path}.{os.getpid()}.tmp"
+            with open(temp_path, "w") as file:
+                json.dump(state, file, indent=2)
+            os.replace(temp_path, self.state_path)
+        self.reconcile()
+        return state
+
+    # --------- Convergence ---------
+
+    def load_version(self, version: ModelVersion):
+        threading.Thread(target=self.load_and_reconcile, args=[version],
+                         name=f"model-load-{version.name}",
+                         daemon=True).start()
+
+    def load_and_reconcile(self, version: ModelVersion):
+        version.load()
+        self.reconcile()
+
+    def reconcile(self, state: dict = None):
+        """
+        Converge this process to the desired state: load the missing
+        versions in the background, swap the active version when it is
+        ready, start or stop the shadow evaluation, and unload the removed
+        versions.
+        """
+        state = state or self.read_state()
+        with self.lock:
+            for name, spec in state["versions"].items():
+                version = self.versions.get(name)
+                if version is None or (version.source, version.path) != \
+                        (spec["source"], spec.get("path")):
+                    version = self.versions[name] = ModelVersion(
+                        name, spec["source"], spec.get("path"))
+                    self.load_version(version)
+
+            active = self.versions.get(state["active"])
+            if active is not None and active is not self.active \
+                    and active.status == "ready":
+                log_info(f"Active model: {self.active.name} -> {active.name}")
+                self.active = active
+
+            shadow = state.get("shadow") or {}
+            candidate = self.versions.get(shadow.get("name"))
+            if candidate is not None and (
+                    candidate.status != "ready" or candidate is self.active):
+                candidate = None
+            current = self.shadow
+            if current is not None and (
+                    candidate is not current.version
+                    or current.active_name != self.active.name
+                    or current.sample_rate != shadow.get("sample_rate")):
+                current.stop()
+                self.shadow = current = None
+            if candidate is not None and current is None:
+                self.shadow = ShadowEvaluation(
+                    candidate, self.active.name, shadow["sample_rate"],
+                    self.shadow_queue_size)
+
+            for name in list(self.versions):
+                if name != DEFAULT_VERSION and name not in state["versions"] \
+                        and self.versions[name] is not self.active:
+                    del self.versions[name]
+
+    def watch(self):
+        while True:
+            time.sleep(self.poll_interval)
+            try:
+                mtime = os.stat(self.state_path).st_mtime_ns
+            except FileNotFoundError:
+                continue
+            if mtime != self.state_mtime:
+                self.state_mtime = mtime
+                try:
+                    self.reconcile()
+                except Exception as e:
+                    log_info(f"Error applying {self.state_path}: {e}")
+
+    def start(self):
+        """
+        Start the background watcher of the desired state file
+        (MODEL_REGISTRY_POLL_INTERVAL=0 disables it).
+        """
+        if self.thread is not None or self.poll_interval <= 0:
+            return
+        self.thread = threading.Thread(
+            target=self.watch, name="model-registry-watcher", daemon=True)
+        self.thread.start()
+
+    # --------- Serving ---------
+
+    def warm_up(self) -> MLModels:
+        """
+        Load and warm up the desired active version in the calling thread
+        (the server warm-up), then start following the desired state.
+        """
+        state = self.read_state()
+        version = self.versions.get(state["active"])
+        if version is None and state["active"] in state["versions"]:
+            spec = state["versions"][state["active"]]
+            version = ModelVersion(state["active"], spec["source"],
+                                   spec.get("path"))
+            with self.lock:
+                self.versions[version.name] = version
+        version = version or self.active
+        if version.status != "ready":
+            version.load()
+        if version.status != "ready":
+            raise RuntimeError(version.error)
+        self.reconcile(state)
+        self.start()
+        return version.model
+
+    def get_active_model(self) -> MLModels:
+        """
+        Get the model of the active version. The model of the default
+        version is loaded on first use.
+        """
+        version = self.active
+        if version.model is None:
+            return get_ml_model()
+        return version.model
+
+    def shadow_predictions(self, texts: list, responses: list,
+                           latency: float):
+        """
+        Pass the predictions of the active model to the shadow
+        evaluation, if any.
+        """
+        shadow = self.shadow
+        if shadow is not None:
+            shadow.submit(texts, responses, latency)
+
+    # --------- Administration ---------
+
+    def register(self, name: str, source: str, path: str = None) -> dict:
+        if not VERSION_NAME_PATTERN.match(name or "") \
+                or name == DEFAULT_VERSION:
+            raise ValueError(f"Invalid model version name: {name}")
+        if source not in MODEL_SOURCES:
+            raise ValueError(f"Invalid model source: {source}. Valid"
+                             f" sources: {', '.join(MODEL_SOURCES)}")
+        if source == "snapshot" and not path:
+            raise ValueError("A snapshot version needs its path")
+        if self.read_state()["active"] == name:
+            raise ValueError(f"Model version {name} is active")
+
+        def update(state):
+            state["versions"][name] = {"source": source, "path": path}
+        self.update_state(update)
+        return self.get_status()
+
+    def activate(self, name: str) -> dict:
+        def update(state):
+            if name != DEFAULT_VERSION and name not in state["versions"]:
+                raise LookupError(f"Model version not found: {name}")
+            state["active"] = name
+            if (state.get("shadow") or {}).get("name") == name:
+                state["shadow"] = None
+        self.update_state(update)
+        return self.get_status()
+
+    def set_shadow(self, name: Optional[str], sample_rate: float) -> dict:
+        """
+        Set the shadow candidate (`name` None stops the shadow
+        evaluation).
+        """
+        if name is not None and not 0 < sample_rate <= 1:
+            raise ValueError("The sample rate must be in (0, 1]")
+
+        def update(state):
+            if name is None:
+                state["shadow"] = None
+                return
+            if name != DEFAULT_VERSION and name not in state["versions"]:
+                raise LookupError(f"Model version not found: {name}")
+            if name == state["active"]:
+                raise ValueError(f"Model version {name} is active")
+            state["shadow"] = {"name": name, "sample_rate": sample_rate}
+        self.update_state(update)
+        return self.get_status()
+
+    def remove(self, name: str) -> dict:
+        def update(state):
+            if name not in state["versions"]:
+                raise LookupError(f"Model version not found: {name}")
+            if name == state["active"]:
+                raise ValueError(f"Model version {name} is active")
+            del state["versions"][name]
+            if (state.get("shadow") or {}).get("name") == name:
+                state["shadow"] = None
+        self.update_state(update)
+        return self.get_status()
+
+    def get_status(self) -> dict:
+        """
+        Get the versions of this process, the active one and the shadow
+        evaluation results.
+        """
+        with self.lock:
+            versions = [version.to_dict()
+                        for version in self.versions.values()]
+            shadow = self.shadow
+            active = self.active.name
+        return {
+            "pid": os.getpid(),
+            "active": active,
+            "desired_active": self.read_state()["active"],
+            "versions": versions,
+            "shadow": shadow.get_stats() if shadow else None,
+        }
+
+
+model_registry = None
+model_registry_lock = threading.Lock()
+
+
+def get_model_registry() -> ModelRegistry:
+    global model_registry
+    with model_registry_lock:
+        if model_registry is None:
+            model_registry = ModelRegistry()
+    return model_registry
@@ -0,0 +1,301 @@
+"""
+Offline model snapshots.
+
+A snapshot pins the tokenizer and the classification model (safetensors
+weights) into a local versioned directory, so the server loads them
+without reaching the Hugging Face hub:
+
+    python -m api.model_snapshot [--version v1] [--revision <commit>]
+
+Snapshots are saved in MODEL_SNAPSHOT_DIR/<version>, and the `current`
+link points to the last one. Set MODEL_SNAPSHOT_PATH to the snapshots
+directory (or to a version directory) to serve it.
+"""
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import shutil
+import time
+from contextlib import nullcontext
+
+from .utilities import get_non_empty_value, log_info
+
+SNAPSHOT_MANIFEST = "snapshot.json"
+CURRENT_LINK = "current"
+DEFAULT_SNAPSHOT_DIR = "/code/saved_models/snapshots"
+
+# safetensors dtype -> torch dtype name
+SAFETENSORS_DTYPES = {
+    "F64": "float64",
+    "F32": "float32",
+    "F16": "float16",
+    "BF16": "bfloat16",
+    "I64": "int64",
+    "I32": "int32",
+    "I16": "int16",
+    "I8": "int8",
+    "U8": "uint8",
+    "BOOL": "bool",
+}
+
+
+def get_file_sha256(file_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def resolve_snapshot_path(path: str) -> str:
+    """
+    Get the directory of a snapshot: `path` itself if it is a version
+    directory, or the `current` version of a snapshots directory.
+    """
+    if os.path.isfile(os.path.join(path, SNAPSHOT_MANIFEST)):
+        return path
+    current_path = os.path.join(path, CURRENT_LINK)
+    if os.path.isfile(os.path.join(current_path, SNAPSHOT_MANIFEST)):
+        return os.path.realpath(current_path)
+    raise FileNotFoundError(f"No model snapshot found in {path}")
+
+
+def get_snapshot_manifest(snapshot_path: str) -> dict:
+    with open(os.path.join(snapshot_path, SNAPSHOT_MANIFEST)) as file:
+        return json.load(file)
+
+
+def set_current_snapshot(snapshot_dir: str, version: str):
+    """
+    Point the `current` link to a snapshot version (atomically replaced).
+    """
+    link_path = os.path.join(snapshot_dir, CURRENT_LINK)
+    temp_link_path = f"{link_path}.{os.getpid()}.tmp"
+    os.symlink(version, temp_link_path)
+    os.replace(temp_link_path, link_path)
+
+
+def create_snapshot(
+    tokenizer_name: str,
+    model_name: str,
+    snapshot_dir: str,
+    labels: list,
+    version: str = None,
+    revision: str = None,
+    tokenizer_revision: str = None,
+    set_current: bool = True,
+) -> str:
+    """
+    Download (or read) the tokenizer and the model, and save them with
+    safetensors weights in a new snapshot version directory, with a
+    manifest of the sources, revisions and file hashes. With
+    `set_current`, the `current` link points to the new version.
+
+    Returns the snapshot directory.
+    """
+    from transformers import AutoModelForSequenceClassification, AutoTokenizer
+
+    version = version or time.strftime("%Y%m%d-%H%M%S")
+    snapshot_path = os.path.join(snapshot_dir, version)
+    if os.path.exists(snapshot_path):
+        raise FileExistsError(f"Snapshot {snapshot_path} already exists")
+
+    tokenizer = AutoTokenizer.from_pretrained(
+        tokenizer_name, revision=tokenizer_revision)
+    model = AutoModelForSequenceClassification.from_pretrained(
+        model_name, revision=revision, num_labels=len(labels))
+
+    # Written aside and renamed, so a snapshot is never seen half-written
+    temp_path = f"{snapshot_path}.tmp"
+    shutil.rmtree(temp_path, ignore_errors=True)
+    tokenizer.save_pretrained(temp_path)
+    model.save_pretrained(temp_path, safe_serialization=True)
+    manifest = {
+        "version": version,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "tokenizer": {"name": tokenizer_name,
+                      "revision": tokenizer_revision},
+        "model": {"name": model_name,
+                  "revision": revision
+                  or getattr(model.config, "_commit_hash", None)},
+        "labels": labels,
+        "files": {
+            file_name: get_file_sha256(os.path.join(temp_path, file_name))
+            for file_name in sorted(os.listdir(temp_path))
+        },
+    }
+    with open(os.path.join(temp_path, SNAPSHOT_MANIFEST), "w") as file:
+        json.dump(manifest, file, indent=2)
+    os.rename(temp_path, snapshot_path)
+    if set_current:
+        set_current_snapshot(snapshot_dir, version)
+    return snapshot_path
+
+
+def get_weight_files(snapshot_path: str) -> list:
+    """
+    Get the safetensors weight files of a model directory (single file or
+    sharded with an index).
+    """
+    index_path = os.path.join(snapshot_path, "model.safetensors.index.json")
+    if os.path.isfile(index_path):
+        with open(index_path) as file:
+            weight_map = json.load(file)["weight_map"]
+        return [os.path.join(snapshot_path, file_name)
+                for file_name in sorted(set(weight_map.values()))]
+    file_path = os.path.join(snapshot_path, "model.safetensors")
+    if not os.path.isfile(file_path):
+        raise FileNotFoundError(f"No safetensors weights in {snapshot_path}")
+    return [file_path]
+
+
+def load_safetensors_mmap(file_path: str) -> dict:
+    """
+    Map a safetensors file in memory and get its tensors without copying
+    them.
+
+    The mapping is private (copy-on-write): the pages stay in the page
+    cache, shared by all the processes of the host that map the same
+    file, as long as nobody writes the weights.
+    """
+    import torch
+
+    with open(file_path, "rb") as file:
+        mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_COPY)
+    header_size = int.from_bytes(mapped[:8], "little")
+    header = json.loads(mapped[8:8 + header_size])
+    header.pop("__metadata__", None)
+    data_start = 8 + header_size
+
+    tensors = {}
+    for name, info in header.items():
+        dtype = getattr(torch, SAFETENSORS_DTYPES[info["dtype"]])
+        start, end = info["data_offsets"]
+        if start == end:
+            tensors[name] = torch.empty(info["shape"], dtype=dtype)
+            continue
+        # The tensors keep a reference to the mapping
+        tensors[name] = torch.frombuffer(
+            mapped, dtype=dtype,
+            count=(end - start) // dtype.itemsize,
+            offset=data_start + start,
+        ).view(info["shape"])
+    return tensors
+
+
+def load_model_mmap(snapshot_path: str, attn_implementation: str = None):
+    """
+    Build the classification model with its parameters backed by the
+    memory-mapped safetensors weights (no per-process copy), with the
+    `attn_implementation` attention (or the eager one if the model does
+    not support it).
+    """
+    import torch
+    from transformers import AutoConfig, AutoModelForSequenceClassification
+    try:
+        from transformers.modeling_utils import no_init_weights
+    except ImportError:
+        no_init_weights = nullcontext
+
+    state_dict = {}
+    for file_path in get_weight_files(snapshot_path):
+        state_dict.update(load_safetensors_mmap(file_path))
+
+    config = AutoConfig.from_pretrained(snapshot_path, local_files_only=True)
+    # The weights are replaced right after, no need to initialize them
+    with no_init_weights():
+        try:
+            model = AutoModelForSequenceClassification.from_config(
+                config, attn_implementation=attn_implementation)
+        except (ValueError, ImportError) as e:
+            if attn_implementation in (None, "eager"):
+                raise
+            log_info(f"Attention {attn_implementation} not supported ({e}),"
+                     " using eager")
+            model = AutoModelForSequenceClassification.from_config(
+                config, attn_implementation="eager")
+    with torch.no_grad():
+        result = model.load_state_dict(state_dict, strict=False,
+                                       assign=True)
+    model.tie_weights()
+    missing_keys = [
+        key for key in result.missing_keys
+        if key not in dict(model.named_buffers())
+    ]
+    if missing_keys:
+        raise ValueError(f"Weights missing in the snapshot: {missing_keys}")
+    return model.eval()
+
+
+def load_snapshot(path: str, attn_implementation: str = None) -> tuple:
+    """
+    Load the tokenizer and the model of a snapshot, without network
+    access. The weights are memory-mapped, or loaded by `from_pretrained`
+    if they cannot be.
+
+    Returns the tokenizer, the model and the snapshot manifest.
+    """
+    from transformers import AutoModelForSequenceClassification, AutoTokenizer
+
+    snapshot_path = resolve_snapshot_path(path)
+    manifest = get_snapshot_manifest(snapshot_path)
+    tokenizer = AutoTokenizer.from_pretrained(snapshot_path,
+                                              local_files_only=True)
+    try:
+        model = load_model_mmap(snapshot_path, attn_implementation)
+        manifest["mmap"] = True
+    except Exception as e:
+        log_info(f"Memory-mapped load of {snapshot_path} failed ({e}),"
+                 " loading it with from_pretrained")
+        model = AutoModelForSequenceClassification.from_pretrained(
+            snapshot_path, local_files_only=True).eval()
+        manifest["mmap"] = False
+    return tokenizer, model, manifest
+
+
+def main():
+    from .ml_models import DEFAULT_LABELS
+
+    use_local_model = get_non_empty_value("USE_LOCAL_MODEL", "0") == "1"
+    parser = argparse.ArgumentParser(
+        description="Pin the tokenizer and the model in a local snapshot")
+    parser.add_argument(
+        "--tokenizer",
+        default=get_non_empty_value("BASE_MODEL_NAME",
+                                    "dmis-lab/biobert-v1.1"),
+        help="tokenizer name or path (default: BASE_MODEL_NAME)")
+    parser.add_argument(
+        "--model",
+        default=get_non_empty_value("LOCAL_MODEL_PATH", "/code/saved_models")
+        if use_local_model
+        else get_non_empty_value("CLOUD_MODEL_NAME", "Hiver77/MDT"),
+        help="model name or path (default: CLOUD_MODEL_NAME, or"
+             " LOCAL_MODEL_PATH with USE_LOCAL_MODEL=1)")
+    parser.add_argument("--revision", help="model hub revision to pin")
+    parser.add_argument("--tokenizer-revision",
+                        help="tokenizer hub revision to pin")
+    parser.add_argument("--version",
+                        help="snapshot version (default: a timestamp)")
+    parser.add_argument(
+        "--output",
+        default=get_non_empty_value("MODEL_SNAPSHOT_DIR",
+                                    DEFAULT_SNAPSHOT_DIR),
+        help="snapshots directory (default: MODEL_SNAPSHOT_DIR)")
+    args = parser.parse_args()
+
+    snapshot_path = create_snapshot(
+        tokenizer_name=args.tokenizer,
+        model_name=args.model,
+        snapshot_dir=args.output,
+        labels=list(DEFAULT_LABELS),
+        version=args.version,
+        revision=args.revision,
+        tokenizer_revision=args.tokenizer_revision,
+    )
+    print(f"Snapshot saved in {snapshot_path}")
+
+
+if __name__ == "__main__":
+    main()
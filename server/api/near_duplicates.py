@@ -0,0 +1,355 @@
+"""
+Near-duplicate detection of the classified articles with MinHash and LSH.
+
+The articles are normalized (case, punctuation, whitespace and a trailing
+copyright notice are ignored), split into word shingles and summarized
+by a MinHash signature, whose matching positions estimate the Jaccard
+similarity of the shingle sets. The signatures are split in bands, and
+the LSH buckets (band, hash of the band) are indexed in SQLite: the
+candidates of an article are the documents that share a bucket with it,
+found with one index search per band, so a lookup does not depend on the
+number of documents.
+"""
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+import zlib
+from typing import Optional
+
+import numpy as np
+
+from .single_flight import get_content_hash
+from .utilities import get_non_empty_value, log_info
+
+DEFAULT_NEAR_DUPLICATE_DB_NAME = "near_duplicates.db"
+# Mersenne prime of the MinHash universal hashing
+MERSENNE_PRIME = (1 << 61) - 1
+MAX_HASH = (1 << 32) - 1
+# Trailing copyright notice of the abstract (PubMed exports)
+COPYRIGHT_PATTERN = re.compile(
+    r"(?:©|\(c\)|\bcopyright\b|\ball rights reserved\b)[^©]*$",
+    re.IGNORECASE)
+# Only a notice in the last characters of the abstract is removed
+COPYRIGHT_MAX_LENGTH = 300
+WORD_PATTERN = re.compile(r"\w+")
+
+NEAR_DUPLICATES_SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    content_hash TEXT NOT NULL UNIQUE,
+    signature BLOB NOT NULL,
+    prediction_id INTEGER,
+    created_at REAL NOT NULL,
+    model TEXT,
+    predictions TEXT,
+    updated_at REAL
+);
+CREATE TABLE IF NOT EXISTS lsh_buckets (
+    band INTEGER NOT NULL,
+    bucket INTEGER NOT NULL,
+    document_id INTEGER NOT NULL,
+    PRIMARY KEY (band, bucket, document_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS duplicates (
+    prediction_id INTEGER PRIMARY KEY,
+    duplicate_of INTEGER,
+    similarity REAL NOT NULL
+);
+"""
+
+
+def get_words(title: str, abstract: str) -> list:
+    """
+    Get the normalized words of an article, without the trailing
+    copyright notice of its abstract.
+    """
+    abstract = abstract or ""
+    match = COPYRIGHT_PATTERN.search(abstract,
+                                     max(0, len(abstract)
+                                         - COPYRIGHT_MAX_LENGTH))
+    if match:
+        abstract = abstract[:match.start()]
+    text = unicodedata.normalize("NFKC", f"{title or ''} {abstract}")
+    return WORD_PATTERN.findall(text.lower().replace("_", " "))
+
+
+class MinHash:
+    """
+    MinHash signatures of word shingle sets.
+    """
+
+    def __init__(self, permutations: int, shingle_size: int, seed: int = 1):
+        self.shingle_size = shingle_size
+        rng = np.random.default_rng(seed)
+        # a * hash + b stays below 2^64 with 32-bit a, b and hashes
+        self.a = rng.integers(1, MAX_HASH, permutations, dtype=np.uint64)
+        self.b = rng.integers(0, MAX_HASH, permutations, dtype=np.uint64)
+
+    def get_shingles(self, words: list) -> set:
+        size = self.shingle_size
+        if len(words) <= size:
+            return {" ".join(words)}
+        return {" ".join(words[index:index + size])
+                for index in range(len(words) - size + 1)}
+
+    def get_signature(self, words: list) -> np.ndarray:
+        hashes = np.fromiter(
+            (zlib.crc32(shingle.encode("utf-8"))
+             for shingle in self.get_shingles(words)), dtype=np.uint64)
+        values = (self.a[:, None] * hashes[None, :] + self.b[:, None]) \
+            % MERSENNE_PRIME & MAX_HASH
+        return values.min(axis=1).astype(np.uint32)
+
+
+class NearDuplicates:
+    """
+    Near-duplicate index of the logged predictions.
+
+    Maintained as a commit listener of the prediction log: every
+    successful prediction is matched against the indexed documents. A
+    near-duplicate (estimated similarity of at least
+    NEAR_DUPLICATE_THRESHOLD) is recorded as a duplicate of the first
+    prediction of that document, any other article becomes a new document.
+    Each document keeps the last predictions made for it, with the model
+    that made them, to answer its near-duplicates without the model.
+    """
+
+    def __init__(self, prediction_log, db_path: str = None):
+        self.debug = os.environ.get("SERVER_DEBUG", "0") == "1"
+        self.db_path = db_path or get_non_empty_value(
+            "NEAR_DUPLICATE_DB_PATH", os.path.join(
+                os.path.dirname(prediction_log.db_path),
+                DEFAULT_NEAR_DUPLICATE_DB_NAME))
+        self.threshold = float(get_non_empty_value(
+            "NEAR_DUPLICATE_THRESHOLD", "0.9"))
+        self.cache_enabled = get_non_empty_value(
+            "NEAR_DUPLICATE_CACHE", "1") == "1"
+        self.bands = int(get_non_empty_value("NEAR_DUPLICATE_BANDS", "16"))
+        self.band_rows = int(get_non_empty_value(
+            "NEAR_DUPLICATE_BAND_ROWS", "8"))
+        self.max_candidates = int(get_non_empty_value(
+            "NEAR_DUPLICATE_MAX_CANDIDATES", "50"))
+        self.minhash = MinHash(
+            self.bands * self.band_rows,
+            int(get_non_empty_value("NEAR_DUPLICATE_SHINGLE_SIZE", "3")))
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.stats = {"lookups": 0, "cache_hits": 0, "indexed": 0,
+                      "duplicates": 0}
+
+        connection = self.connect()
+        connection.executescript(NEAR_DUPLICATES_SCHEMA)
+        connection.close()
+        prediction_log.add_commit_listener(self.add_records)
+
+    def connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.db_path, timeout=30,
+                                     check_same_thread=False)
+        connection.row_factory = sqlite3.Row
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    def get_connection(self) -> sqlite3.Connection:
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = self.connect()
+            self.local.connection = connection
+        return connection
+
+    def get_article(self, title: str, abstract: str) -> Optional[tuple]:
+        """
+        Get the content hash and the signature of an article (None if it
+        has no words).
+        """
+        words = get_words(title, abstract)
+        if not words:
+            return None
+        return (get_content_hash(" ".join(words)),
+                self.minhash.get_signature(words))
+
+    def get_buckets(self, signature: np.ndarray) -> list:
+        """
+        Get the LSH (band, bucket) pairs of a signature.
+        """
+        return [
+            (band, int.from_bytes(hashlib.blake2b(
+                signature[band * self.band_rows:
+                          (band + 1) * self.band_rows].tobytes(),
+                digest_size=8).digest(), "big", signed=True))
+            for band in range(self.bands)
+        ]
+
+    def match(self, connection: sqlite3.Connection, content_hash: str,
+              signature: np.ndarray) -> Optional[dict]:
+        """
+        Find the indexed document most similar to an article, if its
+        similarity reaches the threshold.
+        """
+        row = connection.execute(
+            "SELECT * FROM documents WHERE content_hash = ?",
+            [content_hash]).fetchone()
+        if row is not None:
+            return {**dict(row), "similarity": 1.0}
+
+        buckets = self.get_buckets(signature)
+        # At most max_candidates per bucket: a crowded bucket (e.g. a
+        # boilerplate text) does not make the lookup linear
+        candidates = connection.execute(" UNION ".join(
+            ["SELECT * FROM (SELECT document_id FROM lsh_buckets"
+             " WHERE band = ? AND bucket = ? LIMIT ?)"] * len(buckets)),
+            [value for band, bucket in buckets
+             for value in (band, bucket, self.max_candidates)]).fetchall()
+        if not candidates:
+            return None
+        rows = connection.execute(
+            "SELECT * FROM documents WHERE id IN"
+            f" ({', '.join('?' * len(candidates))})",
+            [candidate[0] for candidate in candidates]).fetchall()
+        similarities = [
+            float(np.mean(np.frombuffer(row["signature"], dtype=np.uint32)
+                          == signature))
+            for row in rows
+        ]
+        best = max(range(len(rows)), key=similarities.__getitem__)
+        if similarities[best] < self.threshold:
+            return None
+        return {**dict(rows[best]), "similarity": similarities[best]}
+
+    # --------- Lookups ---------
+
+    def find(self, title: str, abstract: str) -> Optional[dict]:
+        """
+        Find the indexed near-duplicate of an article: its document
+        "id", first "prediction_id", "similarity", and last "model" and
+        "predictions" (JSON). None if there is none.
+        """
+        article = self.get_article(title, abstract)
+        if article is None:
+            return None
+        match = self.match(self.get_connection(), *article)
+        if match is not None:
+            del match["signature"]
+        return match
+
+    def get_cached_predictions(self, title: str, abstract: str,
+                               model: str) -> Optional[list]:
+        """
+        Get the predictions of a near-duplicate of an article made by the
+        same model, None if there is none (or NEAR_DUPLICATE_CACHE=0).
+        """
+        if not self.cache_enabled:
+            return None
+        try:
+            match = self.find(title, abstract)
+        except Exception as e:
+            log_info(f"Near-duplicate lookup error: {e}")
+            match = None
+        hit = match is not None and match["model"] == model \
+            and match["predictions"] is not None
+        with self.lock:
+            self.stats["lookups"] += 1
+            self.stats["cache_hits"] += hit
+        if not hit:
+            return None
+        if self.debug:
+            print(f"NearDuplicates: cache hit, document {match['id']}"
+                  f" (similarity {match['similarity']:.2f})")
+        return json.loads(match["predictions"])
+
+    def get_duplicates(self, prediction_ids: list) -> dict:
+        """
+        Get the prediction ids that are near-duplicates of an earlier
+        prediction: prediction id -> (earlier prediction id, similarity).
+        """
+        if not prediction_ids:
+            return {}
+        placeholders = ", ".join("?" * len(prediction_ids))
+        rows = self.get_connection().execute(
+            "SELECT prediction_id, duplicate_of, similarity FROM duplicates"
+            f" WHERE prediction_id IN ({placeholders})",
+            prediction_ids).fetchall()
+        return {row["prediction_id"]: (row["duplicate_of"], row["similarity"])
+                for row in rows}
+
+    def get_status(self) -> dict:
+        connection = self.get_connection()
+        with self.lock:
+            stats = dict(self.stats)
+        return {
+            "documents": connection.execute(
+                "SELECT COALESCE(MAX(id), 0) FROM documents").fetchone()[0],
+            "threshold": self.threshold,
+            "cache_enabled": self.cache_enabled,
+            "stats": stats,
+        }
+
+    # --------- Writer ---------
+
+    def add_records(self, records: list):
+        """
+        Index a committed batch of logged predictions (commit listener of
+        the prediction log, in its writer thread). A record "model" is the
+        model (or adapter) that made its predictions.
+        """
+        records = [
+            record for record in records
+            if record["status"] == "success"
+            and (record["title"] or record["abstract"])
+        ]
+        if not records:
+            return
+        start_time = time.perf_counter()
+        connection = self.get_connection()
+        # Takes the write lock of the database (all the processes)
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            for record in records:
+                self.add_record(connection, record)
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+        if self.debug:
+            print(f"NearDuplicates: {len(records)} predictions indexed in"
+                  f" {time.perf_counter() - start_time:.4f}s")
+
+    def add_record(self, connection: sqlite3.Connection, record: dict):
+        article = self.get_article(record["title"], record["abstract"])
+        if article is None:
+            return
+        content_hash, signature = article
+        match = self.match(connection, content_hash, signature)
+        now = time.time()
+        if match is None:
+            document_id = connection.execute(
+                "INSERT INTO documents (content_hash, signature,"
+                " prediction_id, created_at) VALUES (?, ?, ?, ?)",
+                [content_hash, signature.tobytes(), record.get("id"),
+                 now]).lastrowid
+            connection.executemany(
+                "INSERT OR IGNORE INTO lsh_buckets (band, bucket,"
+                " document_id) VALUES (?, ?, ?)",
+                [(band, bucket, document_id)
+                 for band, bucket in self.get_buckets(signature)])
+            with self.lock:
+                self.stats["indexed"] += 1
+        else:
+            document_id = match["id"]
+            connection.execute(
+                "INSERT OR REPLACE INTO duplicates (prediction_id,"
+                " duplicate_of, similarity) VALUES (?, ?, ?)",
+                [record.get("id"), match["prediction_id"],
+                 match["similarity"]])
+            with self.lock:
+                self.stats["duplicates"] += 1
+        if record.get("model") and record["predictions"] is not None:
+            connection.execute(
+                "UPDATE documents SET model = ?, predictions = ?,"
+                " updated_at = ? WHERE id = ?",
+                [record["model"], record["predictions"], now, document_id])
@@ -0,0 +1,355 @@
+import atexit
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Optional
+
+from .history_query import HistoryQuery
+from .live_feed import LiveFeed
+from .near_duplicates import NearDuplicates
+from .prediction_rollups import PredictionRollups
+from .serving_rollups import ServingRollups
+from .utilities import get_non_empty_value, log_info
+
+
+DEFAULT_PREDICTION_LOG_DB_PATH = os.path.join(
+    os.path.dirname(os.path.realpath(__file__)),
+    "..", "data", "predictions.db")
+
+SECONDS_PER_DAY = 86400
+# Maximum number of rows counted for the history total estimate when it
+# cannot be answered from the rollups
+HISTORY_COUNT_LIMIT = 10000
+
+PREDICTIONS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS predictions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at REAL NOT NULL,
+    source TEXT NOT NULL,
+    title TEXT,
+    abstract TEXT,
+    category TEXT,
+    confidence REAL,
+    predictions TEXT,
+    processing_time REAL,
+    status TEXT NOT NULL,
+    error_message TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_predictions_created_at
+    ON predictions (created_at);
+CREATE INDEX IF NOT EXISTS idx_predictions_category_created_at
+    ON predictions (category, created_at);
+CREATE INDEX IF NOT EXISTS idx_predictions_status_created_at
+    ON predictions (status, created_at);
+"""
+
+PREDICTION_COLUMNS = [
+    "created_at", "source", "title", "abstract", "category", "confidence",
+    "predictions", "processing_time", "status", "error_message",
+]
+
+
+def get_iso_date(timestamp: float) -> str:
+    """ Get the ISO 8601 (UTC) date for an epoch timestamp """
+    return datetime.fromtimestamp(timestamp, tz=timezone.utc) \
+        .strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+class PredictionLog:
+    """
+    Persistent prediction log, stored in a local SQLite database in WAL
+    mode.
+
+    `record()` only puts the prediction in a queue. A background writer
+    thread (started by `start()`) takes the queued predictions and inserts
+    them in batches, one transaction per batch.
+    """
+
+    def __init__(self, db_path: str = None):
+        self.debug = os.environ.get("SERVER_DEBUG", "0") == "1"
+        self.db_path = db_path or get_non_empty_value(
+            "PREDICTION_LOG_DB_PATH", DEFAULT_PREDICTION_LOG_DB_PATH)
+        self.batch_size = int(get_non_empty_value(
+            "PREDICTION_LOG_BATCH_SIZE", "100"))
+        self.flush_interval = float(get_non_empty_value(
+            "PREDICTION_LOG_FLUSH_INTERVAL", "0.5"))
+        self.queue = queue.Queue()
+        self.local = threading.local()
+        # Incremented after each committed batch, so readers can tell
+        # when their cached views are stale.
+        self.version = 0
+        self.batch_listeners = []
+        self.commit_listeners = []
+        self.rollups = None
+        self.serving_rollups = None
+        self.near_duplicates = None
+        self.live_feed = None
+        self.thread = None
+
+        db_dir = os.path.dirname(self.db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        connection = self.connect()
+        connection.executescript(PREDICTIONS_SCHEMA)
+        connection.close()
+
+    def start(self):
+        """
+        Start the background writer thread.
+        """
+        if self.thread is not None:
+            return
+        self.thread = threading.Thread(
+            target=self.write_loop, name="prediction-log-writer",
+            daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.db_path, timeout=30,
+                                     check_same_thread=False)
+        connection.row_factory = sqlite3.Row
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    def get_read_connection(self) -> sqlite3.Connection:
+        """
+        Get the calling thread's read connection.
+        """
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = self.connect()
+            self.local.connection = connection
+        return connection
+
+    def add_batch_listener(self, listener):
+        """
+        Register a function called as `listener(connection, records)`
+        inside the transaction of each written batch, to maintain derived
+        tables together with the raw log.
+        """
+        self.batch_listeners.append(listener)
+
+    def add_commit_listener(self, listener):
+        """
+        Register a function called as `listener(records)` after each batch
+        is committed. The records include their assigned "id".
+        """
+        self.commit_listeners.append(listener)
+
+    # --------- Writer ---------
+
+    def record(
+        self,
+        source: str,
+        status: str,
+        title: str = None,
+        abstract: str = None,
+        category: str = None,
+        confidence: float = None,
+        predictions: Optional[list] = None,
+        processing_time: float = None,
+        error_message: str = None,
+        model: str = None,
+    ):
+        """
+        Queue a prediction to be logged. The `model` that made the
+        predictions is not stored, only passed to the listeners.
+        """
+        self.queue.put({
+            "created_at": time.time(),
+            "source": source,
+            "title": title,
+            "abstract": abstract,
+            "category": category,
+            "confidence": confidence,
+            "predictions": json.dumps(predictions)
+            if predictions is not None else None,
+            "processing_time": processing_time,
+            "status": status,
+            "error_message": error_message,
+            "model": model,
+        })
+
+    def get_batch(self) -> list:
+        """
+        Wait for the first queued record, then take all the others
+        available, up to the batch size.
+        """
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.flush_interval
+        # Stop at the close() marker, without waiting for more records
+        while len(batch) < self.batch_size and batch[-1] is not None:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def write_batch(self, connection: sqlite3.Connection, records: list):
+        with connection:
+            connection.executemany(
+                f"INSERT INTO predictions ({', '.join(PREDICTION_COLUMNS)})"
+                f" VALUES ({', '.join('?' * len(PREDICTION_COLUMNS))})",
+                [[record[column] for column in PREDICTION_COLUMNS]
+                 for record in records])
+            # A single writer inserts the batch rows with consecutive ids
+            last_id = connection.execute(
+                "SELECT last_insert_rowid()").fetchone()[0]
+            for index, record in enumerate(records):
+                record["id"] = last_id - len(records) + 1 + index
+            for listener in self.batch_listeners:
+                listener(connection, records)
+        self.version += 1
+        for listener in self.commit_listeners:
+            try:
+                listener(records)
+            except Exception as e:
+                log_info(f"Error in prediction log commit listener: {e}")
+
+    def write_loop(self):
+        connection = self.connect()
+        stop = False
+        while not stop:
+            batch = self.get_batch()
+            records = [record for record in batch if record is not None]
+            stop = len(records) < len(batch)
+            try:
+                if records:
+                    self.write_batch(connection, records)
+            except Exception as e:
+                log_info(f"Error writing {len(records)} predictions: {e}")
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+        connection.close()
+
+    def flush(self):
+        """
+        Wait until all the queued predictions are written.
+        """
+        self.queue.join()
+
+    def close(self):
+        if self.thread is not None and self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join(timeout=10)
+
+    # --------- Readers ---------
+
+    def query(self, sql: str, params: list = None) -> list:
+        return self.get_read_connection().execute(
+            sql, params or []).fetchall()
+
+    def get_history_filters(self, query: HistoryQuery) -> tuple:
+        """
+        Get the SQL conditions and parameters for the query filters.
+        """
+        conditions, params = [], []
+        for column, operator, value in [
+            ("category", "=", query.category),
+            ("status", "=", query.status),
+            ("created_at", ">=", query.date_from),
+            ("created_at", "<=", query.date_to),
+            ("confidence", ">=", query.min_confidence),
+            ("confidence", "<=", query.max_confidence),
+        ]:
+            if value is not None:
+                conditions.append(f"{column} {operator} ?")
+                params.append(value)
+        return conditions, params
+
+    def get_history(self, query: HistoryQuery) -> list:
+        """
+        Get a page of logged predictions (newest first) as a list of
+        (timestamp, item) with up to `query.limit + 1` items.
+        """
+        conditions, params = self.get_history_filters(query)
+        if query.cursor is not None:
+            # Keyset pagination: continue after the last returned item
+            conditions.append("(created_at, id) < (?, ?)")
+            params.extend(query.cursor)
+        columns = ["id", "created_at"] + [
+            field for field in query.fields
+            if field not in ("id", "date", "duplicate_of")
+        ]
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+        rows = self.query(
+            f"SELECT {', '.join(columns)} FROM predictions{where}"
+            " ORDER BY created_at DESC, id DESC LIMIT ?",
+            params + [query.limit + 1])
+        return [
+            (row["created_at"], {
+                **dict(row),
+                "date": get_iso_date(row["created_at"]),
+            })
+            for row in rows
+        ]
+
+    def estimate_history_count(self, query: HistoryQuery) -> int:
+        """
+        Estimate the number of logged predictions matching the query
+        filters. Category, status and date filters are answered from the
+        daily rollups (exact to the day). With confidence filters, the
+        matching rows are counted up to HISTORY_COUNT_LIMIT.
+        """
+        if query.min_confidence is not None \
+           or query.max_confidence is not None:
+            conditions, params = self.get_history_filters(query)
+            return self.query(
+                "SELECT COUNT(*) AS count FROM (SELECT 1 FROM predictions"
+                f" WHERE {' AND '.join(conditions)} LIMIT ?)",
+                params + [HISTORY_COUNT_LIMIT])[0]["count"]
+
+        conditions, params = [], []
+        if query.category is not None:
+            conditions.append("category = ?")
+            params.append(query.category)
+        if query.date_from is not None:
+            conditions.append("bucket_start >= ?")
+            params.append(int(query.date_from // SECONDS_PER_DAY)
+                          * SECONDS_PER_DAY)
+        if query.date_to is not None:
+            conditions.append("bucket_start <= ?")
+            params.append(query.date_to)
+        if query.status == "success":
+            count_expression = "count - error_count"
+        elif query.status == "error":
+            count_expression = "error_count"
+        elif query.status is not None:
+            return 0
+        else:
+            count_expression = "count"
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+        return self.query(
+            f"SELECT COALESCE(SUM({count_expression}), 0) AS count"
+            f" FROM prediction_rollups_daily{where}",
+            params)[0]["count"]
+
+
+prediction_log = None
+prediction_log_lock = threading.Lock()
+
+
+def get_prediction_log() -> PredictionLog:
+    """
+    Get the shared prediction log.
+    """
+    global prediction_log
+    with prediction_log_lock:
+        if prediction_log is None:
+            prediction_log = PredictionLog()
+            prediction_log.rollups = PredictionRollups(prediction_log)
+            prediction_log.serving_rollups = ServingRollups(prediction_log)
+            prediction_log.near_duplicates = NearDuplicates(prediction_log)
+            prediction_log.live_feed = LiveFeed(prediction_log)
+            prediction_log.start()
+    return prediction_log
@@ -0,0 +1,179 @@
+import json
+import sqlite3
+
+from .latency_sketch import LatencySketch
+from .serving_rollups import get_endpoint
+
+# Rollup table -> bucket size in seconds
+ROLLUP_TABLES = {
+    "prediction_rollups_hourly": 3600,
+    "prediction_rollups_daily": 86400,
+}
+
+ROLLUP_SCHEMA = """
+CREATE TABLE IF NOT EXISTS {table} (
+    bucket_start INTEGER NOT NULL,
+    category TEXT NOT NULL,
+    count INTEGER NOT NULL DEFAULT 0,
+    error_count INTEGER NOT NULL DEFAULT 0,
+    confidence_sum REAL NOT NULL DEFAULT 0,
+    processing_time_sum REAL NOT NULL DEFAULT 0,
+    latency_sketch TEXT,
+    PRIMARY KEY (bucket_start, category)
+) WITHOUT ROWID;
+"""
+
+# Rows for classifications without a category (errors)
+NO_CATEGORY = ""
+# Rows for the PDF reads (title and abstract extractions, not
+# classifications)
+PDFREAD_CATEGORY = ":pdfread"
+# Layout of the rollup rows (the database user_version): the rollups of
+# an older layout are rebuilt from the prediction log
+ROLLUPS_VERSION = 1
+
+
+def get_rollup_category(record: dict) -> str:
+    """
+    Get the rollup row category of a prediction record.
+    """
+    if get_endpoint(record["source"]) == "pdfread":
+        return PDFREAD_CATEGORY
+    return record["category"] or NO_CATEGORY
+
+
+class PredictionRollups:
+    """
+    Hourly and daily rollups of the prediction log.
+
+    Each (time bucket, category) row keeps the prediction and error
+    counts, the confidence and processing time sums, and a mergeable
+    latency sketch for the percentiles. The rows are updated in the same
+    transaction that writes each batch of predictions, so reading a time
+    range costs O(buckets) rows instead of a scan of the history.
+    """
+
+    def __init__(self, prediction_log):
+        self.prediction_log = prediction_log
+        connection = prediction_log.connect()
+        with connection:
+            for table in ROLLUP_TABLES:
+                connection.executescript(ROLLUP_SCHEMA.format(table=table))
+            version = connection.execute(
+                "PRAGMA user_version").fetchone()[0]
+            if version < ROLLUPS_VERSION:
+                for table in ROLLUP_TABLES:
+                    connection.execute(f"DELETE FROM {table}")
+            if self.needs_backfill(connection):
+                self.backfill(connection)
+            if version < ROLLUPS_VERSION:
+                connection.execute(
+                    f"PRAGMA user_version = {ROLLUPS_VERSION}")
+        connection.close()
+        prediction_log.add_batch_listener(self.update)
+
+    def needs_backfill(self, connection: sqlite3.Connection) -> bool:
+        """
+        The rollups are empty but there are logged predictions (e.g. the
+        log was created before the rollups existed).
+        """
+        has_rollups = connection.execute(
+            "SELECT 1 FROM prediction_rollups_daily LIMIT 1").fetchone()
+        has_predictions = connection.execute(
+            "SELECT 1 FROM predictions LIMIT 1").fetchone()
+        return has_predictions is not None and has_rollups is None
+
+    def backfill(self, connection: sqlite3.Connection,
+                 chunk_size: int = 10000):
+        """
+        Build the rollups from the whole prediction log.
+        """
+        last_id = 0
+        while True:
+            rows = connection.execute(
+                "SELECT id, created_at, source, category, confidence,"
+                " processing_time, status FROM predictions"
+                " WHERE id > ? ORDER BY id LIMIT ?",
+                [last_id, chunk_size]).fetchall()
+            if not rows:
+                break
+            self.update(connection, [dict(row) for row in rows])
+            last_id = rows[-1]["id"]
+
+    def update(self, connection: sqlite3.Connection, records: list):
+        """
+        Add a batch of prediction records to the rollups.
+        """
+        for table, bucket_size in ROLLUP_TABLES.items():
+            buckets = {}
+            for record in records:
+                key = (int(record["created_at"] // bucket_size)
+                       * bucket_size,
+                       get_rollup_category(record))
+                bucket = buckets.get(key)
+                if bucket is None:
+                    bucket = buckets[key] = {
+                        "count": 0,
+                        "error_count": 0,
+                        "confidence_sum": 0.0,
+                        "processing_time_sum": 0.0,
+                        "latency_sketch": LatencySketch(),
+                    }
+                bucket["count"] += 1
+                if record["status"] != "success":
+                    bucket["error_count"] += 1
+                bucket["confidence_sum"] += record["confidence"] or 0
+                bucket["processing_time_sum"] += \
+                    record["processing_time"] or 0
+                bucket["latency_sketch"].add(record["processing_time"])
+
+            for (bucket_start, category), bucket in buckets.items():
+                self.upsert_bucket(connection, table, bucket_start,
+                                   category, bucket)
+
+    def upsert_bucket(self, connection: sqlite3.Connection, table: str,
+                      bucket_start: int, category: str, bucket: dict):
+        row = connection.execute(
+            f"SELECT latency_sketch FROM {table}"
+            " WHERE bucket_start = ? AND category = ?",
+            [bucket_start, category]).fetchone()
+        sketch = bucket["latency_sketch"]
+        if row is not None and row["latency_sketch"]:
+            sketch.merge(LatencySketch.from_dict(
+                json.loads(row["latency_sketch"])))
+        connection.execute(
+            f"INSERT INTO {table} (bucket_start, category, count,"
+            " error_count, confidence_sum, processing_time_sum,"
+            " latency_sketch) VALUES (?, ?, ?, ?, ?, ?, ?)"
+            " ON CONFLICT (bucket_start, category) DO UPDATE SET"
+            " count = count + excluded.count,"
+            " error_count = error_count + excluded.error_count,"
+            " confidence_sum = confidence_sum + excluded.confidence_sum,"
+            " processing_time_sum ="
+            " processing_time_sum + excluded.processing_time_sum,"
+            " latency_sketch = excluded.latency_sketch",
+            [bucket_start, category, bucket["count"],
+             bucket["error_count"], bucket["confidence_sum"],
+             bucket["processing_time_sum"],
+             json.dumps(sketch.to_dict(), separators=(",", ":"))])
+
+    def get_buckets(self, table: str, since: int) -> list:
+        """
+        Get the rollup rows of `table` from the `since` bucket start on,
+        as dicts with the latency sketch decoded.
+        """
+        rows = self.prediction_log.query(
+            f"SELECT bucket_start, category, count, error_count,"
+            f" confidence_sum, processing_time_sum, latency_sketch"
+            f" FROM {table} WHERE bucket_start >= ?"
+            f" ORDER BY bucket_start",
+            [since])
+        return [
+            {
+                **dict(row),
+                "latency_sketch": LatencySketch.from_dict(
+                    json.loads(row["latency_sketch"]))
+                if row["latency_sketch"] else LatencySketch(),
+            }
+            for row in rows
+        ]
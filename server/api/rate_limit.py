@@ -0,0 +1,270 @@
+import fcntl
+import hashlib
+import math
+import os
+import struct
+import threading
+import time
+
+from starlette.datastructures import Headers
+
+from .responses import send_error_response
+from .utilities import get_non_empty_value
+
+API_KEY_HEADER = "x-api-key"
+# Client name of the requests without API key (one bucket per address,
+# only with RATE_LIMIT_ANONYMOUS=1)
+ANONYMOUS_CLIENT = "anonymous"
+# Buckets kept in memory before the full ones are dropped
+MAX_MEMORY_BUCKETS = 10000
+
+# Shared file store: slots of (key hash, tokens, updated time)
+SLOT_FORMAT = "<Qdd8x"
+SLOT_SIZE = struct.calcsize(SLOT_FORMAT)
+MAX_PROBES = 8
+
+
+def parse_pairs(value: str) -> dict:
+    """
+    Parse a "name=value,name2=value2" environment variable value.
+    """
+    pairs = {}
+    for item in (value or "").split(","):
+        name, _, item_value = item.partition("=")
+        if name.strip() and item_value.strip():
+            pairs[name.strip()] = item_value.strip()
+    return pairs
+
+
+def get_api_keys() -> dict:
+    """
+    Get the API keys (key -> client name) from AG_API_KEYS
+    ("client=key,client2=key2"). AG_API_KEY is the "default" client key.
+    """
+    api_keys = {
+        key: client
+        for client, key in parse_pairs(os.environ.get("AG_API_KEYS")).items()
+    }
+    if os.environ.get("AG_API_KEY"):
+        api_keys.setdefault(os.environ["AG_API_KEY"], "default")
+    return api_keys
+
+
+def take_tokens(tokens: float, updated: float, cost: float, rate: float,
+                burst: float, now: float) -> tuple:
+    """
+    Refill a bucket since `updated` and take `cost` tokens from it.
+
+    Returns the seconds to wait before the request can be accepted (0 if
+    it was) and the bucket tokens left.
+    """
+    tokens = min(burst, tokens + max(now - updated, 0) * rate)
+    if tokens >= cost:
+        return 0.0, tokens - cost
+    wait = (cost - tokens) / rate if rate > 0 else math.inf
+    return wait, tokens
+
+
+class MemoryBucketStore:
+    """
+    Token buckets of this process. It is only used from the event loop,
+    so the buckets are updated without locks.
+    """
+
+    name = "memory"
+
+    def __init__(self):
+        self.buckets = {}
+
+    def consume(self, key: str, cost: float, rate: float, burst: float,
+                now: float) -> float:
+        tokens, updated, _ = self.buckets.get(key, (burst, now, now))
+        wait, tokens = take_tokens(tokens, updated, cost, rate, burst, now)
+        full_time = now + (burst - tokens) / rate if rate > 0 else math.inf
+        self.buckets[key] = (tokens, now, full_time)
+        if len(self.buckets) > MAX_MEMORY_BUCKETS:
+            # A bucket that would be full again is the same as a new one
+            self.buckets = {
+                key: bucket for key, bucket in self.buckets.items()
+                if bucket[2] > now
+            }
+        return wait
+
+
+class FileBucketStore:
+    """
+    Token buckets in a file shared by the worker processes, so the limits
+    hold across them.
+
+    The file is a hash table of fixed size slots, and each update only
+    locks its slot (a POSIX byte-range lock), so the workers contend only
+    for the same bucket. When the probed slots are all taken, the last one
+    is reused and its bucket starts full again.
+    """
+
+    name = "file"
+
+    def __init__(self, path: str, slots: int = 4096):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.slots = slots
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        if os.fstat(self.fd).st_size < slots * SLOT_SIZE:
+            os.ftruncate(self.fd, slots * SLOT_SIZE)
+
+    def consume(self, key: str, cost: float, rate: float, burst: float,
+                now: float) -> float:
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest()
+        key_hash = int.from_bytes(digest, "big") or 1
+        for probe in range(MAX_PROBES):
+            offset = (key_hash + probe) % self.slots * SLOT_SIZE
+            fcntl.lockf(self.fd, fcntl.LOCK_EX, SLOT_SIZE, offset)
+            try:
+                slot_hash, tokens, updated = struct.unpack(
+                    SLOT_FORMAT, os.pread(self.fd, SLOT_SIZE, offset))
+                if slot_hash not in (0, key_hash) \
+                        and probe < MAX_PROBES - 1:
+                    continue
+                if slot_hash != key_hash:
+                    tokens, updated = burst, now
+                wait, tokens = take_tokens(tokens, updated, cost, rate,
+                                           burst, now)
+                os.pwrite(self.fd,
+                          struct.pack(SLOT_FORMAT, key_hash, tokens, now),
+                          offset)
+                return wait
+            finally:
+                fcntl.lockf(self.fd, fcntl.LOCK_UN, SLOT_SIZE, offset)
+
+
+class RateLimiter:
+    """
+    Per-client token buckets for each costly route.
+
+    Every request takes the route cost (RATE_LIMIT_COSTS) from the bucket
+    of its client and route, and the buckets refill at the client quota
+    (RATE_LIMIT_RATE cost units per second, up to RATE_LIMIT_BURST, or the
+    RATE_LIMIT_<CLIENT>_RATE and RATE_LIMIT_<CLIENT>_BURST overrides). Each
+    client has its own buckets, so a noisy batch client only exhausts its
+    own quota. With RATE_LIMIT_ANONYMOUS=1, requests without API key get a
+    bucket per client address, with the "anonymous" quota; behind a proxy,
+    the address is only the real one when the proxy is trusted
+    (FORWARDED_ALLOW_IPS), otherwise all the users share the proxy bucket.
+    """
+
+    def __init__(self):
+        self.api_keys = get_api_keys()
+        self.api_key_required = get_non_empty_value(
+            "API_KEY_REQUIRED", "0") == "1"
+        self.anonymous_limited = get_non_empty_value(
+            "RATE_LIMIT_ANONYMOUS", "0") == "1"
+        self.costs = {
+            f"/{route}": float(cost)
+            for route, cost in parse_pairs(get_non_empty_value(
+                "RATE_LIMIT_COSTS",
+                "predict=1,similar=1,pdfread=10,batch-jobs=20")).items()
+        }
+        self.default_rate = float(get_non_empty_value("RATE_LIMIT_RATE", "1"))
+        self.default_burst = float(get_non_empty_value(
+            "RATE_LIMIT_BURST", "20"))
+        store_path = os.environ.get("RATE_LIMIT_STORE_PATH")
+        self.store = FileBucketStore(store_path) if store_path \
+            else MemoryBucketStore()
+        self.clock = time.time if store_path else time.monotonic
+        self.quotas = {}
+        self.stats = {}
+
+    def get_quota(self, client: str) -> tuple:
+        """
+        Get the (rate, burst) quota of a client.
+        """
+        quota = self.quotas.get(client)
+        if quota is None:
+            prefix = "RATE_LIMIT_" + client.upper().replace("-", "_")
+            quota = self.quotas[client] = (
+                float(get_non_empty_value(f"{prefix}_RATE",
+                                          str(self.default_rate))),
+                float(get_non_empty_value(f"{prefix}_BURST",
+                                          str(self.default_burst))),
+            )
+        return quota
+
+    def check(self, client: str, bucket_id: str, path: str) -> float:
+        """
+        Take the `path` cost from the client bucket. Returns the seconds to
+        wait before retrying, or 0 if the request is accepted.
+        """
+        rate, burst = self.get_quota(client)
+        # A request costlier than the burst only needs a full bucket
+        cost = min(self.costs[path], burst)
+        wait = self.store.consume(f"{bucket_id}{path}", cost, rate, burst,
+                                  self.clock())
+        stats = self.stats.setdefault(client, {"accepted": 0, "rejected": 0})
+        stats["rejected" if wait else "accepted"] += 1
+        return wait
+
+    def get_stats(self) -> dict:
+        return {
+            "store": self.store.name,
+            "costs": {path.strip("/"): cost
+                      for path, cost in self.costs.items()},
+            "clients": {client: dict(stats)
+                        for client, stats in self.stats.items()},
+        }
+
+
+class RateLimitMiddleware:
+    """
+    ASGI middleware applying the rate limiter to the costly POST routes.
+
+    Clients identify themselves with the X-API-Key header. Unknown keys
+    (or a missing key with API_KEY_REQUIRED=1) get a 401, and requests over
+    the client quota get a 429 with Retry-After.
+    """
+
+    def __init__(self, app, rate_limiter: RateLimiter = None):
+        self.app = app
+        self.rate_limiter = rate_limiter or get_rate_limiter()
+
+    async def __call__(self, scope, receive, send):
+        limiter = self.rate_limiter
+        if scope["type"] != "http" or scope["method"] != "POST" \
+                or scope["path"] not in limiter.costs:
+            await self.app(scope, receive, send)
+            return
+
+        api_key = Headers(scope=scope).get(API_KEY_HEADER)
+        if api_key:
+            client = bucket_id = limiter.api_keys.get(api_key)
+            if client is None:
+                await send_error_response(send, 401, "Invalid API key")
+                return
+        elif limiter.api_key_required:
+            await send_error_response(send, 401, "API key required")
+            return
+        elif not limiter.anonymous_limited:
+            await self.app(scope, receive, send)
+            return
+        else:
+            client = ANONYMOUS_CLIENT
+            address = (scope.get("client") or ("unknown",))[0]
+            bucket_id = f"{ANONYMOUS_CLIENT}:{address}"
+
+        wait = limiter.check(client, bucket_id, scope["path"])
+        if wait:
+            await send_error_response(
+                send, 429, f"Rate limit exceeded for {client}",
+                retry_after=max(1, math.ceil(min(wait, 3600))))
+            return
+        await self.app(scope, receive, send)
+
+
+rate_limiter = None
+rate_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter() -> RateLimiter:
+    global rate_limiter
+    with rate_limiter_lock:
+        if rate_limiter is None:
+            rate_limiter = RateLimiter()
+    return rate_limiter
@@ -0,0 +1,114 @@
+from typing import Any
+
+from fastapi import Request, Response
+from fastapi.responses import JSONResponse
+
+from .compression import (
+    ENCODINGS,
+    compress,
+    get_compression_min_size,
+    negotiate_encoding,
+)
+from .utilities import json_dumps
+
+COMPRESSION_MIN_SIZE = get_compression_min_size()
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    JSON response rendered with orjson (compact, NumPy values included).
+    """
+
+    def render(self, content: Any) -> bytes:
+        return json_dumps(content)
+
+
+def get_encoded_etag(etag: str, encoding: str) -> str:
+    """
+    Get the ETag of an encoded representation ('"abc"' -> '"abc-br"').
+    """
+    return f'{etag[:-1]}-{encoding}"' if encoding else etag
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """
+    Check if the `If-None-Match` header matches the given ETag, in any of
+    its encoded representations.
+    """
+    if not if_none_match:
+        return False
+    etags = {etag} | {
+        get_encoded_etag(etag, encoding) for encoding in ENCODINGS
+    }
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return True
+        # Weak comparison is enough for a GET conditional request
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate in etags:
+            return True
+    return False
+
+
+def get_encoded_body(payload: dict, encoding: str) -> bytes:
+    """
+    Get the payload body compressed with `encoding`, compressing it only
+    once per payload.
+    """
+    encoded_bodies = payload.setdefault("encoded_bodies", {})
+    body = encoded_bodies.get(encoding)
+    if body is None:
+        body = encoded_bodies[encoding] = compress(payload["body"], encoding)
+    return body
+
+
+def get_cached_response(request: Request, payload: dict) -> Response:
+    """
+    Build the response for a pre-serialized payload (see
+    `utilities.get_serialized_payload`), answering 304 Not Modified when
+    the client already has the current version.
+
+    Bodies of COMPRESSION_MIN_SIZE bytes or more are sent compressed as
+    negotiated with Accept-Encoding, and the compressed body is cached
+    with the payload.
+    """
+    encoding = None
+    if 0 < COMPRESSION_MIN_SIZE <= len(payload["body"]):
+        encoding = negotiate_encoding(request.headers.get("accept-encoding"))
+    headers = {
+        "ETag": get_encoded_etag(payload["etag"], encoding),
+        "Cache-Control": "no-cache",
+        "Vary": "Accept-Encoding",
+    }
+    if etag_matches(request.headers.get("if-none-match"), payload["etag"]):
+        return Response(status_code=304, headers=headers)
+    if encoding is None:
+        body = payload["body"]
+    else:
+        body = get_encoded_body(payload, encoding)
+        headers["Content-Encoding"] = encoding
+    return Response(
+        content=body,
+        media_type="application/json",
+        headers=headers,
+    )
+
+
+async def send_error_response(send, status_code: int, message: str,
+                              retry_after: int = None):
+    """
+    Send a JSON error response (`{"detail": message}`, like HTTPException)
+    from an ASGI middleware, with an optional Retry-After header.
+    """
+    body = json_dumps({"detail": message})
+    headers = [
+        (b"content-type", b"application/json"),
+        (b"content-length", str(len(body)).encode()),
+    ]
+    if retry_after is not None:
+        headers.append((b"retry-after", str(retry_after).encode()))
+    await send({"type": "http.response.start", "status": status_code,
+                "headers": headers})
+    await send({"type": "http.response.body", "body": body})
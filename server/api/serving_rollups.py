@@ -0,0 +1,182 @@
+import json
+import sqlite3
+import time
+
+from .latency_sketch import LatencySketch
+
+# Serving rollup table -> bucket size in seconds
+SERVING_ROLLUP_TABLES = {
+    "serving_rollups_minute": 60,
+    "serving_rollups_hourly": 3600,
+}
+# Seconds of per-minute rows kept (older rows are pruned)
+MINUTE_ROLLUP_RETENTION = 86400
+
+SERVING_ROLLUP_SCHEMA = """
+CREATE TABLE IF NOT EXISTS {table} (
+    bucket_start INTEGER NOT NULL,
+    source TEXT NOT NULL,
+    count INTEGER NOT NULL DEFAULT 0,
+    error_count INTEGER NOT NULL DEFAULT 0,
+    processing_time_sum REAL NOT NULL DEFAULT 0,
+    latency_sketch TEXT,
+    PRIMARY KEY (bucket_start, source)
+) WITHOUT ROWID;
+"""
+
+WINDOW_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+def parse_window(window: str) -> int:
+    """
+    Parse a window like "30s", "5m", "1h" or "7d" to seconds.
+    """
+    window = window.strip()
+    try:
+        if window[-1] in WINDOW_UNITS:
+            return int(window[:-1]) * WINDOW_UNITS[window[-1]]
+        return int(window)
+    except (ValueError, IndexError):
+        raise ValueError(f"Invalid window: {window}")
+
+
+def get_endpoint(source: str) -> str:
+    """
+    Get the endpoint of a prediction log source ("api_predict" ->
+    "predict").
+    """
+    return source.rsplit("_", 1)[-1]
+
+
+class ServingRollups:
+    """
+    Per-minute and per-hour serving rollups of the prediction log, by
+    source: request and error counts, processing time sum and a mergeable
+    latency sketch.
+
+    Each worker writes its batches to the shared database, so the windows
+    read from here cover the traffic of all the workers.
+    """
+
+    def __init__(self, prediction_log):
+        self.prediction_log = prediction_log
+        connection = prediction_log.connect()
+        with connection:
+            for table in SERVING_ROLLUP_TABLES:
+                connection.executescript(
+                    SERVING_ROLLUP_SCHEMA.format(table=table))
+        connection.close()
+        prediction_log.add_batch_listener(self.update)
+
+    def update(self, connection: sqlite3.Connection, records: list):
+        """
+        Add a batch of prediction records to the rollups.
+        """
+        for table, bucket_size in SERVING_ROLLUP_TABLES.items():
+            buckets = {}
+            for record in records:
+                key = (int(record["created_at"] // bucket_size)
+                       * bucket_size, record["source"])
+                bucket = buckets.get(key)
+                if bucket is None:
+                    bucket = buckets[key] = {
+                        "count": 0,
+                        "error_count": 0,
+                        "processing_time_sum": 0.0,
+                        "latency_sketch": LatencySketch(),
+                    }
+                bucket["count"] += 1
+                if record["status"] != "success":
+                    bucket["error_count"] += 1
+                bucket["processing_time_sum"] += \
+                    record["processing_time"] or 0
+                bucket["latency_sketch"].add(record["processing_time"])
+
+            for (bucket_start, source), bucket in buckets.items():
+                self.upsert_bucket(connection, table, bucket_start,
+                                   source, bucket)
+
+        connection.execute(
+            "DELETE FROM serving_rollups_minute WHERE bucket_start < ?",
+            [time.time() - MINUTE_ROLLUP_RETENTION])
+
+    def upsert_bucket(self, connection: sqlite3.Connection, table: str,
+                      bucket_start: int, source: str, bucket: dict):
+        row = connection.execute(
+            f"SELECT latency_sketch FROM {table}"
+            " WHERE bucket_start = ? AND source = ?",
+            [bucket_start, source]).fetchone()
+        sketch = bucket["latency_sketch"]
+        if row is not None and row["latency_sketch"]:
+            sketch.merge(LatencySketch.from_dict(
+                json.loads(row["latency_sketch"])))
+        connection.execute(
+            f"INSERT INTO {table} (bucket_start, source, count,"
+            " error_count, processing_time_sum, latency_sketch)"
+            " VALUES (?, ?, ?, ?, ?, ?)"
+            " ON CONFLICT (bucket_start, source) DO UPDATE SET"
+            " count = count + excluded.count,"
+            " error_count = error_count + excluded.error_count,"
+            " processing_time_sum ="
+            " processing_time_sum + excluded.processing_time_sum,"
+            " latency_sketch = excluded.latency_sketch",
+            [bucket_start, source, bucket["count"], bucket["error_count"],
+             bucket["processing_time_sum"],
+             json.dumps(sketch.to_dict(), separators=(",", ":"))])
+
+    def get_window_stats(self, window: int) -> dict:
+        """
+        Get the serving stats of the last `window` seconds, by endpoint
+        ("predict", "pdfread"): request and error counts, throughput
+        (articles per second) and latency percentiles (milliseconds).
+
+        Windows that are a multiple of an hour (or longer than the minute
+        rows retention) are read from the hourly rows, the others from the
+        minute rows.
+        """
+        if window % 3600 == 0 or window > MINUTE_ROLLUP_RETENTION:
+            table = "serving_rollups_hourly"
+        else:
+            table = "serving_rollups_minute"
+        bucket_size = SERVING_ROLLUP_TABLES[table]
+        now = time.time()
+        buckets = max(1, window // bucket_size)
+        since = (int(now // bucket_size) - buckets + 1) * bucket_size
+        # Seconds actually covered by the buckets (the last one is partial)
+        elapsed = max(now - since, 1)
+
+        rows = self.prediction_log.query(
+            f"SELECT source, count, error_count, processing_time_sum,"
+            f" latency_sketch FROM {table} WHERE bucket_start >= ?",
+            [since])
+        endpoints = {}
+        for row in rows:
+            endpoint = endpoints.setdefault(get_endpoint(row["source"]), {
+                "count": 0,
+                "error_count": 0,
+                "processing_time_sum": 0.0,
+                "latency_sketch": LatencySketch(),
+            })
+            endpoint["count"] += row["count"]
+            endpoint["error_count"] += row["error_count"]
+            endpoint["processing_time_sum"] += row["processing_time_sum"]
+            if row["latency_sketch"]:
+                endpoint["latency_sketch"].merge(LatencySketch.from_dict(
+                    json.loads(row["latency_sketch"])))
+
+        result = {}
+        for name, endpoint in endpoints.items():
+            sketch = endpoint["latency_sketch"]
+            result[name] = {
+                "count": endpoint["count"],
+                "error_count": endpoint["error_count"],
+                "articles_per_second": endpoint["count"] / elapsed,
+                "latency_ms": {
+                    key: value * 1000 if value is not None else None
+                    for key, value in {
+                        **sketch.get_percentiles(),
+                        "mean": sketch.mean(),
+                    }.items()
+                },
+            }
+        return result
@@ -0,0 +1,88 @@
+import copy
+import hashlib
+import threading
+from typing import Callable
+
+
+def get_content_hash(*parts) -> str:
+    """
+    Hash the request content (str or bytes parts) into a single-flight
+    key.
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode("utf-8")
+        digest.update(len(part).to_bytes(8, "big"))
+        digest.update(part)
+    return digest.hexdigest()
+
+
+def normalize_text(text: str) -> str:
+    """
+    Normalize the whitespace of a text, so trivially different copies of
+    the same article share the key.
+    """
+    return " ".join((text or "").split())
+
+
+class SingleFlightCall:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.exception = None
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent identical calls: while a call for a key is in
+    flight, the other callers with the same key wait for it and get a
+    copy of its result (or its exception) instead of running the same
+    work again. Nothing is cached after the call finishes.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.total_calls = 0
+        self.executions = 0
+        self.coalesced = 0
+
+    def do(self, key: str, function: Callable):
+        with self.lock:
+            self.total_calls += 1
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = SingleFlightCall()
+                self.executions += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call.done.wait()
+            if call.exception is not None:
+                raise call.exception
+            return copy.deepcopy(call.result)
+
+        try:
+            call.result = function()
+            return call.result
+        except BaseException as e:
+            call.exception = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            return {
+                "calls": self.total_calls,
+                "executions": self.executions,
+                "coalesced": self.coalesced,
+                "coalesced_ratio": self.coalesced / self.total_calls
+                if self.total_calls else 0,
+                "in_flight": len(self.calls),
+            }
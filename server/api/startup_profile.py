@@ -0,0 +1,139 @@
+"""
+Startup timing report.
+
+The server records how long its startup phases take (app import, heavy
+library imports, model load, warm-up), reported by /dashboard/runtime.
+For the import time of each module, run:
+
+    python -m api.startup_profile [--module api.main] [--top 20] [--json]
+
+It imports the module in a fresh interpreter with `-X importtime` and
+breaks the import time down by package and module.
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+import orjson
+
+# Time when the api package started importing (this module is imported
+# first by api.main)
+STARTUP_START_TIME = time.perf_counter()
+
+IMPORT_TIME_LINE = re.compile(
+    r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|\s*(\S+)$")
+
+startup_phases = {}
+startup_phases_lock = threading.Lock()
+
+
+@contextmanager
+def startup_phase(name: str):
+    """
+    Record the time spent in a startup phase (accumulated if the phase
+    runs more than once).
+    """
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_startup_phase(name, time.perf_counter() - start_time)
+
+
+def record_startup_phase(name: str, seconds: float):
+    with startup_phases_lock:
+        startup_phases[name] = startup_phases.get(name, 0) + seconds
+
+
+def get_startup_report() -> dict:
+    """
+    Get the startup phases of this process, in seconds.
+    """
+    with startup_phases_lock:
+        return {name: round(seconds, 4)
+                for name, seconds in startup_phases.items()}
+
+
+def parse_import_times(output: str) -> list:
+    """
+    Parse the `-X importtime` output into (module, self seconds,
+    cumulative seconds) tuples.
+    """
+    imports = []
+    for line in output.splitlines():
+        match = IMPORT_TIME_LINE.match(line)
+        if match:
+            imports.append((match.group(3), int(match.group(1)) / 1e6,
+                            int(match.group(2)) / 1e6))
+    return imports
+
+
+def get_import_report(module: str = "api.main", top: int = 20) -> dict:
+    """
+    Import `module` in a fresh interpreter and get its total import time,
+    the time by top-level package (self times added up) and the slowest
+    modules (cumulative time).
+    """
+    server_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    start_time = time.perf_counter()
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=server_dir, capture_output=True, text=True)
+    wall_time = time.perf_counter() - start_time
+    if process.returncode != 0:
+        raise RuntimeError(
+            f"Importing {module} failed:\n{process.stderr[-2000:]}")
+
+    imports = parse_import_times(process.stderr)
+    packages = {}
+    for name, self_time, _ in imports:
+        package = name.split(".")[0]
+        packages[package] = packages.get(package, 0) + self_time
+    return {
+        "module": module,
+        "wall_time": round(wall_time, 4),
+        "import_time": round(sum(item[1] for item in imports), 4),
+        "packages": {
+            package: round(seconds, 4)
+            for package, seconds in sorted(
+                packages.items(), key=lambda item: -item[1])[:top]
+        },
+        "modules": {
+            name: round(cumulative_time, 4)
+            for name, _, cumulative_time in sorted(
+                imports, key=lambda item: -item[2])[:top]
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Report the import time of the server modules")
+    parser.add_argument("--module", default="api.main",
+                        help="module to import (default: api.main)")
+    parser.add_argument("--top", type=int, default=20,
+                        help="number of packages and modules to list")
+    parser.add_argument("--json", action="store_true",
+                        help="print the report as JSON")
+    args = parser.parse_args()
+
+    report = get_import_report(args.module, args.top)
+    if args.json:
+        print(orjson.dumps(report, option=orjson.OPT_INDENT_2).decode())
+        return
+    print(f"Import of {report['module']}: {report['import_time']:.3f}s"
+          f" ({report['wall_time']:.3f}s with the interpreter start)")
+    for title, key in (("By package (self time)", "packages"),
+                       ("By module (cumulative time)", "modules")):
+        print(f"\n{title}:")
+        for name, seconds in report[key].items():
+            print(f"  {seconds:8.3f}s  {name}")
+
+
+if __name__ == "__main__":
+    main()
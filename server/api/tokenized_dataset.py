@@ -0,0 +1,336 @@
+"""
+Pre-tokenized dataset cache of the challenge data.
+
+The articles are read once, normalized (title and abstract joined, with
+their whitespace collapsed), tokenized and saved as memory-mappable
+columns, sorted by token length:
+
+- input_ids.npy: the tokens of all the articles, one after the other
+- offsets.npy: where the tokens of each article start (and end)
+- source_index.npy: the index of each article in the CSV (the dataset
+  indexes, used by the splits)
+- targets.npy: the multi-hot labels
+
+The cache key covers the data file content, the tokenizer (vocabulary,
+normalization and pre-tokenization rules, library versions), the text
+normalization, the max length and the labels: any change builds a new
+cache and removes the stale one. The training, distillation and
+evaluation runs get padded batches of tokens, without tokenizing again:
+
+    python -m api.tokenized_dataset [--max-length 256] [--evaluate]
+"""
+import argparse
+import csv
+import fcntl
+import hashlib
+import json
+import os
+import random
+import shutil
+import time
+
+import numpy as np
+
+from .ml_models import DEFAULT_LABELS
+from .single_flight import normalize_text
+from .utilities import get_non_empty_value, log_info
+
+DEFAULT_DATA_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__)))),
+    "data", "raw", "challenge_data.csv")
+DEFAULT_TOKENIZED_DATASET_DIR = "/code/data/tokenized"
+# Bumped when the cache layout changes
+CACHE_FORMAT = 1
+# Text normalization of the articles (part of the cache key)
+NORMALIZATION = {"text": "title abstract", "whitespace": "collapse"}
+MANIFEST_FILE = "manifest.json"
+TOKENIZE_CHUNK_SIZE = 1000
+
+
+def load_dataset(data_path: str, labels: list) -> tuple:
+    """
+    Read the challenge data (";" separated `title`, `abstract` and `group`,
+    with "|" separated labels). Returns the texts and the multi-hot
+    labels.
+    """
+    texts = []
+    targets = []
+    with open(data_path, newline="", encoding="utf-8") as file:
+        for row in csv.DictReader(file, delimiter=";"):
+            groups = (row.get("group") or "").split("|")
+            if not row.get("title") and not row.get("abstract"):
+                continue
+            if not all(group in labels for group in groups):
+                continue
+            texts.append(normalize_text(
+                f"{row.get('title') or ''} {row.get('abstract') or ''}"))
+            targets.append([float(label in groups) for label in labels])
+    return texts, np.asarray(targets, dtype=np.float32)
+
+
+def split_dataset(size: int, eval_fraction: float, seed: int) -> tuple:
+    """
+    Get the (shuffled) train and evaluation indexes.
+    """
+    indexes = list(range(size))
+    random.Random(seed).shuffle(indexes)
+    eval_size = int(size * eval_fraction)
+    return indexes[eval_size:], indexes[:eval_size]
+
+
+def get_file_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def get_tokenizer_fingerprint(tokenizer) -> str:
+    """
+    Hash what decides the tokens of a tokenizer: its class, vocabulary,
+    normalization and pre-tokenization rules, and the library versions.
+    """
+    import transformers
+
+    parts = [type(tokenizer).__name__, transformers.__version__,
+             json.dumps(tokenizer.model_input_names)]
+    backend = getattr(tokenizer, "backend_tokenizer", None)
+    if backend is not None:
+        import tokenizers
+        state = json.loads(backend.to_str())
+        # Set by the calls, not part of the tokenizer
+        state.pop("truncation", None)
+        state.pop("padding", None)
+        parts += [tokenizers.__version__,
+                  json.dumps(state, sort_keys=True)]
+    else:
+        parts += [json.dumps(sorted(tokenizer.get_vocab().items())),
+                  json.dumps(tokenizer.init_kwargs, sort_keys=True,
+                             default=str)]
+    return hashlib.sha256("\n".join(parts).encode("utf-8")).hexdigest()
+
+
+class TokenizedDataset:
+    """
+    Tokenized dataset read from its cache directory, with the columns
+    memory-mapped.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, MANIFEST_FILE)) as file:
+            self.manifest = json.load(file)
+        columns = {
+            name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")
+            for name in ("input_ids", "offsets", "source_index", "targets")
+        }
+        self.input_ids = columns["input_ids"]
+        self.offsets = columns["offsets"]
+        # Row of the cache of each dataset index
+        self.rows = np.empty(len(columns["source_index"]), dtype=np.int64)
+        self.rows[columns["source_index"]] = np.arange(len(self.rows))
+        self.lengths = np.diff(self.offsets)[self.rows]
+        self.targets = np.asarray(columns["targets"])[self.rows]
+        self.pad_token_id = self.manifest["pad_token_id"]
+        self.input_names = self.manifest["input_names"]
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def get_tokens(self, index: int) -> np.ndarray:
+        row = self.rows[index]
+        return self.input_ids[self.offsets[row]:self.offsets[row + 1]]
+
+    def get_batch(self, indexes: list) -> dict:
+        """
+        Get the padded model inputs (torch tensors) of dataset indexes.
+        """
+        import torch
+
+        length = int(self.lengths[indexes].max())
+        input_ids = np.full((len(indexes), length), self.pad_token_id,
+                            dtype=np.int64)
+        attention_mask = np.zeros((len(indexes), length), dtype=np.int64)
+        for position, index in enumerate(indexes):
+            tokens = self.get_tokens(index)
+            input_ids[position, :len(tokens)] = tokens
+            attention_mask[position, :len(tokens)] = 1
+        inputs = {"input_ids": torch.from_numpy(input_ids),
+                  "attention_mask": torch.from_numpy(attention_mask)}
+        if "token_type_ids" in self.input_names:
+            inputs["token_type_ids"] = torch.zeros_like(inputs["input_ids"])
+        return inputs
+
+    def iter_batches(self, indexes: list, batch_size: int):
+        """
+        Iterate over the batches of dataset indexes in token length
+        order (the least padding). Yields the positions of the batch in
+        `indexes` and its model inputs.
+        """
+        order = np.argsort(self.lengths[indexes], kind="stable")
+        for start in range(0, len(order), batch_size):
+            positions = order[start:start + batch_size]
+            yield positions, self.get_batch(
+                [indexes[position] for position in positions])
+
+
+def build_tokenized_dataset(data_path: str, tokenizer, labels: list,
+                            max_length: int, path: str, manifest: dict):
+    """
+    Tokenize the dataset and write its cache columns in `path`, sorted by
+    token length.
+    """
+    start_time = time.perf_counter()
+    texts, targets = load_dataset(data_path, labels)
+    tokens = []
+    for start in range(0, len(texts), TOKENIZE_CHUNK_SIZE):
+        tokens += tokenizer(texts[start:start + TOKENIZE_CHUNK_SIZE],
+                            truncation=True, max_length=max_length,
+                            return_attention_mask=False,
+                            return_token_type_ids=False)["input_ids"]
+    lengths = np.asarray([len(item) for item in tokens], dtype=np.int64)
+    order = np.argsort(lengths, kind="stable")
+    offsets = np.zeros(len(tokens) + 1, dtype=np.int64)
+    np.cumsum(lengths[order], out=offsets[1:])
+    input_ids = np.fromiter(
+        (token for index in order for token in tokens[index]),
+        dtype=np.int32, count=int(offsets[-1]))
+
+    os.makedirs(path)
+    np.save(os.path.join(path, "input_ids.npy"), input_ids)
+    np.save(os.path.join(path, "offsets.npy"), offsets)
+    np.save(os.path.join(path, "source_index.npy"), order)
+    np.save(os.path.join(path, "targets.npy"), targets.reshape(
+        len(texts), len(labels))[order])
+    with open(os.path.join(path, MANIFEST_FILE), "w") as file:
+        json.dump({
+            **manifest,
+            "created_at": time.time(),
+            "articles": len(texts),
+            "tokens": int(offsets[-1]),
+            "truncated": int((lengths >= max_length).sum()),
+            "pad_token_id": tokenizer.pad_token_id or 0,
+            "input_names": list(tokenizer.model_input_names),
+            "build_time": time.perf_counter() - start_time,
+        }, file, indent=2)
+
+
+def get_tokenized_dataset(data_path: str, tokenizer, max_length: int,
+                          labels: list = None,
+                          cache_dir: str = None) -> TokenizedDataset:
+    """
+    Get the tokenized dataset from the cache, built on the first use and
+    whenever the data, the tokenizer or the settings change (the stale
+    caches of the data file are removed). The processes building the same
+    cache wait for the first one.
+    """
+    labels = labels or list(DEFAULT_LABELS)
+    cache_dir = cache_dir or get_non_empty_value(
+        "TOKENIZED_DATASET_DIR", DEFAULT_TOKENIZED_DATASET_DIR)
+    data_path = os.path.abspath(data_path)
+    manifest = {
+        "format": CACHE_FORMAT,
+        "data_path": data_path,
+        "data_hash": get_file_hash(data_path),
+        "tokenizer": getattr(tokenizer, "name_or_path", None),
+        "tokenizer_fingerprint": get_tokenizer_fingerprint(tokenizer),
+        "normalization": NORMALIZATION,
+        "max_length": max_length,
+        "labels": labels,
+    }
+    key = hashlib.sha256(json.dumps(manifest, sort_keys=True)
+                         .encode("utf-8")).hexdigest()[:16]
+    name = os.path.splitext(os.path.basename(data_path))[0]
+    path = os.path.join(cache_dir, f"{name}-{key}")
+
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(os.path.join(cache_dir, f"{name}.lock"), "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        if not os.path.isfile(os.path.join(path, MANIFEST_FILE)):
+            # Written aside and renamed, so a cache is never seen
+            # half-written
+            temp_path = f"{path}.{os.getpid()}.tmp"
+            shutil.rmtree(temp_path, ignore_errors=True)
+            build_tokenized_dataset(data_path, tokenizer, labels,
+                                    max_length, temp_path, manifest)
+            os.rename(temp_path, path)
+            log_info(f"Tokenized dataset cache built: {path}")
+            for entry in os.listdir(cache_dir):
+                stale_path = os.path.join(cache_dir, entry)
+                if entry.startswith(f"{name}-") and stale_path != path \
+                        and is_cache_of(stale_path, data_path):
+                    shutil.rmtree(stale_path, ignore_errors=True)
+                    log_info(f"Stale tokenized dataset cache removed:"
+                             f" {stale_path}")
+    return TokenizedDataset(path)
+
+
+def is_cache_of(path: str, data_path: str) -> bool:
+    try:
+        with open(os.path.join(path, MANIFEST_FILE)) as file:
+            return json.load(file).get("data_path") == data_path
+    except (OSError, ValueError):
+        return False
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Build the tokenized dataset cache, and optionally"
+                    " evaluate the served model on it")
+    parser.add_argument(
+        "--tokenizer",
+        default=get_non_empty_value("BASE_MODEL_NAME",
+                                    "dmis-lab/biobert-v1.1"),
+        help="tokenizer name or path (default: BASE_MODEL_NAME)")
+    parser.add_argument("--data", default=DEFAULT_DATA_PATH,
+                        help="challenge data CSV")
+    parser.add_argument("--max-length", type=int, default=256,
+                        help="max tokens per article (default: 256)")
+    parser.add_argument(
+        "--evaluate", action="store_true",
+        help="evaluate the model configured by the environment (see"
+             " MLModels) on the dataset")
+    parser.add_argument("--limit", type=int,
+                        help="evaluate only the first N articles")
+    args = parser.parse_args()
+
+    from transformers import AutoTokenizer
+
+    ml_model = None
+    labels = None
+    if args.evaluate:
+        from .ml_models import MLModels
+
+        # Tokenized with the tokenizer of the model (e.g. a snapshot one)
+        ml_model = MLModels()
+        if ml_model.model is None:
+            raise SystemExit("The model could not be loaded")
+        tokenizer = ml_model.tokenizer
+        labels = ml_model.labels
+    else:
+        tokenizer = AutoTokenizer.from_pretrained(args.tokenizer)
+
+    start_time = time.perf_counter()
+    dataset = get_tokenized_dataset(args.data, tokenizer, args.max_length,
+                                    labels)
+    manifest = dataset.manifest
+    print(f"Tokenized dataset: {dataset.path}")
+    print(f"  {manifest['articles']} articles, {manifest['tokens']} tokens"
+          f" (mean {manifest['tokens'] / max(1, manifest['articles']):.1f},"
+          f" {manifest['truncated']} truncated at {args.max_length})")
+    print(f"  built in {manifest['build_time']:.2f}s,"
+          f" loaded in {time.perf_counter() - start_time:.2f}s")
+
+    if ml_model is not None:
+        from .distillation import evaluate
+
+        indexes = list(range(min(args.limit or len(dataset),
+                                 len(dataset))))
+        metrics = evaluate(ml_model.model.eval(), dataset, indexes, labels)
+        print(json.dumps(metrics, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -7,6 +7,12 @@ class Article(BaseModel):
     abstract: str
 
 
+# Define the feedback request model
+class Feedback(BaseModel):
+    prediction_id: int
+    category: str
+
+
 # Define the prediction response model
 class Prediction(BaseModel):
     label: str
@@ -44,3 +50,15 @@ class Metrics(BaseModel):
     training_metrics: list[TrainingMetric]
     summary: TrainingSummary
     training_output: TrainingOutput
+
+
+# Define the model registry request models
+class ModelVersionSpec(BaseModel):
+    name: str
+    source: str
+    path: str | None = None
+
+
+class ShadowConfig(BaseModel):
+    name: str | None = None
+    sample_rate: float = 0.1
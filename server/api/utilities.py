@@ -1,7 +1,10 @@
 import os
+import hashlib
 from datetime import datetime
 from uuid import uuid4
 
+import orjson
+
 SERVER_DEBUG = os.environ.get("SERVER_DEBUG", "0") == "1"
 
 
@@ -87,6 +90,28 @@ def get_standard_response(
     }
 
 
+def json_dumps(data) -> bytes:
+    """
+    Serialize to compact JSON bytes with orjson (NumPy values included).
+    """
+    return orjson.dumps(
+        data, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+
+
+def get_serialized_payload(data) -> dict:
+    """
+    Serialize the data once and compute its strong ETag, so it can be
+    served many times without re-encoding it.
+    """
+    body = json_dumps(data)
+    etag = '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+    return {
+        "data": data,
+        "body": body,
+        "etag": etag,
+    }
+
+
 def log_info(message: str):
     """
     Log information message
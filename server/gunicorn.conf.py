@@ -0,0 +1,52 @@
+"""
+Gunicorn configuration of the production API server (pre-fork workers).
+
+    gunicorn -c gunicorn.conf.py api.main:app
+
+The classification model is loaded once in the master process, before
+the workers are forked, so they share its weights (copy-on-write). The
+rest of the app (threads, SQLite connections) is imported by each worker
+after the fork. Each worker runs a warm-up inference before /ready
+reports it ready, and is recycled after GUNICORN_MAX_REQUESTS requests.
+"""
+import multiprocessing
+import os
+
+# Tokenizers must not use their thread pool across the fork
+os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+
+bind = f"0.0.0.0:{os.environ.get('PORT') or '8000'}"
+worker_class = "uvicorn_worker.UvicornWorker"
+workers = int(os.environ.get("WEB_CONCURRENCY")
+              or min(4, multiprocessing.cpu_count()))
+
+# Graceful worker recycling (the jitter avoids restarting all the workers
+# at the same time)
+max_requests = int(os.environ.get("GUNICORN_MAX_REQUESTS") or 2000)
+max_requests_jitter = int(os.environ.get("GUNICORN_MAX_REQUESTS_JITTER")
+                          or max_requests // 10)
+graceful_timeout = int(os.environ.get("GUNICORN_GRACEFUL_TIMEOUT") or 30)
+timeout = int(os.environ.get("GUNICORN_TIMEOUT") or 120)
+keepalive = 5
+# Proxies trusted to set X-Forwarded-For (the client address of the
+# requests, used by the anonymous rate limits)
+forwarded_allow_ips = os.environ.get("FORWARDED_ALLOW_IPS") or "127.0.0.1,::1"
+
+accesslog = "-"
+errorlog = "-"
+
+
+def on_starting(server):
+    # Load the model in the master, before any worker is forked
+    from api.ml_models import get_ml_model
+    get_ml_model()
+    server.log.info("Model preloaded in the master process")
+
+
+def post_fork(server, worker):
+    # Share the CPU cores among the workers instead of oversubscribing them
+    torch_threads = int(os.environ.get("TORCH_NUM_THREADS") or max(
+        1, multiprocessing.cpu_count() // server.cfg.workers))
+    import torch
+    torch.set_num_threads(torch_threads)
+    server.log.info(f"Worker {worker.pid}: {torch_threads} torch threads")